@@ -64,6 +64,41 @@ async def create_indexes():
     await db.kyc_submissions.create_index("user_id")
     await db.kyc_submissions.create_index("status")
     
+    # KYC analysis jobs indexes
+    await db.kyc_analysis_jobs.create_index("id", unique=True)
+    await db.kyc_analysis_jobs.create_index([("status", 1), ("available_at", 1)])
+    await db.kyc_analysis_jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+    await db.kyc_analysis_jobs.create_index("kyc_id")
+    
+    # KYC analysis cache indexes (TTL: entry bị xóa khi quá expires_at)
+    await db.kyc_analysis_cache.create_index(
+        [("content_hash", 1), ("id_type", 1), ("analyzer_version", 1)], unique=True
+    )
+    await db.kyc_analysis_cache.create_index("expires_at", expireAfterSeconds=0)
+    
+    # KYC image hash indexes (multi-index hashing: một index cho mỗi chunk pHash)
+    await db.kyc_image_hashes.create_index("file_id", unique=True)
+    await db.kyc_image_hashes.create_index("kyc_id")
+    for i in range(4):
+        await db.kyc_image_hashes.create_index(f"p{i}")
+    
+    # KYC analysis metrics indexes (histogram theo ngày / stage / resolution)
+    await db.kyc_analysis_metrics.create_index([("day", 1), ("stage", 1), ("resolution", 1)], unique=True)
+    
+    # KYC file store indexes (metadata file, dedup theo nội dung)
+    await db.kyc_files.create_index("file_id", unique=True)
+    await db.kyc_files.create_index("content_hash")
+    await db.kyc_files.create_index("blob_key", sparse=True)
+    
+    # KYC upload session indexes (resumable upload, GC theo expires_at)
+    await db.kyc_upload_sessions.create_index("id", unique=True)
+    await db.kyc_upload_sessions.create_index([("user_id", 1), ("status", 1)])
+    await db.kyc_upload_sessions.create_index("expires_at")
+    
+    # KYC feature vector indexes (re-scoring khi đổi ngưỡng)
+    await db.kyc_feature_vectors.create_index("file_id", unique=True)
+    await db.kyc_feature_vectors.create_index("kyc_id")
+    
     # Audit logs indexes
     await db.audit_logs.create_index("user_id")
     await db.audit_logs.create_index("action")
@@ -0,0 +1,296 @@
+"""KYC analysis worker
+Lấy job từ kyc_analysis_jobs, phân tích ảnh và ghi kết quả / auto-approval
+vào kyc_submissions.
+
+Chạy từ thư mục backend:
+    python -m kyc_worker --processes 4 --concurrency 2
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from database import db, client
+from middleware import log_audit
+from models import SystemSettings
+from utils.analysis_executor import AnalysisExecutor, KYC_ANALYSIS_WORKERS
+from utils.kyc_analysis_cache import get_cached_results, store_result, trim_cache
+from utils.kyc_analyzer import analyzer_version
+from utils.kyc_features import store_feature_vectors
+from utils.kyc_file_store import read_blob, document_crop_temp_path, store_document_crop
+from utils.kyc_thumbnails import generate_thumbnails
+from utils.kyc_metrics import record_stage_timings
+from utils.kyc_upload_sessions import gc_upload_sessions
+from utils.perceptual_index import index_image_hash
+from utils.kyc_jobs import (
+    KYC_JOB_LEASE_SECONDS, JOB_DEAD,
+    lease_next_job, extend_lease, complete_job, fail_job, dead_letter_expired_jobs
+)
+from utils.telegram_service import telegram_service
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("kyc_worker")
+
+# Chu kỳ dọn analysis cache / upload session hết hạn (giây), một task mỗi process
+KYC_WORKER_MAINTENANCE_INTERVAL = float(os.getenv("KYC_WORKER_MAINTENANCE_INTERVAL", 60))
+
+
+async def _heartbeat(job: Dict, lease_seconds: int):
+    """Gia hạn lease định kỳ trong lúc job đang chạy"""
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        if not await extend_lease(db, job, lease_seconds):
+            logger.warning(f"Lost lease on job {job['id']}")
+            return
+
+
+def _read_file(path: str) -> Optional[bytes]:
+    """Đọc qua storage backend (disk local hoặc S3)"""
+    try:
+        return read_blob(path)
+    except Exception as e:
+        logger.error(f"Cannot read KYC file {path}: {e}")
+        return None
+
+
+async def _notify(job: Dict, user: Dict, auto_approved: bool, images_data: List[bytes]):
+    """Gửi thông báo + ảnh KYC qua Telegram (lỗi không làm fail job)
+
+    images_data: nội dung các ảnh đã đọc khi phân tích, không đọc lại từ disk
+    """
+    try:
+        await telegram_service.send_kyc_notification(
+            user_email=user.get('email', 'N/A'),
+            user_name=user.get('username', 'N/A'),
+            kyc_id=job['kyc_id'],
+            status='auto-approved' if auto_approved else 'pending review'
+        )
+
+        if images_data:
+            await telegram_service.send_kyc_images(
+                user_email=user.get('email', 'N/A'),
+                user_name=user.get('username', 'N/A'),
+                images=images_data,
+                id_type=job['id_type']
+            )
+    except Exception as e:
+        logger.error(f"Failed to send Telegram notification: {e}")
+
+
+async def _load_settings() -> SystemSettings:
+    settings = await db.system_settings.find_one({"id": "system_settings"}, {"_id": 0})
+    return SystemSettings(**settings) if settings else SystemSettings()
+
+
+async def process_job(job: Dict, executor: AnalysisExecutor):
+    """Phân tích các file của submission và ghi kết quả"""
+    # Skip PDF files for now (image analysis only)
+    image_files = [f for f in job['files'] if not f['path'].lower().endswith('.pdf')]
+
+    # Đọc mỗi file đúng một lần: cùng buffer dùng cho phân tích và Telegram
+    contents = await asyncio.gather(*[asyncio.to_thread(_read_file, f['path']) for f in image_files])
+    content_by_id = {f['file_id']: content for f, content in zip(image_files, contents)}
+
+    # File upload thẳng lên object storage chưa có thumbnail (đã có thì chỉ kiểm tra tồn tại)
+    for f, content in zip(image_files, contents):
+        if content and f.get('sha256'):
+            await asyncio.to_thread(generate_thumbnails, content, f['sha256'])
+
+    # File đã phân tích trước đó (cùng nội dung) lấy từ cache, không decode lại
+    version = analyzer_version()
+    cached = await get_cached_results(
+        db, [f['sha256'] for f in image_files if f.get('sha256')], job['id_type'], version
+    )
+    results_by_id = {f['file_id']: cached[f['sha256']] for f in image_files if f.get('sha256') in cached}
+    misses = [f for f in image_files if f['file_id'] not in results_by_id]
+    if results_by_id:
+        logger.info(f"KYC {job['kyc_id']}: {len(results_by_id)} file(s) served from analysis cache")
+
+    fresh_results = await executor.validate_documents(
+        # File không đọc được: truyền path để analyzer trả về lỗi như cũ
+        [content_by_id[f['file_id']] or f['path'] for f in misses], job['id_type'],
+        # Crop ghi ra file tạm rồi đưa vào storage theo hash nội dung (file cũ không có hash: bỏ qua)
+        crop_paths=[document_crop_temp_path() if f.get('sha256') else None for f in misses]
+    )
+    for file, validation_result in zip(misses, fresh_results):
+        results_by_id[file['file_id']] = validation_result
+        if file.get('sha256'):
+            await asyncio.to_thread(store_document_crop, validation_result, file['sha256'])
+            await store_result(db, file['sha256'], job['id_type'], version, validation_result)
+        resolution = validation_result.get('quality_analysis', {}).get('resolution', {})
+        await record_stage_timings(db, validation_result.get('timings_ms'), resolution.get('width'), resolution.get('height'))
+    validation_results = [results_by_id[f['file_id']] for f in image_files]
+
+    analysis_results = []
+    overall_validation_score = 0
+    for file, validation_result in zip(image_files, validation_results):
+        analysis_results.append({
+            'file_id': file['file_id'],
+            'analysis': validation_result
+        })
+        overall_validation_score += validation_result.get('validation_score', 0)
+
+    # Calculate average validation score
+    if analysis_results:
+        overall_validation_score = overall_validation_score / len(analysis_results)
+
+    # Determine auto-approval (cùng SystemSettings với scripts/rescore_kyc.py --apply)
+    settings = await _load_settings()
+    auto_approved = (settings.kyc_auto_approval_enabled
+                     and overall_validation_score >= settings.kyc_auto_approval_threshold)
+    requires_review = not auto_approved
+
+    now = datetime.now(timezone.utc).isoformat()
+    update = {
+        'analysis': {
+            'validation_score': round(overall_validation_score, 2),
+            'auto_approved': auto_approved,
+            'requires_manual_review': requires_review,
+            'file_analyses': analysis_results,
+            'analyzed_at': now
+        },
+        'status': 'approved' if auto_approved else 'pending',
+        'perceptual_hashes': [
+            {'file_id': file['file_id'], **result['perceptual_hash']}
+            for file, result in zip(image_files, validation_results) if result.get('perceptual_hash')
+        ]
+    }
+    if auto_approved:
+        update['reviewed_at'] = now
+        update['admin_note'] = 'Automatically approved based on quality analysis'
+
+    # Chỉ ghi khi submission còn 'analyzing' (job có thể bị chạy lại sau khi hết lease)
+    result = await db.kyc_submissions.update_one(
+        {'id': job['kyc_id'], 'status': 'analyzing'},
+        {'$set': update}
+    )
+    if result.modified_count == 0:
+        logger.info(f"KYC {job['kyc_id']} already finalized, skipping")
+        return
+
+    for entry in update['perceptual_hashes']:
+        await index_image_hash(db, entry['file_id'], job['kyc_id'], job['user_id'], entry)
+    await store_feature_vectors(
+        db, job['kyc_id'], job['id_type'],
+        [(file['file_id'], result) for file, result in zip(image_files, validation_results)], version
+    )
+
+    await db.users.update_one(
+        {'id': job['user_id']},
+        {'$set': {'kyc_status': 'verified' if auto_approved else 'pending'}}
+    )
+
+    await log_audit(
+        db, job['user_id'], "kyc_analyzed",
+        {
+            "kyc_id": job['kyc_id'],
+            "validation_score": round(overall_validation_score, 2),
+            "auto_approved": auto_approved
+        }
+    )
+
+    user = await db.users.find_one({'id': job['user_id']}, {'_id': 0, 'email': 1, 'username': 1}) or {}
+    await _notify(job, user, auto_approved, [content for content in contents if content])
+
+
+async def _send_to_manual_review(kyc_id: str, error: str):
+    """Job dead-letter: chuyển submission sang admin duyệt tay"""
+    await db.kyc_submissions.update_one(
+        {'id': kyc_id, 'status': 'analyzing'},
+        {'$set': {
+            'status': 'pending',
+            'analysis': {
+                'validation_score': 0,
+                'auto_approved': False,
+                'requires_manual_review': True,
+                'error': error,
+                'analyzed_at': datetime.now(timezone.utc).isoformat()
+            }
+        }}
+    )
+
+
+async def worker_loop(worker_id: str, executor: AnalysisExecutor, stop: asyncio.Event,
+                      poll_interval: float, lease_seconds: int):
+    while not stop.is_set():
+        for expired in await dead_letter_expired_jobs(db):
+            logger.error(f"Job {expired['id']} dead-lettered after lease expiry")
+            await _send_to_manual_review(expired['kyc_id'], 'Analysis failed: lease expired too many times')
+
+        job = await lease_next_job(db, worker_id, lease_seconds)
+        if not job:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        logger.info(f"Processing job {job['id']} (kyc {job['kyc_id']}, attempt {job['attempts']})")
+        heartbeat = asyncio.create_task(_heartbeat(job, lease_seconds))
+        try:
+            await process_job(job, executor)
+            await complete_job(db, job)
+        except Exception as e:
+            logger.exception(f"Job {job['id']} failed")
+            new_status = await fail_job(db, job, str(e))
+            if new_status == JOB_DEAD:
+                await _send_to_manual_review(job['kyc_id'], f"Analysis failed: {e}")
+        finally:
+            heartbeat.cancel()
+
+
+async def maintenance_loop(stop: asyncio.Event, interval: float):
+    """Dọn analysis cache và upload session hết hạn, tách khỏi vòng poll job"""
+    while not stop.is_set():
+        try:
+            await trim_cache(db)
+            await gc_upload_sessions(db)
+        except Exception:
+            logger.exception("KYC worker maintenance failed")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="KYC analysis worker")
+    parser.add_argument("--processes", type=int, default=KYC_ANALYSIS_WORKERS,
+                        help="OpenCV processes used by this worker")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Jobs processed concurrently")
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("KYC_WORKER_POLL_INTERVAL", 1.0)))
+    parser.add_argument("--lease-seconds", type=int, default=KYC_JOB_LEASE_SECONDS)
+    parser.add_argument("--maintenance-interval", type=float, default=KYC_WORKER_MAINTENANCE_INTERVAL)
+    args = parser.parse_args()
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    executor = AnalysisExecutor(max_workers=args.processes, max_queue=args.processes * args.concurrency * 8)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"KYC worker {worker_id} started ({args.processes} processes, concurrency {args.concurrency})")
+    try:
+        await asyncio.gather(*[
+            worker_loop(worker_id, executor, stop, args.poll_interval, args.lease_seconds)
+            for _ in range(args.concurrency)
+        ], maintenance_loop(stop, args.maintenance_interval))
+    finally:
+        executor.shutdown()
+        client.close()
+        logger.info(f"KYC worker {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
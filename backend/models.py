@@ -270,11 +270,29 @@ class KYCSubmission(BaseModel):
     user_id: str
     id_type: str
     file_ids: List[str] = Field(default_factory=list)
-    status: str = "pending"  # pending, approved, rejected
+    # file_id -> SHA-256 nội dung (key của thumbnail / analysis cache)
+    file_hashes: Dict[str, str] = Field(default_factory=dict)
+    status: str = "pending"  # analyzing, pending, approved, rejected
     admin_note: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     reviewed_at: Optional[datetime] = None
 
+class KYCUploadSessionCreate(BaseModel):
+    """Tạo upload session resumable cho một file KYC"""
+    filename: str
+    size: int = Field(gt=0)  # Tổng kích thước file (bytes)
+
+class KYCDirectUploadCreate(BaseModel):
+    """Upload một file KYC thẳng lên object storage qua presigned URL"""
+    filename: str
+    size: int = Field(gt=0)
+    sha256: str = Field(pattern=r"^[0-9a-f]{64}$")  # SHA-256 (hex) client tính trước khi upload
+
+class KYCUploadFinalize(BaseModel):
+    """Gộp các upload session đã hoàn tất thành một KYC submission"""
+    id_type: str
+    upload_ids: List[str] = Field(min_length=1)
+
 # ============ AUDIT LOG MODELS ============
 
 class AuditLog(BaseModel):
@@ -1,18 +1,27 @@
 """Enhanced KYC Management Routes with Analytics and Timeline"""
 from fastapi import APIRouter, HTTPException, status, Depends, Request, Query
+from fastapi.responses import FileResponse, RedirectResponse, Response
 from models import MessageResponse
 from middleware import get_current_admin_user, log_audit
 from database import get_db
 from typing import Dict, Optional, List
 from datetime import datetime, timezone, timedelta
 from collections import defaultdict
+import asyncio
 import os
-from pathlib import Path
+import sys
 
-router = APIRouter(prefix="/admin/kyc", tags=["Admin KYC"])
+sys.path.append('/app/backend')
+from utils.perceptual_index import HASH_COLLECTION, MAX_SEARCH_DISTANCE, find_similar_images
+from utils.kyc_metrics import get_stage_histograms
+from utils.kyc_thumbnails import THUMBNAIL_SIZES, is_content_hash, thumbnail_key, generate_thumbnails
+from utils.kyc_file_store import FILE_COLLECTION, document_crop_key, get_file, record_key
+from utils.kyc_storage import get_storage
+from utils.kyc_file_response import (
+    MEDIA_TYPES, RangeFileResponse, RangeNotSatisfiable, file_etag, parse_range
+)
 
-UPLOAD_DIR = Path("/app/backend/uploads/kyc")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+router = APIRouter(prefix="/admin/kyc", tags=["Admin KYC"])
 
 # ============ KYC STATISTICS ============
 
@@ -131,6 +140,20 @@ async def get_kyc_statistics(
         }
     }
 
+# ============ ANALYZER PERFORMANCE ============
+
+@router.get("/analyzer-metrics")
+async def get_kyc_analyzer_metrics(
+    current_admin: Dict = Depends(get_current_admin_user),
+    db = Depends(get_db),
+    days: int = Query(7, ge=1, le=90)
+):
+    """Get per-stage analyzer latency histograms by resolution bucket"""
+    return {
+        'days': days,
+        'stages': await get_stage_histograms(db, days)
+    }
+
 # ============ KYC TIMELINE ============
 
 @router.get("/timeline/{kyc_id}")
@@ -211,6 +234,61 @@ async def get_kyc_timeline(
         'timeline': timeline
     }
 
+# ============ NEAR-DUPLICATE DETECTION ============
+
+@router.get("/{kyc_id}/similar")
+async def get_similar_kyc_submissions(
+    kyc_id: str,
+    max_distance: int = Query(6, ge=0, le=MAX_SEARCH_DISTANCE),
+    limit: int = Query(20, ge=1, le=100),
+    current_admin: Dict = Depends(get_current_admin_user),
+    db = Depends(get_db)
+):
+    """Find submissions whose images are within max_distance bits (pHash) of this submission"""
+    
+    kyc = await db.kyc_submissions.find_one({"id": kyc_id}, {"_id": 0, "user_id": 1})
+    if not kyc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="KYC submission not found"
+        )
+    
+    hashes = await db[HASH_COLLECTION].find(
+        {"kyc_id": kyc_id},
+        {"_id": 0, "file_id": 1, "phash": 1}
+    ).to_list(100)
+    
+    # Gộp theo submission, giữ cặp file gần nhất
+    similar = {}
+    for entry in hashes:
+        for match in await find_similar_images(db, entry['phash'], max_distance, exclude_kyc_id=kyc_id, limit=limit):
+            current = similar.get(match['kyc_id'])
+            if current is None or match['distance'] < current['distance']:
+                similar[match['kyc_id']] = {
+                    'kyc_id': match['kyc_id'],
+                    'user_id': match['user_id'],
+                    'file_id': entry['file_id'],
+                    'matched_file_id': match['file_id'],
+                    'distance': match['distance'],
+                    'same_user': match['user_id'] == kyc['user_id']
+                }
+    
+    results = sorted(similar.values(), key=lambda item: item['distance'])[:limit]
+    
+    # Enrich with user data
+    for item in results:
+        item['user'] = await db.users.find_one(
+            {"id": item['user_id']},
+            {"_id": 0, "email": 1, "username": 1, "full_name": 1}
+        )
+    
+    return {
+        'kyc_id': kyc_id,
+        'indexed_files': len(hashes),
+        'max_distance': max_distance,
+        'similar': results
+    }
+
 # ============ ENHANCED KYC LIST ============
 
 @router.get("/pending")
@@ -303,6 +381,87 @@ async def get_all_kyc_submissions(
 
 # ============ FILE VIEWER ============
 
+# Nội dung không bao giờ đổi; private: chỉ cache ở browser của admin, không ở proxy dùng chung
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    return bool(if_none_match) and (
+        if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+    )
+
+async def _stored_image_response(request: Request, key: str, etag: str) -> Optional[Response]:
+    """Ảnh JPEG dẫn xuất (thumbnail, crop) từ storage backend; None nếu chưa có
+
+    Đọc qua storage nên mọi API replica đều trả về được, không phụ thuộc disk
+    của worker đã tạo ra ảnh.
+    """
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": etag}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    storage = get_storage()
+    path = storage.local_path(key)
+    if path is not None:
+        return FileResponse(path, media_type="image/jpeg", headers=headers) if path.exists() else None
+    try:
+        # Ảnh dẫn xuất nhỏ (vài chục KB): đọc một lần, không redirect để giữ cache immutable
+        content = await asyncio.to_thread(storage.read_bytes, key)
+    except FileNotFoundError:
+        return None
+    return Response(content, media_type="image/jpeg", headers=headers)
+
+async def _regenerate_thumbnails(db, content_hash: str) -> bool:
+    """Tạo lại thumbnail từ file gốc (thumbnail tạo trước khi chuyển sang storage / lỗi lúc upload)"""
+    record = await db[FILE_COLLECTION].find_one(
+        {"content_hash": content_hash, "extension": {"$ne": ".pdf"}}, {"_id": 0}
+    )
+    if not record:
+        return False
+    try:
+        content = await asyncio.to_thread(get_storage().read_bytes, record_key(record))
+    except FileNotFoundError:
+        return False
+    return await asyncio.to_thread(generate_thumbnails, content, content_hash) is not None
+
+@router.get("/thumbnails/{content_hash}")
+async def get_kyc_thumbnail(
+    content_hash: str,
+    request: Request,
+    current_admin: Dict = Depends(get_current_admin_user),
+    db = Depends(get_db),
+    size: int = Query(THUMBNAIL_SIZES[1])
+):
+    """Thumbnail theo SHA-256 nội dung (kyc_submissions.file_hashes)
+
+    Nội dung ứng với một hash không bao giờ đổi nên được cache vĩnh viễn phía client.
+    """
+    if not is_content_hash(content_hash) or size not in THUMBNAIL_SIZES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid thumbnail request (sizes: {', '.join(map(str, THUMBNAIL_SIZES))})"
+        )
+    
+    key, etag = thumbnail_key(content_hash, size), f'"{content_hash}-{size}"'
+    response = await _stored_image_response(request, key, etag)
+    if response is None and await _regenerate_thumbnails(db, content_hash):
+        response = await _stored_image_response(request, key, etag)
+    if response is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Thumbnail not found"
+        )
+    return response
+
+async def _presigned_download_url(file_id: str, record: Dict) -> Optional[str]:
+    """URL tải trực tiếp từ object storage (None với backend local / file cũ ngoài store)"""
+    storage = get_storage()
+    if not storage.supports_presigned_urls or not record.get('key'):
+        return None
+    return await asyncio.to_thread(
+        storage.presigned_get_url, record['key'],
+        f"{file_id}{record['extension']}", MEDIA_TYPES.get(record['extension'])
+    )
+
 @router.get("/file/{file_id}")
 async def get_kyc_file_info(
     file_id: str,
@@ -323,19 +482,23 @@ async def get_kyc_file_info(
             detail="File not found"
         )
     
-    # Find the actual file
+    # Metadata từ kyc_files (một lần đọc theo index)
+    record = await get_file(db, file_id)
     file_found = None
-    for ext in ['.jpg', '.jpeg', '.png', '.pdf']:
-        file_path = UPLOAD_DIR / f"{file_id}{ext}"
-        if file_path.exists():
-            file_found = {
-                'file_id': file_id,
-                'filename': file_path.name,
-                'extension': ext,
-                'size': file_path.stat().st_size,
-                'path': str(file_path)
-            }
-            break
+    if record:
+        file_found = {
+            'file_id': file_id,
+            'filename': f"{file_id}{record['extension']}",
+            'extension': record['extension'],
+            'size': record['size'],
+            'content_hash': record.get('content_hash'),
+            'width': record.get('width'),
+            'height': record.get('height'),
+            'tier': record.get('tier', 'hot'),
+            'path': record['path'],
+            'download_url': (await _presigned_download_url(file_id, record)
+                             or f"/api/admin/kyc/file/{file_id}/download")
+        }
     
     if not file_found:
         raise HTTPException(
@@ -343,8 +506,108 @@ async def get_kyc_file_info(
             detail="File not found on disk"
         )
     
+    # Crop giấy tờ đã nắn phẳng (nhỏ hơn nhiều so với ảnh gốc), nếu analyzer tạo được
+    document_crop = _document_crop(kyc, file_id)
+    if document_crop and record.get('content_hash'):
+        file_found['document_crop'] = {
+            'url': f"/api/admin/kyc/file/{file_id}/document-crop",
+            'width': document_crop.get('width'),
+            'height': document_crop.get('height')
+        }
+    
     return file_found
 
+def _document_crop(kyc: Dict, file_id: str) -> Optional[Dict]:
+    """document_crop trong kết quả phân tích của file (None nếu analyzer không tạo được)"""
+    for file_analysis in kyc.get('analysis', {}).get('file_analyses', []):
+        if file_analysis.get('file_id') == file_id:
+            return file_analysis.get('analysis', {}).get('document_crop')
+    return None
+
+@router.get("/file/{file_id}/document-crop")
+async def get_kyc_document_crop(
+    file_id: str,
+    request: Request,
+    current_admin: Dict = Depends(get_current_admin_user),
+    db = Depends(get_db)
+):
+    """Crop giấy tờ đã nắn phẳng của file (JPEG, cache immutable như thumbnail)
+
+    Crop đặt theo SHA-256 nội dung gốc nên không đổi với một file_id. Kết quả phân
+    tích cũ chỉ có 'path' (cạnh blob trên disk local) dùng cùng key.
+    """
+    kyc = await db.kyc_submissions.find_one(
+        {"file_ids": file_id},
+        {"_id": 0, "analysis.file_analyses": 1}
+    )
+    record = await get_file(db, file_id) if kyc and _document_crop(kyc, file_id) else None
+    response = None
+    if record and record.get('content_hash'):
+        key = document_crop_key(record['content_hash'])
+        response = await _stored_image_response(request, key, f'"{record["content_hash"]}-document"')
+    if response is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document crop not found"
+        )
+    return response
+
+@router.get("/file/{file_id}/download")
+async def download_kyc_file(
+    file_id: str,
+    request: Request,
+    current_admin: Dict = Depends(get_current_admin_user),
+    db = Depends(get_db)
+):
+    """Stream nội dung file KYC (hỗ trợ Range, ETag / If-None-Match)
+
+    Với object storage: redirect tới presigned URL, bytes không đi qua API.
+    """
+    record = await get_file(db, file_id)
+    presigned_url = await _presigned_download_url(file_id, record) if record else None
+    if presigned_url:
+        return RedirectResponse(presigned_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    try:
+        stat = os.stat(record['path']) if record else None
+    except FileNotFoundError:
+        stat = None
+    if not stat:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    etag = file_etag(record, stat)
+    headers = {
+        # Nội dung của một file_id không bao giờ đổi
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "ETag": etag,
+        "Content-Disposition": f'inline; filename="{file_id}{record["extension"]}"'
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    # If-Range khác ETag hiện tại: client giữ bản cũ, trả về cả file
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{stat.st_size}", "ETag": etag}
+        )
+    
+    return RangeFileResponse(
+        record['path'],
+        stat.st_size,
+        MEDIA_TYPES.get(record['extension'], "application/octet-stream"),
+        byte_range=byte_range,
+        headers=headers
+    )
+
 # ============ KYC VERIFY (APPROVE/REJECT) ============
 
 @router.put("/{kyc_id}/verify")
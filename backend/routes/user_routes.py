@@ -1,41 +1,274 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request, UploadFile, File
-from models import MessageResponse, KYCSubmission
+from fastapi import APIRouter, HTTPException, status, Depends, Request, UploadFile, File, Query, Response
+from starlette.requests import ClientDisconnect
+from models import (
+    MessageResponse, KYCSubmission, KYCUploadSessionCreate, KYCDirectUploadCreate, KYCUploadFinalize, SystemSettings
+)
 from middleware import get_current_user, log_audit
 from database import get_db
-from typing import Dict, List
+from typing import BinaryIO, Dict, List, Optional, Union
 from datetime import datetime, timezone
+import asyncio
+import logging
+import time
 import uuid
 import os
+import hashlib
 from pathlib import Path
 import sys
-import asyncio
 
 # Add utils to path
 sys.path.append('/app/backend')
-from utils.kyc_analyzer import KYCDocumentAnalyzer
-from utils.telegram_service import telegram_service
+from utils.kyc_jobs import enqueue_analysis_job
+from utils.kyc_thumbnails import generate_thumbnails
+from utils.kyc_file_store import (
+    UPLOAD_DIR, MEDIA_TYPES, blob_key, blob_path, store_blob, register_file, discard_files
+)
+from utils.kyc_storage import get_storage, sha256_checksum
+from utils.kyc_upload_sessions import (
+    SESSION_OPEN, MODE_DIRECT, KYC_UPLOAD_MAX_OPEN_SESSIONS,
+    count_open_sessions, create_session, get_session, get_sessions, advance_offset, mark_finalized,
+    is_staged_here
+)
+from utils.image_sniffer import (
+    sniff_image, is_pdf, InvalidImageError, MIN_KYC_IMAGE_WIDTH, MIN_KYC_IMAGE_HEIGHT,
+    KYC_PRECHECK_MAX_EDGE, KYC_PRECHECK_MAX_BYTES
+)
+from utils.analysis_executor import precheck_executor, AnalysisQueueFull
+from utils.kyc_multipart import iter_multipart, MultipartError, BodyTooLarge, PART_BEGIN, PART_DATA
 
 router = APIRouter(prefix="/user", tags=["User Operations"])
+logger = logging.getLogger(__name__)
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = Path("/app/backend/uploads/kyc")
+# Create uploads directory if it doesn't exist (file KYC nằm trong kyc_file_store)
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-@router.post("/kyc/submit", response_model=MessageResponse)
-async def submit_kyc(
-    id_type: str,
-    files: List[UploadFile] = File(...),
-    current_user: Dict = Depends(get_current_user),
-    request: Request = None,
-    db = Depends(get_db)
-):
+ALLOWED_KYC_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.pdf'}
+# Kích thước mỗi lần đọc upload (hash được cập nhật theo từng chunk)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Số byte đầu của upload direct đọc về để kiểm tra magic bytes / độ phân giải
+DIRECT_UPLOAD_SNIFF_BYTES = 1024 * 1024
+# Số file tối đa mỗi lần /kyc/submit
+KYC_MAX_SUBMIT_FILES = int(os.getenv("KYC_MAX_SUBMIT_FILES", 10))
+# Ngân sách latency của /kyc/precheck phía server (kể cả IPC với process pool)
+KYC_PRECHECK_BUDGET_MS = float(os.getenv("KYC_PRECHECK_BUDGET_MS", 50))
+# Dự phòng cho boundary + header của mỗi part khi giới hạn tổng kích thước body
+MULTIPART_PART_OVERHEAD = 16 * 1024
+
+def _check_kyc_file(filename: str, file_ext: str, content: Union[str, bytes]) -> Dict:
+    """Kiểm tra nội dung file (path hoặc bytes) từ header, không decode ảnh
+
+    Trả về header đã sniff (format, width, height); raise 400 nếu file không
+    đúng định dạng, bị hỏng hoặc độ phân giải dưới mức tối thiểu.
     """
-    Submit KYC documents for verification
+    if file_ext == '.pdf':
+        if not is_pdf(content):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid file: {filename} is not a valid PDF document"
+            )
+        return {'format': 'pdf'}
+    
+    try:
+        header = sniff_image(content)
+    except InvalidImageError:
+        header = None
+    if header is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file: {filename} is not a valid JPG or PNG image"
+        )
+    
+    if header['width'] < MIN_KYC_IMAGE_WIDTH or header['height'] < MIN_KYC_IMAGE_HEIGHT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                f"Image resolution too low: {filename} is {header['width']}x{header['height']} "
+                f"(minimum {MIN_KYC_IMAGE_WIDTH}x{MIN_KYC_IMAGE_HEIGHT})"
+            )
+        )
+    return header
+
+def _temp_upload_path(file_id: str, file_ext: str) -> Path:
+    """File tạm khi đang nhận upload, cùng thư mục để rename sang file thật là atomic"""
+    return UPLOAD_DIR / f".{file_id}{file_ext}.part"
+
+async def _cleanup_uploaded_files(db, file_ids: List[str]):
+    """Xóa các file đã lưu (kể cả file tạm đang ghi dở) của một submission bị hủy"""
+    for file_id in file_ids:
+        for ext in ALLOWED_KYC_EXTENSIONS:
+            temp_path = _temp_upload_path(file_id, ext)
+            if temp_path.exists():
+                temp_path.unlink()
+    await discard_files(db, file_ids)
+
+async def _store_uploaded_file(db, user_id: str, file_id: str, filename: str, file_ext: str,
+                               temp_path: Path, sha256: str, size: int) -> str:
+    """Kiểm tra file tạm đã nhận đủ, đưa vào store + metadata, trả về path trong store"""
+    # Kiểm tra magic bytes / kích thước từ header file tạm, rồi rename (atomic)
+    header = await asyncio.to_thread(_check_kyc_file, filename, file_ext, str(temp_path))
+    
+    # Thumbnail cho trang review (ngoài event loop), lỗi không chặn submission.
+    # Tạo từ file tạm: với object storage, file không còn trên disk sau store_blob
+    if file_ext != '.pdf':
+        await asyncio.to_thread(generate_thumbnails, str(temp_path), sha256)
+    
+    file_path = await store_blob(db, temp_path, file_id, sha256, file_ext, size, user_id, header)
+    return str(file_path)
+
+async def _store_direct_upload(db, user_id: str, session: Dict) -> str:
+    """Chuyển object staging của session direct vào store + metadata, trả về blob_path
+
+    Object storage kiểm tra checksum SHA-256 lúc PUT; API vẫn so checksum của
+    object staging với hash client khai báo trước khi dùng hash đó làm key (S3:
+    HeadObject ChecksumMode, không đọc lại bytes), rồi chỉ đọc header để kiểm tra
+    định dạng. Copy sang key theo hash diễn ra phía storage, bỏ qua nếu nội dung
+    đã có trong store (dedup như store_blob).
     """
-    # Check if user already has pending or approved KYC
+    storage = get_storage()
+    staging_key, sha256, file_ext = session['storage_key'], session['sha256'], session['file_ext']
+    size = await asyncio.to_thread(storage.size, staging_key)
+    if size != session['size']:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Uploads not complete: {session['id']}"
+        )
+    if await asyncio.to_thread(storage.checksum_sha256, staging_key) != sha256_checksum(sha256):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Checksum mismatch: {session['filename']} does not match the declared SHA-256"
+        )
+    head = await asyncio.to_thread(storage.read_bytes, staging_key, 0, min(size, DIRECT_UPLOAD_SNIFF_BYTES) - 1)
+    header = await asyncio.to_thread(_check_kyc_file, session['filename'], file_ext, head)
+    
+    # Metadata trước khi kiểm tra dedup, như store_blob
+    await register_file(db, session['id'], sha256, file_ext, size, user_id, header)
+    key = blob_key(sha256, file_ext)
+    if not await asyncio.to_thread(storage.exists, key):
+        await asyncio.to_thread(storage.copy, staging_key, key)
+    await asyncio.to_thread(storage.delete, staging_key)
+    return str(blob_path(sha256, file_ext))
+
+async def _delete_staged_uploads(sessions: List[Dict]):
+    storage = get_storage()
+    for session in sessions:
+        if session.get('storage_key'):
+            await asyncio.to_thread(storage.delete, session['storage_key'])
+
+async def _kyc_max_file_size(db) -> int:
+    """Giới hạn kích thước mỗi file KYC (bytes) theo SystemSettings.kyc_max_file_size_mb"""
+    settings = await db.system_settings.find_one({"id": "system_settings"}, {"_id": 0})
+    settings = SystemSettings(**settings) if settings else SystemSettings()
+    return int(settings.kyc_max_file_size_mb * 1024 * 1024)
+
+def _write_chunk(f: BinaryIO, hasher, chunk: bytes):
+    # hashlib nhả GIL với buffer lớn: hash + ghi cùng chạy trong thread
+    hasher.update(chunk)
+    f.write(chunk)
+
+def _max_submit_body(max_file_size: int) -> int:
+    """Kích thước body tối đa của /kyc/submit: KYC_MAX_SUBMIT_FILES file + header multipart"""
+    return KYC_MAX_SUBMIT_FILES * (max_file_size + MULTIPART_PART_OVERHEAD)
+
+def _check_content_length(request: Request, max_bytes: int):
+    """413 trước khi đọc body nếu Content-Length đã vượt max_bytes"""
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request too large: maximum {max_bytes // (1024 * 1024)}MB"
+        )
+
+async def _receive_kyc_files(db, request: Request, user_id: str, max_file_size: int,
+                             file_ids: List[str], file_paths: List[str], file_hashes: List[str]):
+    """Đọc các part 'files' của body multipart theo stream, lưu từng file khi nhận xong
+
+    Mỗi file được ghi ra file tạm theo chunk (SHA-256 tính trong lúc ghi); vượt
+    max_file_size thì dừng ngay với 413, không chờ client gửi hết. file_ids được
+    ghi nhận ngay khi part bắt đầu để caller dọn file tạm nếu lỗi giữa chừng.
+    """
+    current = None
+    try:
+        async for event, value in iter_multipart(request, _max_submit_body(max_file_size)):
+            if event == PART_BEGIN:
+                name, filename = value
+                if name != 'files' or filename is None:
+                    # Field khác bị bỏ qua (id_type nằm trong query)
+                    continue
+                if len(file_ids) >= KYC_MAX_SUBMIT_FILES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Too many files: maximum {KYC_MAX_SUBMIT_FILES}"
+                    )
+                file_ext = _kyc_file_ext(filename)
+                file_id = str(uuid.uuid4())
+                temp_path = _temp_upload_path(file_id, file_ext)
+                file_ids.append(file_id)
+                current = {
+                    'filename': filename, 'file_id': file_id, 'file_ext': file_ext, 'temp_path': temp_path,
+                    'file': await asyncio.to_thread(open, temp_path, "wb"),
+                    'hasher': hashlib.sha256(), 'size': 0, 'buffer': bytearray()
+                }
+            elif current is None:
+                continue
+            elif event == PART_DATA:
+                current['size'] += len(value)
+                if current['size'] > max_file_size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File too large: {current['filename']} exceeds {max_file_size // (1024 * 1024)}MB"
+                    )
+                # Gom các chunk ASGI nhỏ, ghi + hash theo UPLOAD_CHUNK_SIZE ngoài event loop
+                current['buffer'] += value
+                if len(current['buffer']) >= UPLOAD_CHUNK_SIZE:
+                    await asyncio.to_thread(_write_chunk, current['file'], current['hasher'], bytes(current['buffer']))
+                    current['buffer'].clear()
+            else:
+                await asyncio.to_thread(_write_chunk, current['file'], current['hasher'], bytes(current['buffer']))
+                await asyncio.to_thread(current['file'].close)
+                part, current = current, None
+                file_path = await _store_uploaded_file(
+                    db, user_id, part['file_id'], part['filename'], part['file_ext'],
+                    part['temp_path'], part['hasher'].hexdigest(), part['size']
+                )
+                file_paths.append(file_path)
+                file_hashes.append(part['hasher'].hexdigest())
+    except BodyTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request too large: maximum {_max_submit_body(max_file_size) // (1024 * 1024)}MB"
+        )
+    except MultipartError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid upload: {e}")
+    finally:
+        if current is not None:
+            await asyncio.to_thread(current['file'].close)
+    
+    if current is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload incomplete")
+    if not file_paths:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No files uploaded")
+
+def _hash_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _kyc_file_ext(filename: str) -> str:
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in ALLOWED_KYC_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file type: {filename}. Only JPG, PNG, and PDF are allowed"
+        )
+    return file_ext
+
+async def _ensure_can_submit_kyc(db, user_id: str):
+    """400 nếu user đã có KYC đang chờ / đã được duyệt"""
     existing_kyc = await db.kyc_submissions.find_one({
-        "user_id": current_user['id'],
-        "status": {"$in": ["pending", "approved"]}
+        "user_id": user_id,
+        "status": {"$in": ["analyzing", "pending", "approved"]}
     })
     
     if existing_kyc:
@@ -49,170 +282,411 @@ async def submit_kyc(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="You already have a pending KYC submission"
             )
+
+async def _create_kyc_submission(db, current_user: Dict, id_type: str, file_ids: List[str],
+                                 file_paths: List[str], file_hashes: List[str],
+                                 request: Optional[Request], kyc_id: Optional[str] = None) -> str:
+    """Tạo submission cho các file đã lưu và đẩy job phân tích, trả về kyc_id"""
+    # Create KYC submission, analysis runs in kyc_worker
+    kyc_submission = KYCSubmission(
+        id=kyc_id or str(uuid.uuid4()),
+        user_id=current_user['id'],
+        id_type=id_type,
+        file_ids=file_ids,
+        file_hashes=dict(zip(file_ids, file_hashes)),
+        status='analyzing'
+    )
+    
+    kyc_doc = kyc_submission.model_dump()
+    kyc_doc['created_at'] = kyc_doc['created_at'].isoformat()
+    
+    await db.kyc_submissions.insert_one(kyc_doc)
+    
+    # ===== TỰ ĐỘNG PHÂN TÍCH DOCUMENTS =====
+    # Job được worker xử lý, kết quả / auto-approval ghi ngược vào kyc_submissions
+    await enqueue_analysis_job(
+        db,
+        kyc_id=kyc_submission.id,
+        user_id=current_user['id'],
+        id_type=id_type,
+        files=[
+            {'file_id': file_id, 'path': path, 'sha256': sha256}
+            for file_id, path, sha256 in zip(file_ids, file_paths, file_hashes)
+        ]
+    )
+    
+    # Update user KYC status
+    await db.users.update_one(
+        {"id": current_user['id']},
+        {"$set": {"kyc_status": "pending"}}
+    )
+    
+    # Log audit
+    await log_audit(
+        db, current_user['id'], "kyc_submitted",
+        {
+            "kyc_id": kyc_submission.id, 
+            "id_type": id_type, 
+            "files_count": len(file_ids)
+        },
+        request.client.host if request else None,
+        request.headers.get("user-agent") if request else None
+    )
+    return kyc_submission.id
+
+# Body multipart đọc theo stream trong handler (không khai báo File(...) để FastAPI
+# không spool trước), schema giữ nguyên cho OpenAPI
+_KYC_SUBMIT_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["files"],
+            "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}}
+        }}}
+    }
+}
+
+@router.post("/kyc/submit", response_model=MessageResponse, openapi_extra=_KYC_SUBMIT_BODY)
+async def submit_kyc(
+    id_type: str,
+    request: Request,
+    current_user: Dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Submit KYC documents for verification
+
+    Mỗi file bị giới hạn ngay trong lúc nhận (413 khi vượt kyc_max_file_size_mb),
+    body khai báo Content-Length lớn hơn giới hạn bị từ chối trước khi đọc.
+    """
+    # Check if user already has pending or approved KYC
+    await _ensure_can_submit_kyc(db, current_user['id'])
     
-    # Validate file types
-    allowed_extensions = {'.jpg', '.jpeg', '.png', '.pdf'}
     file_ids = []
     file_paths = []
+    file_hashes = []
+    max_file_size = await _kyc_max_file_size(db)
+    _check_content_length(request, _max_submit_body(max_file_size))
     
     try:
-        # Save files
-        for file in files:
-            # Check file extension
-            file_ext = os.path.splitext(file.filename)[1].lower()
-            if file_ext not in allowed_extensions:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Invalid file type: {file.filename}. Only JPG, PNG, and PDF are allowed"
-                )
-            
-            # Generate unique filename
-            file_id = str(uuid.uuid4())
-            filename = f"{file_id}{file_ext}"
-            file_path = UPLOAD_DIR / filename
-            
-            # Save file
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            file_ids.append(file_id)
-            file_paths.append(str(file_path))
+        # Stream từng file ra file tạm rồi vào store
+        await _receive_kyc_files(db, request, current_user['id'], max_file_size, file_ids, file_paths, file_hashes)
     
+    except HTTPException:
+        await _cleanup_uploaded_files(db, file_ids)
+        raise
     except Exception as e:
         # Clean up any uploaded files if error occurs
-        for file_id in file_ids:
-            for ext in allowed_extensions:
-                file_path = UPLOAD_DIR / f"{file_id}{ext}"
-                if file_path.exists():
-                    file_path.unlink()
+        await _cleanup_uploaded_files(db, file_ids)
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error uploading files: {str(e)}"
         )
     
-    # ===== TỰ ĐỘNG PHÂN TÍCH DOCUMENTS =====
-    analysis_results = []
-    overall_validation_score = 0
-    
-    for i, file_path in enumerate(file_paths):
-        # Skip PDF files for now (image analysis only)
-        if not file_path.lower().endswith('.pdf'):
-            try:
-                # Analyze document
-                validation_result = KYCDocumentAnalyzer.validate_document(file_path, id_type)
-                analysis_results.append({
-                    'file_id': file_ids[i],
-                    'analysis': validation_result
-                })
-                overall_validation_score += validation_result.get('validation_score', 0)
-            except Exception as e:
-                analysis_results.append({
-                    'file_id': file_ids[i],
-                    'analysis': {'error': str(e), 'validation_score': 0}
-                })
-    
-    # Calculate average validation score
-    if analysis_results:
-        overall_validation_score = overall_validation_score / len(analysis_results)
-    
-    # Determine auto-approval
-    auto_approved = overall_validation_score >= 80
-    requires_review = overall_validation_score < 80
-    
-    # Create KYC submission with analysis
-    kyc_submission = KYCSubmission(
-        user_id=current_user['id'],
-        id_type=id_type,
-        file_ids=file_ids
+    await _create_kyc_submission(db, current_user, id_type, file_ids, file_paths, file_hashes, request)
+    
+    return MessageResponse(
+        message="KYC documents submitted successfully. Your documents are being analyzed.",
+        success=True
     )
+
+@router.post("/kyc/precheck")
+async def precheck_kyc(
+    file: UploadFile = File(...),
+    current_user: Dict = Depends(get_current_user)
+):
+    """
+    Quick brightness / contrast / sharpness / framing check on a small preview before uploading
+    """
+    start = time.perf_counter()
+    content = await file.read(KYC_PRECHECK_MAX_BYTES + 1)
+    if len(content) > KYC_PRECHECK_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Preview too large: maximum {KYC_PRECHECK_MAX_BYTES // 1024}KB"
+        )
     
-    kyc_doc = kyc_submission.model_dump()
-    kyc_doc['created_at'] = kyc_doc['created_at'].isoformat()
+    # Header: từ chối file không phải ảnh / quá lớn trước khi decode
+    try:
+        header = sniff_image(content)
+    except InvalidImageError:
+        header = None
+    if header is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file: preview must be a JPG or PNG image"
+        )
+    if max(header['width'], header['height']) > KYC_PRECHECK_MAX_EDGE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Preview too large: downscale to at most {KYC_PRECHECK_MAX_EDGE}px on the long edge"
+        )
     
-    # Add analysis results
-    kyc_doc['analysis'] = {
-        'validation_score': round(overall_validation_score, 2),
-        'auto_approved': auto_approved,
-        'requires_manual_review': requires_review,
-        'file_analyses': analysis_results,
-        'analyzed_at': datetime.now(timezone.utc).isoformat()
-    }
+    try:
+        result = await precheck_executor.precheck(content)
+    except AnalysisQueueFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="KYC analysis is busy. Please try again shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     
-    # Set initial status based on analysis
-    if auto_approved:
-        kyc_doc['status'] = 'approved'
-        kyc_doc['reviewed_at'] = datetime.now(timezone.utc).isoformat()
-        kyc_doc['admin_note'] = 'Automatically approved based on quality analysis'
+    # elapsed_ms: trong worker; server_ms: từ lúc handler nhận file (sniff + hàng đợi + IPC)
+    result['server_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    if result['server_ms'] > KYC_PRECHECK_BUDGET_MS:
+        logger.warning(f"KYC precheck took {result['server_ms']} ms (analyzer {result.get('elapsed_ms')} ms, "
+                       f"budget {KYC_PRECHECK_BUDGET_MS:.0f} ms, {precheck_executor.pending} pending)")
+    return result
+
+# ============ RESUMABLE KYC UPLOAD ============
+# POST /kyc/uploads -> PUT /kyc/uploads/{id}?offset=N (lặp lại) -> POST /kyc/uploads/finalize
+# Mất kết nối: GET /kyc/uploads/{id} để lấy offset đã nhận rồi gửi tiếp từ đó.
+# PUT / finalize của session chunked phải tới replica giữ file tạm ('node'), xem kyc_upload_sessions.
+
+async def _check_new_upload(db, user_id: str, filename: str, size: int) -> str:
+    """Kiểm tra extension / kích thước / số session đang mở trước khi tạo session, trả về extension"""
+    file_ext = _kyc_file_ext(filename)
+    max_file_size = await _kyc_max_file_size(db)
+    if size > max_file_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large: {filename} exceeds {max_file_size // (1024 * 1024)}MB"
+        )
+    if await count_open_sessions(db, user_id) >= KYC_UPLOAD_MAX_OPEN_SESSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many unfinished uploads, finalize or wait for them to expire"
+        )
+    return file_ext
+
+def _session_status(session: Dict) -> Dict:
+    return {
+        'upload_id': session['id'],
+        'offset': session['offset'],
+        'size': session['size'],
+        'status': session['status'],
+        'mode': session.get('mode', 'chunked'),
+        'complete': session['offset'] == session['size'],
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'node': session.get('node')
+    }
+
+async def _require_staged_here(sessions: List[Dict]):
+    """Từ chối (421) khi file tạm của session chunked không nằm trên replica này"""
+    for session in sessions:
+        if not await asyncio.to_thread(is_staged_here, session):
+            raise HTTPException(
+                status_code=status.HTTP_421_MISDIRECTED_REQUEST,
+                detail=f"Upload {session['id']} is staged on another server, retry against node {session.get('node')}",
+                headers={"Upload-Node": str(session.get('node'))}
+            )
+
+@router.post("/kyc/uploads")
+async def create_kyc_upload(
+    payload: KYCUploadSessionCreate,
+    current_user: Dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Create a resumable upload session for one KYC file
+    """
+    file_ext = await _check_new_upload(db, current_user['id'], payload.filename, payload.size)
     
-    await db.kyc_submissions.insert_one(kyc_doc)
+    # upload_id cũng là file_id: finalize chỉ cần rename file tạm
+    upload_id = str(uuid.uuid4())
+    temp_path = _temp_upload_path(upload_id, file_ext)
+    await asyncio.to_thread(temp_path.touch)
+    session = await create_session(
+        db, current_user['id'], payload.filename, file_ext, payload.size, str(temp_path), upload_id
+    )
+    return _session_status(session)
+
+@router.post("/kyc/uploads/direct")
+async def create_kyc_direct_upload(
+    payload: KYCDirectUploadCreate,
+    current_user: Dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Create an upload session with a presigned URL to PUT the file straight to object storage
+    """
+    storage = get_storage()
+    if not storage.supports_presigned_urls:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Direct upload is not available, use /user/kyc/uploads"
+        )
+    file_ext = await _check_new_upload(db, current_user['id'], payload.filename, payload.size)
     
-    # Update user KYC status
-    new_kyc_status = 'verified' if auto_approved else 'pending'
-    await db.users.update_one(
-        {"id": current_user['id']},
-        {"$set": {"kyc_status": new_kyc_status}}
+    # Upload vào key staging riêng của session, finalize mới copy sang key theo hash:
+    # client không ghi đè được blob của người khác dù khai báo cùng hash
+    upload_id = str(uuid.uuid4())
+    staging_key = f"incoming/{upload_id}{file_ext}"
+    session = await create_session(
+        db, current_user['id'], payload.filename, file_ext, payload.size, None, upload_id,
+        mode=MODE_DIRECT, storage_key=staging_key, sha256=payload.sha256
     )
+    upload = storage.presigned_put_url(staging_key, payload.sha256, MEDIA_TYPES.get(file_ext))
+    return {**_session_status(session), 'upload': upload}
+
+@router.get("/kyc/uploads/{upload_id}")
+async def get_kyc_upload(
+    upload_id: str,
+    response: Response,
+    current_user: Dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Get the number of bytes received so far for an upload session
+    """
+    session = await get_session(db, upload_id, current_user['id'])
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+    response.headers["Upload-Offset"] = str(session['offset'])
+    return _session_status(session)
+
+@router.put("/kyc/uploads/{upload_id}")
+async def upload_kyc_chunk(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    offset: int = Query(..., ge=0),
+    current_user: Dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Append a chunk (raw request body) at the given offset
+    """
+    session = await get_session(db, upload_id, current_user['id'])
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+    if session.get('mode') == MODE_DIRECT:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Direct upload session, PUT the file to its presigned URL"
+        )
+    if session['status'] != SESSION_OPEN or offset != session['offset']:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Offset mismatch: upload is at {session['offset']}",
+            headers={"Upload-Offset": str(session['offset'])}
+        )
+    await _require_staged_here([session])
     
-    # Send Telegram notification with KYC images
+    # Ghi thẳng vào file tạm tại offset, mỗi lần ghi tối đa UPLOAD_CHUNK_SIZE bytes
+    written = 0
+    buffer = bytearray()
+    f = await asyncio.to_thread(open, session['temp_path'], "r+b")
     try:
-        # Send notification message
-        asyncio.create_task(
-            telegram_service.send_kyc_notification(
-                user_email=current_user.get('email', 'N/A'),
-                user_name=current_user.get('username', 'N/A'),
-                kyc_id=kyc_submission.id,
-                status='auto-approved' if auto_approved else 'pending review'
-            )
+        await asyncio.to_thread(f.seek, offset)
+        async for data in request.stream():
+            if offset + written + len(buffer) + len(data) > session['size']:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Chunk exceeds declared file size ({session['size']} bytes)"
+                )
+            buffer += data
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(f.write, buffer)
+                written += len(buffer)
+                buffer = bytearray()
+    except ClientDisconnect:
+        # Giữ phần đã nhận được, client hỏi lại offset rồi gửi tiếp
+        pass
+    finally:
+        if buffer:
+            await asyncio.to_thread(f.write, buffer)
+            written += len(buffer)
+        await asyncio.to_thread(f.close)
+        advanced = written == 0 or await advance_offset(db, session, offset, offset + written)
+    
+    if not advanced:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload was modified by a concurrent request, query the offset and retry"
         )
-        
-        # Send KYC images to Telegram
-        images_data = []
-        for file_path in file_paths:
-            # Only send images, skip PDFs
-            if not file_path.lower().endswith('.pdf'):
-                with open(file_path, 'rb') as f:
-                    images_data.append(f.read())
-        
-        if images_data:
-            asyncio.create_task(
-                telegram_service.send_kyc_images(
-                    user_email=current_user.get('email', 'N/A'),
-                    user_name=current_user.get('username', 'N/A'),
-                    images=images_data,
-                    id_type=id_type
+    session['offset'] = offset + written
+    response.headers["Upload-Offset"] = str(session['offset'])
+    return _session_status(session)
+
+@router.post("/kyc/uploads/finalize", response_model=MessageResponse)
+async def finalize_kyc_uploads(
+    payload: KYCUploadFinalize,
+    current_user: Dict = Depends(get_current_user),
+    request: Request = None,
+    db = Depends(get_db)
+):
+    """
+    Submit completed upload sessions as a KYC submission
+    """
+    await _ensure_can_submit_kyc(db, current_user['id'])
+    
+    upload_ids = list(dict.fromkeys(payload.upload_ids))
+    sessions = await get_sessions(db, upload_ids, current_user['id'])
+    if len(sessions) != len(upload_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+    # Session direct: kích thước được kiểm tra trên object storage lúc xử lý
+    incomplete = [s['id'] for s in sessions if s['status'] != SESSION_OPEN
+                  or (s.get('mode') != MODE_DIRECT and s['offset'] != s['size'])]
+    if incomplete:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Uploads not complete: {', '.join(incomplete)}"
+        )
+    await _require_staged_here(sessions)
+    
+    # Claim các session trước khi đụng tới file (GC / finalize song song không chạm vào nữa)
+    kyc_id = str(uuid.uuid4())
+    if await mark_finalized(db, upload_ids, kyc_id) != len(upload_ids):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Uploads are already being finalized"
+        )
+    
+    file_ids = []
+    file_paths = []
+    file_hashes = []
+    try:
+        # Thứ tự file theo upload_ids client gửi
+        for session in sorted(sessions, key=lambda s: upload_ids.index(s['id'])):
+            file_id, file_ext = session['id'], session['file_ext']
+            file_ids.append(file_id)
+            if session.get('mode') == MODE_DIRECT:
+                sha256 = session['sha256']
+                file_path = await _store_direct_upload(db, current_user['id'], session)
+            else:
+                temp_path = Path(session['temp_path'])
+                sha256 = await asyncio.to_thread(_hash_file, temp_path)
+                file_path = await _store_uploaded_file(
+                    db, current_user['id'], file_id, session['filename'], file_ext, temp_path, sha256, session['size']
                 )
-            )
+            
+            file_paths.append(file_path)
+            file_hashes.append(sha256)
+    
+    except HTTPException:
+        # Session đã claim không còn được GC: dọn cả file tạm / object staging chưa xử lý tới
+        await _delete_staged_uploads(sessions)
+        await _cleanup_uploaded_files(db, upload_ids)
+        raise
     except Exception as e:
-        # Log error but don't fail the request
-        print(f"Failed to send Telegram notification: {e}")
+        await _delete_staged_uploads(sessions)
+        await _cleanup_uploaded_files(db, upload_ids)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error finalizing uploads: {str(e)}"
+        )
     
-    # Log audit
-    await log_audit(
-        db, current_user['id'], "kyc_submitted",
-        {
-            "kyc_id": kyc_submission.id, 
-            "id_type": id_type, 
-            "files_count": len(file_ids),
-            "validation_score": round(overall_validation_score, 2),
-            "auto_approved": auto_approved
-        },
-        request.client.host if request else None,
-        request.headers.get("user-agent") if request else None
+    await _create_kyc_submission(
+        db, current_user, payload.id_type, file_ids, file_paths, file_hashes, request, kyc_id=kyc_id
     )
     
-    # Return appropriate message
-    if auto_approved:
-        return MessageResponse(
-            message="KYC documents submitted and automatically approved! Your account is now verified.",
-            success=True
-        )
-    else:
-        return MessageResponse(
-            message="KYC documents submitted successfully. Please wait for admin review.",
-            success=True
-        )
+    return MessageResponse(
+        message="KYC documents submitted successfully. Your documents are being analyzed.",
+        success=True
+    )
 
 @router.get("/kyc/status")
 async def get_kyc_status(
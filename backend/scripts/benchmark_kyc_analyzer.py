@@ -0,0 +1,329 @@
+"""
+Benchmark KYCDocumentAnalyzer trên corpus ảnh tổng hợp (deterministic)
+
+Corpus: nhiều độ phân giải x các biến thể (nét / mờ / tối / cháy sáng, có hoặc
+không có thẻ và khuôn mặt), encode JPEG giống ảnh upload thật. Mỗi stage được
+gọi qua API public với path (bao gồm cả decode), chạy một luồng nên
+throughput là ảnh/giây trên một core.
+
+    cd backend && python scripts/benchmark_kyc_analyzer.py --repeat 3 --output bench/kyc_baseline.json
+    cd backend && python scripts/benchmark_kyc_analyzer.py --compare bench/kyc_baseline.json
+    cd backend && python scripts/benchmark_kyc_analyzer.py --rejection-mix --resolutions 8MP 12MP
+    cd backend && python scripts/benchmark_kyc_analyzer.py --tile-cost --resolutions 2MP 8MP 12MP
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import cv2
+import numpy as np
+from skimage import data
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.kyc_analyzer import (
+    KYCDocumentAnalyzer, ImageAnalysisContext, KYC_FACE_DETECTION_MAX_EDGE, analyzer_version
+)
+
+RESOLUTIONS = {
+    '0.5MP': (800, 600),
+    '2MP': (1632, 1224),
+    '8MP': (3264, 2448),
+    '12MP': (4000, 3000),
+}
+
+# name: (blur sigma, brightness offset, có thẻ, có mặt)
+VARIANTS = {
+    'id_card': (0, 0, True, True),
+    'id_card_blurred': (4, 0, True, True),
+    'id_card_dark': (0, -95, True, True),
+    'id_card_bright': (0, 90, True, True),
+    'card_no_face': (0, 0, True, False),
+    'no_document': (0, 0, False, False),
+}
+
+# Tỉ lệ các biến thể trong một tập upload thực tế (nhiều ảnh bị reject)
+REJECTION_MIX = {
+    'id_card': 0.45,
+    'id_card_blurred': 0.20,
+    'id_card_dark': 0.15,
+    'id_card_bright': 0.05,
+    'card_no_face': 0.05,
+    'no_document': 0.10,
+}
+
+# Các trường phải giống hệt nhau giữa có / không short-circuit
+DECISION_KEYS = ('validation_score', 'auto_approved', 'requires_manual_review', 'auto_rejected')
+
+CORPUS_SEED = 20240501
+JPEG_QUALITY = 90
+
+
+def make_image(width: int, height: int, blur: float, brightness: int,
+               with_card: bool, with_face: bool, seed: int) -> np.ndarray:
+    """Ảnh giả lập chụp giấy tờ: nền có texture, thẻ ở giữa với chữ và ảnh chân dung"""
+    rng = np.random.default_rng(seed)
+    # Nền: nhiễu tần số thấp (phóng to từ lưới nhỏ) + nhiễu hạt
+    coarse = rng.integers(60, 180, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    img = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 20, (height, width, 3), dtype=np.uint8))
+
+    if with_card:
+        card_w, card_h = int(width * 0.7), int(width * 0.7 / 1.58)
+        x0, y0 = (width - card_w) // 2, (height - card_h) // 2
+        cv2.rectangle(img, (x0, y0), (x0 + card_w, y0 + card_h), (225, 225, 215), thickness=-1)
+        cv2.rectangle(img, (x0, y0), (x0 + card_w, y0 + card_h), (40, 40, 40), thickness=max(2, width // 400))
+
+        # Các dòng chữ giả lập bên phải ảnh chân dung
+        font_scale = card_h / 500
+        for line in range(6):
+            y = y0 + int(card_h * (0.25 + line * 0.11))
+            text = ''.join(rng.choice(list('ABCDEFGHKLMNPQRSTUVXY0123456789'), 18))
+            cv2.putText(img, text, (x0 + int(card_w * 0.42), y), cv2.FONT_HERSHEY_SIMPLEX,
+                        font_scale, (30, 30, 30), max(1, int(font_scale * 2)), cv2.LINE_AA)
+
+        if with_face:
+            portrait = cv2.cvtColor(data.astronaut(), cv2.COLOR_RGB2BGR)
+            side = int(card_h * 0.6)
+            portrait = cv2.resize(portrait, (side, side), interpolation=cv2.INTER_AREA)
+            px, py = x0 + int(card_w * 0.06), y0 + int(card_h * 0.2)
+            img[py:py + side, px:px + side] = portrait
+
+    if blur:
+        img = cv2.GaussianBlur(img, (0, 0), blur)
+    if brightness:
+        img = cv2.convertScaleAbs(img, alpha=1.0, beta=brightness)
+    return img
+
+
+def build_corpus(directory: str, resolutions: List[str]) -> List[Dict]:
+    """Ghi corpus ra directory (JPEG), trả về danh sách {'path', 'resolution', 'variant'}"""
+    corpus = []
+    for label in resolutions:
+        width, height = RESOLUTIONS[label]
+        # Seed theo vị trí của label trong RESOLUTIONS: ảnh không đổi khi chỉ chọn một phần --resolutions
+        r_index = list(RESOLUTIONS).index(label)
+        for v_index, (variant, params) in enumerate(VARIANTS.items()):
+            img = make_image(width, height, *params, seed=CORPUS_SEED + r_index * 100 + v_index)
+            path = os.path.join(directory, f"{label}_{variant}.jpg")
+            ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                raise RuntimeError(f"Cannot encode {path}")
+            with open(path, 'wb') as f:
+                f.write(encoded.tobytes())
+            corpus.append({'path': path, 'resolution': label, 'variant': variant})
+    return corpus
+
+
+def stages(thumbnail_path: str) -> Dict:
+    return {
+        'decode': lambda path: ImageAnalysisContext(path).image,
+        'analyze_image_quality': KYCDocumentAnalyzer.analyze_image_quality,
+        'detect_document_type': KYCDocumentAnalyzer.detect_document_type,
+        'detect_face': KYCDocumentAnalyzer.detect_face,
+        'analyze_tiles': KYCDocumentAnalyzer.analyze_tiles,
+        'validate_document': lambda path: KYCDocumentAnalyzer.validate_document(path, 'national_id'),
+        'generate_thumbnail': lambda path: KYCDocumentAnalyzer.generate_thumbnail(path, thumbnail_path),
+    }
+
+
+def summarize(samples: List[float]) -> Dict:
+    values = np.asarray(samples)
+    mean = float(values.mean())
+    return {
+        'samples': len(samples),
+        'p50_ms': round(float(np.percentile(values, 50)), 2),
+        'p95_ms': round(float(np.percentile(values, 95)), 2),
+        'mean_ms': round(mean, 2),
+        # Chạy một luồng (cv2.setNumThreads(1)) nên đây là ảnh/giây trên một core
+        'throughput_per_core': round(1000 / mean, 2) if mean else None,
+    }
+
+
+def run(corpus: List[Dict], repeat: int, thumbnail_path: str) -> Dict:
+    by_stage = defaultdict(list)
+    by_resolution = defaultdict(lambda: defaultdict(list))
+    for item in corpus:
+        for stage, fn in stages(thumbnail_path).items():
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn(item['path'])
+                elapsed = (time.perf_counter() - start) * 1000
+                by_stage[stage].append(elapsed)
+                by_resolution[item['resolution']][stage].append(elapsed)
+
+    return {
+        'stages': {stage: summarize(samples) for stage, samples in by_stage.items()},
+        'by_resolution': {
+            label: {stage: summarize(samples) for stage, samples in per_stage.items()}
+            for label, per_stage in by_resolution.items()
+        }
+    }
+
+
+def run_short_circuit(corpus: List[Dict], repeat: int) -> Dict:
+    """So sánh validate_document có / không short-circuit trên REJECTION_MIX"""
+    per_variant = {mode: defaultdict(list) for mode in ('full', 'short_circuit')}
+    skipped = defaultdict(int)
+    mismatches = 0
+    for item in corpus:
+        outcomes = {}
+        for mode in per_variant:
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = KYCDocumentAnalyzer.validate_document(item['path'], 'national_id',
+                                                               short_circuit=(mode == 'short_circuit'))
+                samples.append((time.perf_counter() - start) * 1000)
+            per_variant[mode][item['variant']].append(float(np.median(samples)))
+            outcomes[mode] = tuple(result[key] for key in DECISION_KEYS)
+            if mode == 'short_circuit':
+                for stage in result.get('skipped_stages', []):
+                    skipped[stage] += 1
+        # Short-circuit không được làm đổi điểm (kyc_worker lấy trung bình) hay quyết định
+        mismatches += outcomes['full'] != outcomes['short_circuit']
+
+    # Thời gian trung bình có trọng số theo tỉ lệ biến thể
+    summary = {}
+    for mode, variants in per_variant.items():
+        mean_ms = sum(REJECTION_MIX[variant] * float(np.mean(times)) for variant, times in variants.items())
+        summary[mode] = {'mean_ms': round(mean_ms, 2), 'throughput_per_core': round(1000 / mean_ms, 2)}
+    summary['speedup'] = round(summary['full']['mean_ms'] / summary['short_circuit']['mean_ms'], 2)
+    summary['skipped_stages'] = dict(skipped)
+    summary['decision_mismatches'] = mismatches
+    summary['mix'] = REJECTION_MIX
+    return summary
+
+
+def run_tile_cost(corpus: List[Dict], repeat: int) -> Dict:
+    """Chi phí thêm của analyze_tiles trong validate_document so với Laplacian full-res
+
+    Cả hai đo trên cùng context đã decode: grayscale full-res, proxy của face
+    detection và khung giấy tờ đã có sẵn (validate_document dùng chung), nên chỉ
+    còn phần tính riêng của mỗi bên.
+    """
+    by_resolution = defaultdict(lambda: defaultdict(list))
+    for item in corpus:
+        ctx = ImageAnalysisContext(item['path'])
+        ctx.gray
+        ctx.scaled_gray(KYC_FACE_DETECTION_MAX_EDGE)
+        KYCDocumentAnalyzer.detect_document_type(ctx)
+        for stage, fn in (
+            ('analyze_tiles', lambda: KYCDocumentAnalyzer.analyze_tiles(ctx)),
+            ('laplacian_full', lambda: float(cv2.Laplacian(ctx.gray, cv2.CV_64F).var())),
+        ):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                by_resolution[item['resolution']][stage].append((time.perf_counter() - start) * 1000)
+
+    report = {}
+    for label, per_stage in by_resolution.items():
+        summary = {stage: summarize(samples) for stage, samples in per_stage.items()}
+        summary['ratio'] = round(summary['analyze_tiles']['p50_ms'] / summary['laplacian_full']['p50_ms'], 3)
+        report[label] = summary
+    return report
+
+
+def print_report(report: Dict):
+    print(f"{'stage':<24} {'p50 ms':>9} {'p95 ms':>9} {'img/s/core':>11}")
+    for stage, summary in report['stages'].items():
+        print(f"{stage:<24} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} {summary['throughput_per_core']:>11.2f}")
+    for label, per_stage in report['by_resolution'].items():
+        validate = per_stage['validate_document']
+        print(f"  {label:<8} validate_document p50 {validate['p50_ms']:.1f} ms, p95 {validate['p95_ms']:.1f} ms")
+    short_circuit = report.get('short_circuit')
+    if short_circuit:
+        print(f"\nRejection mix: full {short_circuit['full']['throughput_per_core']:.2f} img/s/core, "
+              f"short-circuit {short_circuit['short_circuit']['throughput_per_core']:.2f} img/s/core "
+              f"({short_circuit['speedup']:.2f}x), skipped {short_circuit['skipped_stages']}, "
+              f"score/decision mismatches {short_circuit['decision_mismatches']}")
+    tile_cost = report.get('tile_cost')
+    if tile_cost:
+        print(f"\n{'tile cost':<10} {'tiles p50':>10} {'laplacian p50':>14} {'ratio':>7}")
+        for label, summary in tile_cost.items():
+            print(f"{label:<10} {summary['analyze_tiles']['p50_ms']:>10.2f} "
+                  f"{summary['laplacian_full']['p50_ms']:>14.2f} {summary['ratio']:>7.3f}")
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> bool:
+    """In chênh lệch p50 so với baseline; False nếu có stage chậm hơn quá tolerance"""
+    ok = True
+    print(f"\n{'stage':<24} {'baseline':>9} {'current':>9} {'change':>8}")
+    for stage, summary in report['stages'].items():
+        previous = baseline['stages'].get(stage)
+        if not previous:
+            continue
+        change = summary['p50_ms'] / previous['p50_ms'] - 1
+        regressed = change > tolerance
+        ok = ok and not regressed
+        print(f"{stage:<24} {previous['p50_ms']:>9.1f} {summary['p50_ms']:>9.1f} {change:>+7.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark KYCDocumentAnalyzer on a synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS))
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON (baseline)")
+    parser.add_argument("--compare", help="So sánh với baseline JSON, exit 1 nếu có regression")
+    parser.add_argument("--rejection-mix", action="store_true",
+                        help="So sánh validate_document có / không short-circuit trên tập có tỉ lệ reject thực tế")
+    parser.add_argument("--tile-cost", action="store_true",
+                        help="So sánh analyze_tiles với Laplacian full-res trên cùng context đã decode")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Mức chậm hơn p50 cho phép (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+
+    with tempfile.TemporaryDirectory(prefix="kyc_bench_") as directory:
+        corpus = build_corpus(directory, args.resolutions)
+        thumbnail_path = os.path.join(directory, "thumbnail.jpg")
+        # Warm up: load cascade, import lazy của OpenCV / PIL
+        KYCDocumentAnalyzer.validate_document(corpus[0]['path'], 'national_id')
+        KYCDocumentAnalyzer.generate_thumbnail(corpus[0]['path'], thumbnail_path)
+
+        report = run(corpus, args.repeat, thumbnail_path)
+        if args.rejection_mix:
+            report['short_circuit'] = run_short_circuit(corpus, args.repeat)
+        if args.tile_cost:
+            report['tile_cost'] = run_tile_cost(corpus, args.repeat)
+
+    report['meta'] = {
+        'analyzer_version': analyzer_version(),
+        'corpus_seed': CORPUS_SEED,
+        'corpus_size': len(corpus),
+        'resolutions': args.resolutions,
+        'variants': list(VARIANTS),
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    print_report(report)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
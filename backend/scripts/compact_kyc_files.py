@@ -0,0 +1,126 @@
+"""
+Nén lại lossless file KYC gốc của submission đã duyệt / từ chối và chuyển
+file đã duyệt quá --archive-after-days ngày sang tier archive
+
+Chạy lại an toàn (file đã xử lý được đánh dấu compacted_at / archived_at trong
+kyc_files), dừng giữa chừng thì lần sau làm tiếp phần còn lại. Nén JPEG cần
+jpegtran trong PATH; không có thì JPEG được giữ nguyên.
+
+    cd backend && python scripts/compact_kyc_files.py --processes 4
+    cd backend && python scripts/compact_kyc_files.py --archive-after-days 30 --skip-compaction
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from utils.kyc_compaction import KYC_ARCHIVE_AFTER_DAYS, archive_content, compact_content
+from utils.kyc_file_store import FILE_COLLECTION, record_key
+
+REVIEWED_STATUSES = ["approved", "rejected"]
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+async def _reviewed_file_batches(query: Dict, batch_size: int):
+    """file_ids của các submission khớp query, theo lô"""
+    batch: List[str] = []
+    async for kyc in db.kyc_submissions.find(query, {"_id": 0, "file_ids": 1}).batch_size(batch_size):
+        batch.extend(kyc.get('file_ids', []))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def compact(executor, concurrency: int, batch_size: int) -> Dict:
+    totals = {'files': 0, 'bytes_before': 0, 'bytes_after': 0}
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def run(records: List[Dict]):
+        async with semaphore:
+            stats = await compact_content(db, executor, records)
+        for key, value in stats.items():
+            totals[key] += value
+
+    query = {"status": {"$in": REVIEWED_STATUSES}, "reviewed_at": {"$ne": None}}
+    async for file_ids in _reviewed_file_batches(query, batch_size):
+        # Nhóm theo nội dung gốc: file trùng nội dung chỉ nén một lần
+        groups = defaultdict(list)
+        async for record in db[FILE_COLLECTION].find(
+            {"file_id": {"$in": file_ids}, "compacted_at": {"$exists": False}}, {"_id": 0}
+        ):
+            groups[record['content_hash']].append(record)
+        await asyncio.gather(*[run(records) for records in groups.values()])
+        if groups:
+            saved = totals['bytes_before'] - totals['bytes_after']
+            print(f"{totals['files']} files compacted, {_format_bytes(saved)} saved, "
+                  f"{totals['files'] / (time.perf_counter() - start):.1f} files/s", flush=True)
+    return totals
+
+
+async def archive(after_days: int, batch_size: int) -> int:
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=after_days)).isoformat()
+    query = {"status": {"$in": REVIEWED_STATUSES}, "reviewed_at": {"$ne": None, "$lte": cutoff}}
+    archived = 0
+    async for file_ids in _reviewed_file_batches(query, batch_size):
+        # Chỉ archive sau khi đã nén lại (không phải đọc lại từ tier archive để nén)
+        seen = set()
+        async for record in db[FILE_COLLECTION].find({
+            "file_id": {"$in": file_ids},
+            "compacted_at": {"$exists": True},
+            "tier": {"$ne": "archive"}
+        }, {"_id": 0}):
+            key = record_key(record)
+            if key not in seen:
+                seen.add(key)
+                archived += await archive_content(db, record)
+    return archived
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Lossless recompression and archival of reviewed KYC files")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Số blob xử lý đồng thời (mặc định: 2 x processes)")
+    parser.add_argument("--batch-size", type=int, default=200, help="Số file mỗi lô đọc từ Mongo")
+    parser.add_argument("--archive-after-days", type=int, default=KYC_ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--skip-compaction", action="store_true")
+    parser.add_argument("--skip-archive", action="store_true")
+    args = parser.parse_args()
+
+    executor = ProcessPoolExecutor(max_workers=args.processes, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        if not args.skip_compaction:
+            totals = await compact(executor, args.concurrency or 2 * args.processes, args.batch_size)
+            saved = totals['bytes_before'] - totals['bytes_after']
+            ratio = saved / totals['bytes_before'] * 100 if totals['bytes_before'] else 0
+            print(f"Compaction: {totals['files']} files, {_format_bytes(totals['bytes_before'])} -> "
+                  f"{_format_bytes(totals['bytes_after'])} ({_format_bytes(saved)} saved, {ratio:.1f}%)")
+        if not args.skip_archive:
+            archived = await archive(args.archive_after_days, args.batch_size)
+            print(f"Archive: {archived} files moved to archive tier (reviewed > {args.archive_after_days} days ago)")
+    finally:
+        executor.shutdown()
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Chuyển file KYC cũ (uploads/kyc/<file_id>.<ext>, thư mục phẳng) vào kyc_file_store
+
+Mỗi file được hash, đưa vào thư mục shard theo SHA-256 (trùng nội dung thì chỉ
+giữ một bản) và ghi metadata vào kyc_files. Chạy lại an toàn: file đã có
+metadata được bỏ qua. Submission đang 'analyzing' được bỏ qua vì job phân tích
+còn giữ path cũ.
+
+    cd backend && python scripts/migrate_kyc_file_store.py
+"""
+import asyncio
+import hashlib
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from utils.image_sniffer import InvalidImageError, sniff_image
+from utils.kyc_file_store import FILE_COLLECTION, LEGACY_EXTENSIONS, UPLOAD_DIR, store_blob
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _inspect(path: Path) -> Dict:
+    """sha256, size và header ảnh (nếu có) của một file cũ"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    header: Optional[Dict] = None
+    if path.suffix != '.pdf':
+        try:
+            header = sniff_image(str(path))
+        except InvalidImageError:
+            header = None
+    return {'sha256': hasher.hexdigest(), 'size': path.stat().st_size, 'header': header or {}}
+
+
+async def migrate():
+    migrated = skipped = missing = 0
+    cursor = db.kyc_submissions.find(
+        {"status": {"$ne": "analyzing"}}, {"_id": 0, "user_id": 1, "file_ids": 1}
+    ).batch_size(500)
+    async for kyc in cursor:
+        for file_id in kyc.get('file_ids', []):
+            if await db[FILE_COLLECTION].count_documents({"file_id": file_id}, limit=1):
+                skipped += 1
+                continue
+            path = next((UPLOAD_DIR / f"{file_id}{ext}" for ext in LEGACY_EXTENSIONS
+                         if (UPLOAD_DIR / f"{file_id}{ext}").exists()), None)
+            if path is None:
+                missing += 1
+                continue
+
+            info = await asyncio.to_thread(_inspect, path)
+            await store_blob(db, path, file_id, info['sha256'], path.suffix, info['size'], kyc['user_id'], info['header'])
+            migrated += 1
+            if migrated % 1000 == 0:
+                print(f"{migrated} files migrated", flush=True)
+
+    print(f"Done: {migrated} migrated, {skipped} already in store, {missing} missing on disk")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(migrate())
+    finally:
+        client.close()
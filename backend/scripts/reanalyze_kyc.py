@@ -0,0 +1,189 @@
+"""
+Phân tích lại hàng loạt kyc_submissions sau khi analyzer thay đổi
+
+Submission được đọc tuần tự theo _id bằng cursor phía server, ảnh được phân tích
+song song trên process pool (AnalysisExecutor), kết quả ghi lại theo lô bằng
+bulk_write. Sau mỗi lô checkpoint (_id cuối cùng) được lưu vào
+kyc_reanalysis_checkpoints: chạy lại cùng --name sẽ tiếp tục từ chỗ đã dừng.
+Chỉ cập nhật analysis.* (điểm, kết quả từng file), perceptual_hashes (cùng index
+near-duplicate) và feature vector. analysis.auto_approved / requires_manual_review
+được tính lại cùng điểm (ngưỡng SystemSettings như kyc_worker) để luôn khớp
+validation_score; status của submission không bị thay đổi (auto-approve theo điểm
+mới: scripts/rescore_kyc.py --apply).
+
+    cd backend && python scripts/reanalyze_kyc.py --processes 4 --max-files-per-second 20
+    cd backend && python scripts/reanalyze_kyc.py --status pending approved --restart
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from models import SystemSettings
+from utils.analysis_executor import AnalysisExecutor, KYC_ANALYSIS_WORKERS
+from utils.kyc_analyzer import analyzer_version
+from utils.kyc_features import FEATURE_COLLECTION, feature_vector_updates
+from utils.kyc_file_store import get_files, read_blob, document_crop_temp_path, store_document_crop
+from utils.perceptual_index import HASH_COLLECTION, image_hash_update
+
+CHECKPOINT_COLLECTION = "kyc_reanalysis_checkpoints"
+
+
+async def _load_settings() -> SystemSettings:
+    settings = await db.system_settings.find_one({"id": "system_settings"}, {"_id": 0})
+    return SystemSettings(**settings) if settings else SystemSettings()
+
+
+def _read_image(record: Dict) -> Optional[Tuple[str, bytes, str]]:
+    """(path, nội dung, sha256) của file ảnh; None nếu là PDF hoặc không còn trong storage"""
+    if record['extension'] == '.pdf':
+        return None
+    try:
+        content = read_blob(record['path'])
+    except Exception:
+        return None
+    return record['path'], content, record.get('content_hash') or hashlib.sha256(content).hexdigest()
+
+
+async def _analyze_submission(executor: AnalysisExecutor, kyc: Dict, version: str,
+                              settings: SystemSettings) -> Tuple[List[UpdateOne], List[UpdateOne], List[UpdateOne], int]:
+    """(update submission, update hash index, update feature vector, số file đã phân tích)
+    cho một submission, file theo thứ tự file_ids của submission"""
+    file_ids = kyc.get('file_ids', [])
+    records = await get_files(db, file_ids)
+    file_ids = [file_id for file_id in file_ids if file_id in records]
+    images = await asyncio.gather(*[asyncio.to_thread(_read_image, records[file_id]) for file_id in file_ids])
+    files = [(file_id, image) for file_id, image in zip(file_ids, images) if image]
+    if not files:
+        return [], [], [], 0
+
+    results = await executor.validate_documents(
+        [content for _, (_, content, _) in files], kyc['id_type'],
+        crop_paths=[document_crop_temp_path() for _ in files]
+    )
+    for (_, (_, _, sha256)), result in zip(files, results):
+        await asyncio.to_thread(store_document_crop, result, sha256)
+    entries = list(zip([file_id for file_id, _ in files], results))
+    score = sum(result.get('validation_score', 0) for _, result in entries) / len(entries)
+    auto_approved = settings.kyc_auto_approval_enabled and score >= settings.kyc_auto_approval_threshold
+    perceptual_hashes = [
+        {'file_id': file_id, **result['perceptual_hash']}
+        for file_id, result in entries if result.get('perceptual_hash')
+    ]
+    hash_updates = [image_hash_update(entry['file_id'], kyc['id'], kyc['user_id'], entry) for entry in perceptual_hashes]
+    submission_update = UpdateOne({'_id': kyc['_id']}, {'$set': {
+        'analysis.validation_score': round(score, 2),
+        'analysis.auto_approved': auto_approved,
+        'analysis.requires_manual_review': not auto_approved,
+        'analysis.file_analyses': [{'file_id': file_id, 'analysis': result} for file_id, result in entries],
+        'analysis.analyzer_version': version,
+        'analysis.reanalyzed_at': datetime.now(timezone.utc).isoformat(),
+        'perceptual_hashes': perceptual_hashes
+    }})
+    return ([submission_update], [update for update in hash_updates if update],
+            feature_vector_updates(kyc['id'], kyc['id_type'], entries, version), len(entries))
+
+
+def _format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Resumable bulk re-analysis of KYC submissions")
+    parser.add_argument("--name", help="Tên checkpoint (mặc định: analyzer version hiện tại)")
+    parser.add_argument("--status", nargs="+", help="Chỉ phân tích submission có các status này")
+    parser.add_argument("--processes", type=int, default=KYC_ANALYSIS_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=20, help="Số submission mỗi lô bulk_write / checkpoint")
+    parser.add_argument("--max-files-per-second", type=float, default=0,
+                        help="Giới hạn tốc độ (0: không giới hạn) để không chiếm Mongo / disk production")
+    parser.add_argument("--restart", action="store_true", help="Bỏ checkpoint cũ, chạy lại từ đầu")
+    args = parser.parse_args()
+
+    version = analyzer_version()
+    settings = await _load_settings()
+    name = args.name or f"reanalyze:{version}"
+    if args.restart:
+        await db[CHECKPOINT_COLLECTION].delete_one({'_id': name})
+    checkpoint = await db[CHECKPOINT_COLLECTION].find_one({'_id': name}) or {}
+
+    query = {}
+    if args.status:
+        query['status'] = {'$in': args.status}
+    if checkpoint.get('last_id'):
+        query['_id'] = {'$gt': checkpoint['last_id']}
+        print(f"Resuming '{name}' after {checkpoint['last_id']} "
+              f"({checkpoint.get('submissions', 0)} submissions already done)")
+
+    remaining = await db.kyc_submissions.count_documents(query)
+    print(f"{remaining} submission(s) to analyze with {args.processes} processes (analyzer {version})")
+
+    # Số file đồng thời đã bị giới hạn bởi --batch-size, không cần queue limit của API
+    executor = AnalysisExecutor(max_workers=args.processes, max_queue=sys.maxsize)
+    projection = {'_id': 1, 'id': 1, 'user_id': 1, 'id_type': 1, 'file_ids': 1}
+    cursor = db.kyc_submissions.find(query, projection).sort('_id', 1).batch_size(args.batch_size)
+
+    done_submissions = done_files = 0
+    start = time.perf_counter()
+
+    async def flush(page: List[Dict]):
+        nonlocal done_submissions, done_files
+        outcomes = await asyncio.gather(*[_analyze_submission(executor, kyc, version, settings) for kyc in page])
+        submission_ops = [op for ops, _, _, _ in outcomes for op in ops]
+        hash_ops = [op for _, ops, _, _ in outcomes for op in ops]
+        feature_ops = [op for _, _, ops, _ in outcomes for op in ops]
+        if submission_ops:
+            await db.kyc_submissions.bulk_write(submission_ops, ordered=False)
+        if hash_ops:
+            await db[HASH_COLLECTION].bulk_write(hash_ops, ordered=False)
+        if feature_ops:
+            await db[FEATURE_COLLECTION].bulk_write(feature_ops, ordered=False)
+
+        # Checkpoint chỉ tiến sau khi lô đã được ghi: dừng giữa chừng thì lô bị làm lại
+        done_submissions += len(page)
+        done_files += sum(count for _, _, _, count in outcomes)
+        await db[CHECKPOINT_COLLECTION].update_one({'_id': name}, {
+            '$set': {'last_id': page[-1]['_id'], 'analyzer_version': version,
+                     'updated_at': datetime.now(timezone.utc).isoformat()},
+            '$inc': {'submissions': len(page), 'files': sum(count for _, _, _, count in outcomes)}
+        }, upsert=True)
+
+        elapsed = time.perf_counter() - start
+        if args.max_files_per_second > 0:
+            # Rate cap: ngủ cho tới khi tốc độ trung bình về dưới ngưỡng
+            delay = done_files / args.max_files_per_second - elapsed
+            if delay > 0:
+                await asyncio.sleep(delay)
+                elapsed += delay
+        rate = done_submissions / elapsed if elapsed else 0
+        eta = (remaining - done_submissions) / rate if rate else 0
+        print(f"{done_submissions}/{remaining} submissions, {done_files} files, "
+              f"{done_files / elapsed if elapsed else 0:.1f} files/s, ETA {_format_eta(eta)}", flush=True)
+
+    try:
+        page = []
+        async for kyc in cursor:
+            page.append(kyc)
+            if len(page) >= args.batch_size:
+                await flush(page)
+                page = []
+        if page:
+            await flush(page)
+        print(f"Done: {done_submissions} submissions, {done_files} files in {_format_eta(time.perf_counter() - start)}")
+    finally:
+        executor.shutdown()
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
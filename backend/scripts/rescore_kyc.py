@@ -0,0 +1,109 @@
+"""
+Tính lại validation_score / quyết định KYC từ feature vector đã lưu (không đọc lại ảnh)
+
+Ngưỡng auto-approve mặc định lấy từ SystemSettings (kyc_auto_approval_threshold,
+kyc_auto_approval_enabled), giống kyc_worker. Mặc định chỉ báo cáo; --apply ghi
+điểm mới cho các submission còn 'pending' và auto-approve những submission đạt
+ngưỡng. Submission đã được duyệt / từ chối không bị thay đổi.
+
+    cd backend && python scripts/rescore_kyc.py
+    cd backend && python scripts/rescore_kyc.py --auto-approval-threshold 75 --apply
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from middleware import log_audit
+from models import SystemSettings
+from utils.kyc_features import load_feature_matrix, score_features, score_submissions
+
+
+async def _load_settings() -> SystemSettings:
+    settings = await db.system_settings.find_one({"id": "system_settings"}, {"_id": 0})
+    return SystemSettings(**settings) if settings else SystemSettings()
+
+
+async def _apply(rescored: dict, threshold: float, auto_approval_enabled: bool) -> dict:
+    """Ghi kết quả cho submission còn pending, trả về số submission đã cập nhật / auto-approve"""
+    score_by_id = dict(zip(rescored['kyc_id'], rescored['validation_score']))
+    updated = approved = 0
+    async for kyc in db.kyc_submissions.find({"status": "pending"}, {"_id": 0, "id": 1, "user_id": 1}):
+        if kyc['id'] not in score_by_id:
+            continue
+        score = round(float(score_by_id[kyc['id']]), 2)
+        auto_approved = auto_approval_enabled and score >= threshold
+        now = datetime.now(timezone.utc).isoformat()
+        update = {
+            'analysis.validation_score': score,
+            'analysis.auto_approved': auto_approved,
+            'analysis.requires_manual_review': not auto_approved,
+            'analysis.rescored_at': now
+        }
+        if auto_approved:
+            update.update({
+                'status': 'approved',
+                'reviewed_at': now,
+                'admin_note': 'Automatically approved after re-scoring'
+            })
+
+        # Điều kiện status: không ghi đè submission admin vừa duyệt trong lúc chạy
+        result = await db.kyc_submissions.update_one({'id': kyc['id'], 'status': 'pending'}, {'$set': update})
+        if result.modified_count == 0:
+            continue
+        updated += 1
+        if auto_approved:
+            approved += 1
+            await db.users.update_one({'id': kyc['user_id']}, {'$set': {'kyc_status': 'verified'}})
+            await log_audit(db, kyc['user_id'], "kyc_rescored",
+                            {"kyc_id": kyc['id'], "validation_score": score, "auto_approved": True})
+    return {'updated': updated, 'approved': approved}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Re-score KYC submissions from stored feature vectors")
+    parser.add_argument("--auto-approval-threshold", type=float,
+                        help="Mặc định: SystemSettings.kyc_auto_approval_threshold")
+    parser.add_argument("--apply", action="store_true", help="Ghi kết quả cho các submission đang pending")
+    args = parser.parse_args()
+
+    settings = await _load_settings()
+    auto_threshold = (args.auto_approval_threshold if args.auto_approval_threshold is not None
+                      else settings.kyc_auto_approval_threshold)
+
+    try:
+        start = time.perf_counter()
+        kyc_ids, face_required, matrix = await load_feature_matrix(db)
+        loaded = time.perf_counter()
+        if not len(kyc_ids):
+            print("No feature vectors stored yet")
+            return
+
+        files = score_features(matrix, face_required, auto_threshold)
+        rescored = score_submissions(kyc_ids, files['validation_score'], auto_threshold)
+        scored = time.perf_counter()
+
+        print(f"Auto-approval >= {auto_threshold}"
+              f"{'' if settings.kyc_auto_approval_enabled else ' (disabled in SystemSettings)'}")
+        print(f"Files:       {len(kyc_ids)} (load {loaded - start:.2f}s, score {scored - loaded:.3f}s)")
+        print(f"Submissions: {len(rescored['kyc_id'])}")
+        print(f"  auto-approved:  {int(rescored['auto_approved'].sum())}")
+        print(f"  manual review:  {int((~rescored['auto_approved'] & (rescored['validation_score'] >= 50)).sum())}")
+        print(f"  below 50:       {int((rescored['validation_score'] < 50).sum())}")
+        print(f"File decisions: auto-approved {int(files['auto_approved'].sum())}, "
+              f"manual {int(files['requires_manual_review'].sum())}, rejected {int(files['auto_rejected'].sum())}")
+
+        if args.apply:
+            counts = await _apply(rescored, auto_threshold, settings.kyc_auto_approval_enabled)
+            print(f"Applied: {counts['updated']} pending submission(s) updated, {counts['approved']} auto-approved")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
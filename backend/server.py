@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 from pathlib import Path
@@ -58,9 +59,15 @@ async def lifespan(app: FastAPI):
     await seed_default_admin()
     logger.info("✅ Database initialized successfully")
     
+    # Pool precheck KYC: spawn + import OpenCV chạy nền, không chặn startup
+    from utils.analysis_executor import precheck_executor
+    warm_up = asyncio.create_task(precheck_executor.warm_up())
+    
     yield
     
     # Shutdown
+    warm_up.cancel()
+    precheck_executor.shutdown()
     client.close()
     logger.info("✅ MongoDB connection closed")
 
@@ -0,0 +1,208 @@
+"""Process pool cho phân tích ảnh KYC
+Chạy OpenCV ngoài event loop, giới hạn số job đang chờ để không bị quá tải
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Số process phân tích (mặc định = số core)
+KYC_ANALYSIS_WORKERS = int(os.getenv("KYC_ANALYSIS_WORKERS", os.cpu_count() or 2))
+# Số file tối đa đang chạy + đang chờ trong pool
+KYC_ANALYSIS_MAX_QUEUE = int(os.getenv("KYC_ANALYSIS_MAX_QUEUE", KYC_ANALYSIS_WORKERS * 4))
+# Gợi ý client thử lại sau bao nhiêu giây khi queue đầy
+KYC_ANALYSIS_RETRY_AFTER = int(os.getenv("KYC_ANALYSIS_RETRY_AFTER", 5))
+# Pool riêng cho /kyc/precheck trong process API (preview nhỏ, cần latency thấp),
+# không chiếm KYC_ANALYSIS_WORKERS dành cho kyc_worker
+KYC_PRECHECK_WORKERS = int(os.getenv("KYC_PRECHECK_WORKERS", 1))
+KYC_PRECHECK_MAX_QUEUE = int(os.getenv("KYC_PRECHECK_MAX_QUEUE", KYC_PRECHECK_WORKERS * 8))
+# Thời gian tối đa chờ mọi worker khởi động xong khi warm up lúc startup
+KYC_ANALYSIS_WARM_UP_TIMEOUT = float(os.getenv("KYC_ANALYSIS_WARM_UP_TIMEOUT", 60))
+
+
+class AnalysisQueueFull(Exception):
+    """Queue phân tích đã đầy, request nên được thử lại sau"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("KYC analysis queue is full")
+        self.retry_after = retry_after
+
+
+def _init_worker():
+    """Chạy một lần khi process worker khởi động"""
+    import cv2
+    # Mỗi process đã là một luồng song song, tránh OpenCV tự mở thêm thread
+    cv2.setNumThreads(1)
+    import numpy as np
+    from utils.kyc_analyzer import KYCDocumentAnalyzer, get_face_cascade
+    # Chạy thử precheck trên ảnh nhỏ và load cascade: request đầu tiên không phải
+    # trả chi phí khởi tạo lần đầu của OpenCV (decode, Canny, contour...)
+    image = np.full((240, 320, 3), 96, dtype=np.uint8)
+    cv2.rectangle(image, (40, 40), (280, 190), (220, 220, 220), -1)
+    KYCDocumentAnalyzer.precheck(cv2.imencode('.jpg', image)[1].tobytes())
+    get_face_cascade()
+
+
+def _validate_document(file_path: str, id_type: str, crop_path: Optional[str] = None) -> Dict:
+    from utils.kyc_analyzer import KYCDocumentAnalyzer
+    return KYCDocumentAnalyzer.validate_document(file_path, id_type, crop_path=crop_path)
+
+
+def _validate_shared_document(shm_name: str, size: int, id_type: str, crop_path: Optional[str] = None) -> Dict:
+    """Phân tích buffer nằm trong shared memory, decode trực tiếp không copy qua pipe"""
+    from utils.kyc_analyzer import KYCDocumentAnalyzer
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buffer = shm.buf[:size]
+        try:
+            return KYCDocumentAnalyzer.validate_document(buffer, id_type, crop_path=crop_path)
+        finally:
+            buffer.release()
+    finally:
+        shm.close()
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def _precheck_document(content: bytes) -> Dict:
+    from utils.kyc_analyzer import KYCDocumentAnalyzer
+    return KYCDocumentAnalyzer.precheck(content)
+
+
+class AnalysisExecutor:
+    """Bounded process pool cho KYCDocumentAnalyzer"""
+
+    def __init__(self, max_workers: int = KYC_ANALYSIS_WORKERS, max_queue: int = KYC_ANALYSIS_MAX_QUEUE,
+                 retry_after: int = KYC_ANALYSIS_RETRY_AFTER):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Tạo lazy để script / test không load OpenCV nếu chưa cần (API gọi warm_up lúc startup)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                # spawn: không fork process đang có thread của motor/uvicorn
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+            logger.info(f"KYC analysis pool started with {self.max_workers} workers")
+        return self._pool
+
+    async def warm_up(self, timeout: float = KYC_ANALYSIS_WARM_UP_TIMEOUT):
+        """Khởi động đủ max_workers process và chờ initializer của từng process chạy xong
+
+        Spawn + import cv2 / skimage + lần chạy đầu mất cỡ giây: không để request
+        đầu tiên sau khi deploy phải chờ. Mỗi lần submit khi chưa có worker rảnh, pool
+        spawn thêm một process; task chỉ được nhận sau khi initializer xong, nên lặp
+        lại cho tới khi mọi pid đều đã trả lời. Lỗi / timeout chỉ được log, không raise.
+        """
+        start = time.perf_counter()
+        ready = set()
+        try:
+            loop = asyncio.get_running_loop()
+            pool = self._get_pool()
+            while len(ready) < self.max_workers:
+                ready.update(await asyncio.gather(*[
+                    loop.run_in_executor(pool, _worker_pid) for _ in range(self.max_workers)
+                ]))
+                if time.perf_counter() - start > timeout:
+                    logger.warning(f"KYC analysis pool warm up timed out: {len(ready)}/{self.max_workers} workers ready")
+                    return
+                if len(ready) < self.max_workers:
+                    await asyncio.sleep(0.05)
+        except Exception as e:
+            # Không làm hỏng startup: pool được tạo lại (lazy) ở request đầu tiên
+            logger.error(f"KYC analysis pool warm up failed: {str(e)}")
+            self.shutdown()
+            return
+        logger.info(f"KYC analysis pool warmed up in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def _acquire(self, count: int):
+        if self._pending + count > self.max_queue:
+            raise AnalysisQueueFull(self.retry_after)
+        self._pending += count
+
+    async def validate_documents(self, sources: List[Union[str, bytes]], id_type: str,
+                                 crop_paths: Optional[List[Optional[str]]] = None) -> List[Dict]:
+        """Phân tích song song các file của một submission
+
+        sources: path, hoặc nội dung file đã đọc sẵn (bytes) - được đặt vào
+        shared memory để process worker decode trực tiếp, không pickle qua pipe.
+        crop_paths: (tuỳ chọn) nơi ghi crop giấy tờ đã nắn phẳng cho từng source.
+        Cả submission được nhận hoặc từ chối cùng lúc (AnalysisQueueFull).
+        File lỗi trả về dict có 'error' thay vì raise.
+        """
+        if not sources:
+            return []
+
+        self._acquire(len(sources))
+        segments = []
+        try:
+            loop = asyncio.get_running_loop()
+            pool = self._get_pool()
+            tasks = []
+            for source, crop_path in zip(sources, crop_paths or [None] * len(sources)):
+                if isinstance(source, str) or len(source) == 0:
+                    tasks.append(loop.run_in_executor(pool, _validate_document, source, id_type, crop_path))
+                else:
+                    shm = shared_memory.SharedMemory(create=True, size=len(source))
+                    segments.append(shm)
+                    shm.buf[:len(source)] = source
+                    tasks.append(loop.run_in_executor(pool, _validate_shared_document, shm.name, len(source), id_type, crop_path))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except BrokenProcessPool:
+            # Worker bị kill (OOM, segfault...): bỏ pool cũ, lần gọi sau tạo lại
+            logger.error("KYC analysis pool is broken, restarting on next request")
+            self.shutdown()
+            raise
+        finally:
+            self._pending -= len(sources)
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+        if any(isinstance(result, BrokenProcessPool) for result in results):
+            logger.error("KYC analysis pool is broken, restarting on next request")
+            self.shutdown()
+
+        return [
+            {'error': str(result), 'validation_score': 0} if isinstance(result, BaseException) else result
+            for result in results
+        ]
+
+    async def precheck(self, content: bytes) -> Dict:
+        """KYCDocumentAnalyzer.precheck trên process pool (preview nhỏ: truyền bytes qua pipe)"""
+        self._acquire(1)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_pool(), _precheck_document, content)
+        except BrokenProcessPool:
+            logger.error("KYC analysis pool is broken, restarting on next request")
+            self.shutdown()
+            raise
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+precheck_executor = AnalysisExecutor(max_workers=KYC_PRECHECK_WORKERS, max_queue=KYC_PRECHECK_MAX_QUEUE)
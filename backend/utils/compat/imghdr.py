@@ -18,6 +18,9 @@ def what(file, h=None):
 def test_jpeg(h):
     if h[6:10] in (b'JFIF', b'Exif'):
         return 'jpeg'
+    # JPEG không có marker JFIF/Exif (vd. ICC profile hoặc DQT đứng đầu)
+    if h[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
 
 def test_png(h):
     if h[:8] == b'\211PNG\r\n\032\n':
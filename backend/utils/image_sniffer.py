@@ -0,0 +1,160 @@
+"""Nhận diện định dạng và kích thước ảnh chỉ từ header
+Đọc vài KB đầu file (magic bytes, JPEG SOF / PNG IHDR, EXIF orientation),
+không decode pixel, không cần OpenCV.
+"""
+import io
+import struct
+from typing import BinaryIO, Dict, Optional, Union
+
+from utils.compat import imghdr
+
+# Số byte tối đa đọc để nhận diện định dạng
+SNIFF_HEADER_BYTES = 32
+# Số byte tối đa của segment APP1 (EXIF) được đọc để tìm orientation
+EXIF_READ_BYTES = 4096
+# Giới hạn số segment JPEG duyệt qua trước SOF (chống file bất thường)
+MAX_JPEG_SEGMENTS = 64
+
+PDF_MAGIC = b'%PDF-'
+
+# Kích thước tối thiểu của ảnh KYC, dùng chung cho upload và KYCDocumentAnalyzer
+MIN_KYC_IMAGE_WIDTH = 800
+MIN_KYC_IMAGE_HEIGHT = 600
+# Ảnh preview cho /user/kyc/precheck (client thu nhỏ trước khi gửi)
+KYC_PRECHECK_MAX_EDGE = 1280
+KYC_PRECHECK_MAX_BYTES = 1024 * 1024
+
+# SOF0..SOF15 trừ DHT (C4), JPG (C8), DAC (CC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Marker không có trường length: TEM, RST0..RST7
+_JPEG_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+ImageSource = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+
+class InvalidImageError(Exception):
+    """File không phải ảnh hợp lệ hoặc header bị hỏng"""
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise InvalidImageError("Unexpected end of file in image header")
+    return data
+
+
+def _exif_orientation(payload: bytes) -> int:
+    """Đọc tag Orientation (0x0112) trong IFD0 của segment APP1 Exif, mặc định 1"""
+    tiff = payload[6:]
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return 1
+    try:
+        ifd_offset = struct.unpack_from(endian + 'I', tiff, 4)[0]
+        count = struct.unpack_from(endian + 'H', tiff, ifd_offset)[0]
+        for i in range(count):
+            entry = ifd_offset + 2 + i * 12
+            tag, _, _, value = struct.unpack_from(endian + 'HHIH', tiff, entry)
+            if tag == 0x0112:
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        # IFD0 nằm ngoài phần đã đọc hoặc bị cắt: bỏ qua orientation
+        pass
+    return 1
+
+
+def _parse_jpeg(f: BinaryIO, start: int) -> Dict:
+    """Duyệt các segment tới SOF, payload không cần thiết được seek qua"""
+    f.seek(start + 2)
+    orientation = 1
+    for _ in range(MAX_JPEG_SEGMENTS):
+        if _read_exact(f, 1) != b'\xff':
+            raise InvalidImageError("Invalid JPEG marker")
+        marker = _read_exact(f, 1)[0]
+        while marker == 0xFF:  # fill bytes
+            marker = _read_exact(f, 1)[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):  # EOI / SOS trước SOF
+            break
+
+        length = struct.unpack('>H', _read_exact(f, 2))[0]
+        if length < 2:
+            raise InvalidImageError("Invalid JPEG segment length")
+
+        if marker in _JPEG_SOF_MARKERS:
+            _, height, width, components = struct.unpack('>BHHB', _read_exact(f, 6))
+            if width == 0 or height == 0 or components == 0:
+                raise InvalidImageError("Invalid JPEG dimensions")
+            return {'format': 'jpeg', 'width': width, 'height': height, 'orientation': orientation}
+
+        if marker == 0xE1 and orientation == 1:
+            payload = f.read(min(length - 2, EXIF_READ_BYTES))
+            if payload[:6] == b'Exif\x00\x00':
+                orientation = _exif_orientation(payload)
+            f.seek(length - 2 - len(payload), io.SEEK_CUR)
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+
+    raise InvalidImageError("JPEG frame header (SOF) not found")
+
+
+def _parse_png(f: BinaryIO, start: int) -> Dict:
+    f.seek(start + 8)
+    length, chunk_type, width, height = struct.unpack('>I4sII', _read_exact(f, 16))
+    if chunk_type != b'IHDR' or length != 13:
+        raise InvalidImageError("PNG IHDR chunk not found")
+    if width == 0 or height == 0:
+        raise InvalidImageError("Invalid PNG dimensions")
+    return {'format': 'png', 'width': width, 'height': height, 'orientation': 1}
+
+
+def sniff_image(source: ImageSource) -> Optional[Dict]:
+    """Nhận diện ảnh JPEG/PNG từ header
+
+    Trả về {'format', 'width', 'height', 'orientation'}, width/height là kích
+    thước hiển thị (đã xoay theo EXIF orientation, giống cv2.imread).
+    Trả về None nếu không phải JPEG/PNG, raise InvalidImageError nếu đúng
+    magic bytes nhưng header bị hỏng / bị cắt.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return sniff_image(f)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return sniff_image(io.BytesIO(source))
+
+    f = source
+    start = f.tell()
+    try:
+        kind = imghdr.what(None, f.read(SNIFF_HEADER_BYTES))
+        if kind == 'jpeg':
+            info = _parse_jpeg(f, start)
+        elif kind == 'png':
+            info = _parse_png(f, start)
+        else:
+            return None
+    finally:
+        f.seek(start)
+
+    # Orientation 5..8 xoay 90 độ: đổi chiều rộng / cao
+    if info['orientation'] >= 5:
+        info['width'], info['height'] = info['height'], info['width']
+    return info
+
+
+def is_pdf(source: ImageSource) -> bool:
+    """Kiểm tra magic bytes PDF (%PDF- trong 1KB đầu, theo spec)"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return is_pdf(f)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return PDF_MAGIC in bytes(source[:1024])
+
+    start = source.tell()
+    try:
+        return PDF_MAGIC in source.read(1024)
+    finally:
+        source.seek(start)
@@ -0,0 +1,70 @@
+"""Cache kết quả validate_document theo nội dung file
+Key: SHA-256 của file + analyzer version + id_type. File gửi lại y hệt (thường
+gặp sau khi bị reject) dùng lại kết quả cũ, không phải decode / phân tích lại.
+Eviction: TTL tính từ lần dùng gần nhất + giới hạn số entry (xóa entry cũ nhất).
+"""
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+
+CACHE_COLLECTION = "kyc_analysis_cache"
+
+KYC_ANALYSIS_CACHE_TTL_DAYS = int(os.getenv("KYC_ANALYSIS_CACHE_TTL_DAYS", 30))
+KYC_ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("KYC_ANALYSIS_CACHE_MAX_ENTRIES", 100000))
+
+
+def _expires_at() -> datetime:
+    # datetime (không phải ISO string): TTL index của Mongo chỉ áp dụng cho kiểu Date
+    return datetime.now(timezone.utc) + timedelta(days=KYC_ANALYSIS_CACHE_TTL_DAYS)
+
+
+async def get_cached_results(db, content_hashes: List[str], id_type: str, analyzer_version: str) -> Dict[str, Dict]:
+    """Trả về {content_hash: validation_result} cho các hash đã có trong cache
+
+    Entry được dùng sẽ gia hạn TTL.
+    """
+    if not content_hashes:
+        return {}
+
+    query = {
+        "content_hash": {"$in": content_hashes},
+        "id_type": id_type,
+        "analyzer_version": analyzer_version
+    }
+    entries = await db[CACHE_COLLECTION].find(query, {"_id": 0, "content_hash": 1, "result": 1}).to_list(None)
+    if entries:
+        await db[CACHE_COLLECTION].update_many(
+            {**query, "content_hash": {"$in": [entry["content_hash"] for entry in entries]}},
+            {"$set": {"expires_at": _expires_at()}, "$inc": {"hits": 1}}
+        )
+    return {entry["content_hash"]: entry["result"] for entry in entries}
+
+
+async def store_result(db, content_hash: str, id_type: str, analyzer_version: str, result: Dict):
+    """Lưu kết quả phân tích (kết quả lỗi không được cache)"""
+    if result.get("error"):
+        return
+
+    await db[CACHE_COLLECTION].update_one(
+        {"content_hash": content_hash, "id_type": id_type, "analyzer_version": analyzer_version},
+        {
+            "$set": {"result": result, "expires_at": _expires_at()},
+            "$setOnInsert": {"created_at": datetime.now(timezone.utc).isoformat(), "hits": 0}
+        },
+        upsert=True
+    )
+
+
+async def trim_cache(db, max_entries: int = KYC_ANALYSIS_CACHE_MAX_ENTRIES) -> int:
+    """Xóa các entry sắp hết hạn nhất (ít được dùng gần đây nhất) khi vượt max_entries
+
+    Trả về số entry đã xóa.
+    """
+    # estimated_document_count đọc metadata, đủ rẻ để gọi mỗi vòng poll
+    excess = await db[CACHE_COLLECTION].estimated_document_count() - max_entries
+    if excess <= 0:
+        return 0
+
+    oldest = await db[CACHE_COLLECTION].find({}, {"_id": 1}).sort("expires_at", 1).limit(excess).to_list(None)
+    result = await db[CACHE_COLLECTION].delete_many({"_id": {"$in": [entry["_id"] for entry in oldest]}})
+    return result.deleted_count
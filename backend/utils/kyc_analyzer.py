@@ -3,83 +3,420 @@ Tự động phân tích chất lượng ảnh, định dạng document và vali
 """
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
 import io
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional, Union
+from functools import cached_property, lru_cache
+from contextlib import contextmanager
+from itertools import product
 from datetime import datetime, timezone
 import base64
 from skimage.metrics import structural_similarity as ssim
+import heapq
 import logging
+import os
+import time
+
+from utils.image_sniffer import (
+    MIN_KYC_IMAGE_WIDTH, MIN_KYC_IMAGE_HEIGHT, KYC_PRECHECK_MAX_EDGE, InvalidImageError, sniff_image
+)
 
 logger = logging.getLogger(__name__)
 
+# Cạnh dài tối đa của ảnh proxy dùng cho face detection
+KYC_FACE_DETECTION_MAX_EDGE = int(os.getenv('KYC_FACE_DETECTION_MAX_EDGE', 800))
+
+# Chế độ tính quality metrics: 'full' (full-res) hoặc 'proxy' (ảnh thu nhỏ + hiệu chỉnh)
+KYC_QUALITY_MODE = os.getenv('KYC_QUALITY_MODE', 'full')
+KYC_QUALITY_PROXY_MAX_EDGE = int(os.getenv('KYC_QUALITY_PROXY_MAX_EDGE', 1600))
+
+# Số contour lớn nhất (theo diện tích) được thử approxPolyDP khi tìm khung giấy tờ
+KYC_DOCUMENT_CONTOUR_TOP_K = int(os.getenv('KYC_DOCUMENT_CONTOUR_TOP_K', 10))
+
+# Cạnh dài tối đa của ảnh giấy tờ đã nắn phẳng (derived artifact lưu cạnh file gốc)
+KYC_DOCUMENT_CROP_MAX_EDGE = int(os.getenv('KYC_DOCUMENT_CROP_MAX_EDGE', 1200))
+KYC_DOCUMENT_CROP_QUALITY = int(os.getenv('KYC_DOCUMENT_CROP_QUALITY', 90))
+
+# Tăng khi logic phân tích thay đổi: kết quả cache của version cũ không được dùng lại
+KYC_ANALYZER_VERSION = 10
+
+
+def analyzer_version() -> str:
+    """Version kết quả phân tích, gồm cả các cấu hình làm thay đổi kết quả"""
+    return f"{KYC_ANALYZER_VERSION}:{KYC_QUALITY_MODE}-{KYC_QUALITY_PROXY_MAX_EDGE}:{KYC_FACE_DETECTION_MAX_EDGE}"
+
+
+@lru_cache(maxsize=1)
+def get_face_cascade() -> cv2.CascadeClassifier:
+    """Haar cascade được parse một lần cho mỗi process"""
+    return cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+
+class ImageAnalysisContext:
+    """Decode ảnh một lần, các đại lượng trung gian tính lazy và memoize
+
+    Dùng chung giữa analyze_image_quality, detect_document_type và detect_face
+    để không phải imread / cvtColor / Canny lặp lại cho cùng một file.
+    """
+
+    def __init__(self, source: Union[str, bytes, bytearray, memoryview]):
+        """source: đường dẫn file hoặc buffer chứa file ảnh đã encode (JPEG/PNG)"""
+        self.source = source
+        self._scaled: Dict[int, Tuple[np.ndarray, float]] = {}
+        self._scaled_gray: Dict[int, np.ndarray] = {}
+        self._scaled_edges: Dict[int, np.ndarray] = {}
+        # Thời gian (ms) cộng dồn theo stage, xem timed()
+        self.timings: Dict[str, float] = {}
+        # Kết quả trung gian dùng lại giữa các lần gọi trên cùng context
+        self.memo: Dict[Tuple, object] = {}
+
+    @classmethod
+    def from_image(cls, image: np.ndarray) -> 'ImageAnalysisContext':
+        """Context cho ảnh BGR đã có sẵn trong bộ nhớ (không decode)"""
+        ctx = cls(b'')
+        ctx.image = image
+        return ctx
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Đo thời gian một stage, cộng dồn vào self.timings[stage]"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+    @cached_property
+    def image(self) -> Optional[np.ndarray]:
+        """Ảnh BGR đã decode (None nếu không đọc được)"""
+        if isinstance(self.source, str):
+            return cv2.imread(self.source)
+        if len(self.source) == 0:
+            return None
+        # np.frombuffer không copy: decode thẳng từ buffer (kể cả shared memory)
+        return cv2.imdecode(np.frombuffer(self.source, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    @property
+    def is_valid(self) -> bool:
+        return self.image is not None
+
+    @property
+    def height(self) -> int:
+        return self.image.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.image.shape[1]
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        return cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+
+    def scaled_image(self, max_edge: int) -> Tuple[np.ndarray, float]:
+        """Ảnh BGR thu nhỏ sao cho cạnh dài <= max_edge, kèm hệ số scale (<= 1)"""
+        if max_edge not in self._scaled:
+            # Thu nhỏ theo hệ số nguyên: INTER_AREA có fast path khi chia hết,
+            # nhanh hơn nhiều lần so với hệ số lẻ (bỏ tối đa factor-1 pixel ở mép)
+            factor = -(-max(self.height, self.width) // max_edge)
+            if factor > 1:
+                height, width = self.height // factor, self.width // factor
+                image = cv2.resize(self.image[:height * factor, :width * factor], (width, height),
+                                   interpolation=cv2.INTER_AREA)
+            else:
+                image = self.image
+            self._scaled[max_edge] = (image, 1.0 / factor)
+        return self._scaled[max_edge]
+
+    def scaled_gray(self, max_edge: int) -> Tuple[np.ndarray, float]:
+        """Grayscale của scaled_image, kèm hệ số scale"""
+        image, scale = self.scaled_image(max_edge)
+        if max_edge not in self._scaled_gray:
+            self._scaled_gray[max_edge] = self.gray if scale == 1.0 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return self._scaled_gray[max_edge], scale
+
+    def scaled_edges(self, max_edge: int) -> Tuple[np.ndarray, float]:
+        """Canny trên scaled_gray, kèm hệ số scale"""
+        gray, scale = self.scaled_gray(max_edge)
+        if max_edge not in self._scaled_edges:
+            self._scaled_edges[max_edge] = self.edges if scale == 1.0 else cv2.Canny(gray, 50, 150)
+        return self._scaled_edges[max_edge], scale
+
+    @cached_property
+    def edges(self) -> np.ndarray:
+        return cv2.Canny(self.gray, 50, 150)
+
+    @cached_property
+    def color_histograms(self) -> List[np.ndarray]:
+        return [cv2.calcHist([self.image], [i], None, [256], [0, 256]) for i in range(3)]
+
+
+# Path, buffer (bytes / memoryview) hoặc context đã có
+AnalysisSource = Union[str, bytes, bytearray, memoryview, ImageAnalysisContext]
+
+
 class KYCDocumentAnalyzer:
     """Advanced document analysis for KYC verification"""
     
     # Quality thresholds
-    MIN_IMAGE_WIDTH = 800
-    MIN_IMAGE_HEIGHT = 600
+    MIN_IMAGE_WIDTH = MIN_KYC_IMAGE_WIDTH
+    MIN_IMAGE_HEIGHT = MIN_KYC_IMAGE_HEIGHT
     MIN_BRIGHTNESS = 30
     MAX_BRIGHTNESS = 225
     MIN_SHARPNESS = 100
     MIN_FILE_SIZE = 50000  # 50KB
     MAX_FILE_SIZE = 10485760  # 10MB
+    # Kích thước mặt tối thiểu, tính theo cạnh ngắn của ảnh
+    MIN_FACE_RATIO = 0.04
+    # Trọng số các component của quality_score
+    QUALITY_WEIGHTS = {
+        'resolution': 0.25,
+        'brightness': 0.20,
+        'sharpness': 0.25,
+        'contrast': 0.15,
+        'edge': 0.10,
+        'color': 0.05
+    }
+    # Khung giấy tờ phải chiếm ít nhất tỉ lệ này của ảnh mới dùng làm vùng tìm mặt
+    MIN_DOCUMENT_ROI_RATIO = 0.10
+    # Nới rộng vùng tìm mặt quanh khung giấy tờ (tỉ lệ theo kích thước khung)
+    DOCUMENT_ROI_MARGIN = 0.05
+    # Lưới tile (hàng x cột) cho bản đồ sharpness / glare
+    TILE_GRID = (6, 8)
+    # Pixel >= mức này coi là cháy sáng (glare)
+    GLARE_LEVEL = 250
+    # Tỉ lệ pixel cháy sáng tối đa của một tile
+    MAX_TILE_GLARE_RATIO = 0.15
+    # Cạnh dài tối đa của ảnh preview gửi lên /user/kyc/precheck
+    PRECHECK_MAX_EDGE = KYC_PRECHECK_MAX_EDGE
+    # Loại giấy tờ bắt buộc có ảnh chân dung
+    PHOTO_ID_TYPES = ('passport', 'national_id', 'driver_license')
+    # Các check cộng vào validation_score (quality_good chỉ ảnh hưởng quyết định của file)
+    SCORE_CHECKS = ('quality_valid', 'document_ok', 'face_ok')
+    # quality_score tối thiểu để một file được tự duyệt (quality_good)
+    GOOD_QUALITY_SCORE = 60
+    
+    @staticmethod
+    def _context(source: AnalysisSource) -> ImageAnalysisContext:
+        """Nhận path, buffer hoặc context có sẵn, luôn trả về context"""
+        if isinstance(source, ImageAnalysisContext):
+            return source
+        return ImageAnalysisContext(source)
+    
+    @staticmethod
+    def _laplacian_var(gray: np.ndarray) -> float:
+        """Variance của Laplacian (ksize=1), bằng cv2.Laplacian(gray, CV_64F).var()
+
+        Ảnh uint8 cho Laplacian trong [-1020, 1020]: CV_16S không tràn, meanStdDev
+        cộng dồn bằng double nên kết quả không đổi mà nhanh hơn ~7 lần.
+        """
+        _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+        return float(std[0, 0] ** 2)
+    
+    @staticmethod
+    def _full_quality_metrics(ctx: ImageAnalysisContext) -> Dict[str, float]:
+        """Sharpness / edge / color metrics tính trên ảnh full-res"""
+        # (float(): giá trị numpy không encode được vào Mongo)
+        with ctx.timed('grayscale'):
+            gray = ctx.gray
+        with ctx.timed('laplacian'):
+            laplacian_var = KYCDocumentAnalyzer._laplacian_var(gray)
+        with ctx.timed('canny'):
+            edge_density = float(np.count_nonzero(ctx.edges) / (ctx.height * ctx.width))
+        with ctx.timed('histogram'):
+            color_variance = float(np.mean([np.var(hist) for hist in ctx.color_histograms]))
+        return {
+            'laplacian_var': laplacian_var,
+            'edge_density': edge_density,
+            'color_variance': color_variance
+        }
+    
+    @staticmethod
+    def _calibration_blocks(height: int, width: int, factor: int,
+                            grid: int = 4) -> List[Tuple[int, int, int, int]]:
+        """Các ô mẫu (y, x, h, w) theo toạ độ proxy height x width
+
+        Mỗi ô lưới (grid hàng, số cột theo tỉ lệ ảnh) có một ô mẫu ở vị trí ngẫu nhiên
+        (seed theo kích thước: cùng ảnh luôn cùng mẫu). Chiếu lên full-res, tổng diện
+        tích ~ số pixel của proxy: chi phí không tăng theo megapixel.
+        """
+        rows, cols = grid, max(1, round(grid * width / height))
+        side = int(np.sqrt(height * width / (factor * factor) / (rows * cols)))
+        tile_h, tile_w = max(8, min(side, height // rows)), max(8, min(side, width // cols))
+        rng = np.random.default_rng(height * width)
+        blocks = []
+        for i, j in product(range(rows), range(cols)):
+            y0, y1 = i * height // rows, (i + 1) * height // rows
+            x0, x1 = j * width // cols, (j + 1) * width // cols
+            y = y0 + int(rng.integers(0, max(1, y1 - y0 - tile_h + 1)))
+            x = x0 + int(rng.integers(0, max(1, x1 - x0 - tile_w + 1)))
+            blocks.append((y, x, min(tile_h, height - y), min(tile_w, width - x)))
+        return blocks
+    
+    @staticmethod
+    def _proxy_quality_metrics(ctx: ImageAnalysisContext, max_edge: int) -> Dict[str, float]:
+        """Sharpness / edge / color metrics với chi phí giới hạn theo kích thước proxy
+
+        - color histogram: tính trên proxy, số đếm mỗi bin nhân theo tỉ lệ pixel full/proxy
+        - Laplacian variance: không ước lượng được từ proxy hay từ mẫu (nhiễu hạt mất khi
+          thu nhỏ, vùng nét tập trung ở chữ / viền thẻ), nên tính đúng trên full-res bằng
+          _laplacian_var (một phép lọc số nguyên, rẻ hơn nhiều so với decode)
+        - Canny edge density: mật độ trên proxy nhân hệ số full/proxy đo trên các ô mẫu
+          full-res (_calibration_blocks) cùng vị trí; hệ số phụ thuộc độ mờ của cả ảnh
+          nên mẫu nhỏ vẫn đo được, còn phân bố edge lấy từ toàn bộ proxy
+        """
+        with ctx.timed('resize'):
+            image, scale = ctx.scaled_image(max_edge)
+        if scale == 1.0:
+            return KYCDocumentAnalyzer._full_quality_metrics(ctx)
+        factor = round(1 / scale)
+        CALIBRATION_PAD = 16
+        
+        with ctx.timed('grayscale'):
+            gray = ctx.gray
+            proxy_gray, _ = ctx.scaled_gray(max_edge)
+        with ctx.timed('laplacian'):
+            laplacian_var = KYCDocumentAnalyzer._laplacian_var(gray)
+        
+        with ctx.timed('canny'):
+            proxy_edges, _ = ctx.scaled_edges(max_edge)
+            proxy_count = full_count = full_pixels = 0
+            for y, x, h, w in KYCDocumentAnalyzer._calibration_blocks(*proxy_edges.shape, factor):
+                proxy_count += np.count_nonzero(proxy_edges[y:y + h, x:x + w])
+                # Thêm viền: NMS / hysteresis của Canny ở mép ô cần lân cận ngoài ô
+                y0, x0, y1, x1 = y * factor, x * factor, (y + h) * factor, (x + w) * factor
+                a, c = max(0, y0 - CALIBRATION_PAD), max(0, x0 - CALIBRATION_PAD)
+                block = cv2.Canny(gray[a:y1 + CALIBRATION_PAD, c:x1 + CALIBRATION_PAD], 50, 150)
+                full_count += np.count_nonzero(block[y0 - a:y1 - a, x0 - c:x1 - c])
+                full_pixels += (y1 - y0) * (x1 - x0)
+            if proxy_count:
+                # (full_count / full_pixels) / (proxy_count / proxy_pixels của mẫu)
+                ratio = full_count / (proxy_count * factor * factor)
+                edge_density = float(np.count_nonzero(proxy_edges) / proxy_edges.size * ratio)
+            else:
+                edge_density = float(full_count / full_pixels)
+        
+        with ctx.timed('histogram'):
+            pixel_ratio = (ctx.height * ctx.width) / (proxy_gray.shape[0] * proxy_gray.shape[1])
+            histograms = [cv2.calcHist([image], [i], None, [256], [0, 256]) * pixel_ratio for i in range(3)]
+            color_variance = float(np.mean([np.var(hist) for hist in histograms]))
+        
+        return {
+            'laplacian_var': laplacian_var,
+            'edge_density': edge_density,
+            'color_variance': color_variance
+        }
+    
+    @staticmethod
+    def _brightness_contrast(ctx: ImageAnalysisContext, mode: str) -> Tuple[float, float]:
+        """Brightness / contrast (mean, std của grayscale), memoize trên context
+
+        Proxy mode tính trên ảnh thu nhỏ: hai đại lượng này gần như không đổi khi thu nhỏ.
+        """
+        key = ('brightness_contrast', mode)
+        if key not in ctx.memo:
+            with ctx.timed('grayscale'):
+                gray = ctx.scaled_gray(KYC_QUALITY_PROXY_MAX_EDGE)[0] if mode == 'proxy' else ctx.gray
+            with ctx.timed('brightness_contrast'):
+                ctx.memo[key] = (float(np.mean(gray)), float(gray.std()))
+        return ctx.memo[key]
+    
+    @staticmethod
+    def _quality_score_bounds(scores: Dict[str, float]) -> Tuple[float, float]:
+        """Khoảng [min, max] của quality_score khi mới biết một phần component score (0-100)"""
+        low = high = 0
+        for component, weight in KYCDocumentAnalyzer.QUALITY_WEIGHTS.items():
+            if component in scores:
+                low += scores[component] * weight
+                high += scores[component] * weight
+            else:
+                high += 100 * weight
+        return low, high
     
     @staticmethod
-    def analyze_image_quality(image_path: str) -> Dict:
-        """Phân tích chất lượng ảnh toàn diện"""
+    def analyze_image_quality(image_path: AnalysisSource, mode: Optional[str] = None,
+                              basic_only: bool = False) -> Dict:
+        """Phân tích chất lượng ảnh toàn diện
+
+        mode: 'full' hoặc 'proxy', mặc định theo KYC_QUALITY_MODE
+        basic_only: chỉ tính resolution / brightness / contrast (rẻ), quality_score là
+            None và 'quality_score_range' cho biết khoảng giá trị có thể
+        """
         try:
             # Load image
-            img = cv2.imread(image_path)
-            if img is None:
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            if not ctx.is_valid:
                 return {
                     'valid': False,
                     'error': 'Cannot read image file',
                     'quality_score': 0
                 }
             
+            mode = mode or KYC_QUALITY_MODE
+            
             # Get image properties
-            height, width = img.shape[:2]
+            height, width = ctx.height, ctx.width
             
             # 1. Resolution Check
             resolution_check = width >= KYCDocumentAnalyzer.MIN_IMAGE_WIDTH and height >= KYCDocumentAnalyzer.MIN_IMAGE_HEIGHT
             resolution_score = min(100, (width / KYCDocumentAnalyzer.MIN_IMAGE_WIDTH) * 50 + (height / KYCDocumentAnalyzer.MIN_IMAGE_HEIGHT) * 50)
             
+            brightness, contrast = KYCDocumentAnalyzer._brightness_contrast(ctx, mode)
+            
             # 2. Brightness Check
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            brightness = np.mean(gray)
             brightness_check = KYCDocumentAnalyzer.MIN_BRIGHTNESS <= brightness <= KYCDocumentAnalyzer.MAX_BRIGHTNESS
             brightness_score = 100 if brightness_check else max(0, 100 - abs(brightness - 127) / 127 * 100)
             
-            # 3. Blur Detection (Laplacian variance)
-            laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-            blur_check = laplacian_var >= KYCDocumentAnalyzer.MIN_SHARPNESS
-            sharpness_score = min(100, (laplacian_var / 300) * 100)
-            
             # 4. Contrast Check
-            contrast = gray.std()
             contrast_check = contrast >= 30
             contrast_score = min(100, (contrast / 50) * 100)
             
+            scores = {'resolution': resolution_score, 'brightness': brightness_score, 'contrast': contrast_score}
+            issues = []
+            if not resolution_check:
+                issues.append(f'Low resolution: {width}x{height} (minimum {KYCDocumentAnalyzer.MIN_IMAGE_WIDTH}x{KYCDocumentAnalyzer.MIN_IMAGE_HEIGHT})')
+            if not brightness_check:
+                issues.append(f'Brightness issue: {brightness:.1f} (optimal 50-200)')
+            
+            report = {
+                'resolution': {'width': width, 'height': height, 'passed': resolution_check},
+                'brightness': {'value': round(brightness, 2), 'passed': brightness_check},
+                'contrast': {'value': round(contrast, 2), 'passed': contrast_check},
+            }
+            
+            if basic_only:
+                if not contrast_check:
+                    issues.append(f'Low contrast detected ({contrast:.1f})')
+                low, high = KYCDocumentAnalyzer._quality_score_bounds(scores)
+                return {
+                    # None: chưa xác định được khi chưa có sharpness / edge / color
+                    'valid': True if low >= 40 else False if high < 40 else None,
+                    'quality_score': None,
+                    'quality_score_range': [round(low, 2), round(high, 2)],
+                    **report,
+                    'issues': issues,
+                    'recommendations': KYCDocumentAnalyzer._get_recommendations(issues),
+                    'partial': True
+                }
+            
+            if mode == 'proxy':
+                metrics = KYCDocumentAnalyzer._proxy_quality_metrics(ctx, KYC_QUALITY_PROXY_MAX_EDGE)
+            else:
+                metrics = KYCDocumentAnalyzer._full_quality_metrics(ctx)
+            
+            # 3. Blur Detection (Laplacian variance)
+            laplacian_var = metrics['laplacian_var']
+            blur_check = laplacian_var >= KYCDocumentAnalyzer.MIN_SHARPNESS
+            scores['sharpness'] = min(100, (laplacian_var / 300) * 100)
+            
             # 5. Edge Detection (document boundaries)
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.count_nonzero(edges) / (height * width)
-            edge_score = min(100, edge_density * 500)
+            edge_density = metrics['edge_density']
+            scores['edge'] = min(100, edge_density * 500)
             
             # 6. Color Distribution
-            color_hist = [cv2.calcHist([img], [i], None, [256], [0, 256]) for i in range(3)]
-            color_variance = np.mean([np.var(hist) for hist in color_hist])
-            color_score = min(100, color_variance / 1000)
+            scores['color'] = min(100, metrics['color_variance'] / 1000)
             
             # Calculate overall quality score
-            quality_score = (
-                resolution_score * 0.25 +
-                brightness_score * 0.20 +
-                sharpness_score * 0.25 +
-                contrast_score * 0.15 +
-                edge_score * 0.10 +
-                color_score * 0.05
-            )
+            quality_score, _ = KYCDocumentAnalyzer._quality_score_bounds(scores)
             
             # Determine quality level
             if quality_score >= 80:
@@ -92,11 +429,6 @@ class KYCDocumentAnalyzer:
                 quality_level = 'poor'
             
             # Issues detection
-            issues = []
-            if not resolution_check:
-                issues.append(f'Low resolution: {width}x{height} (minimum {KYCDocumentAnalyzer.MIN_IMAGE_WIDTH}x{KYCDocumentAnalyzer.MIN_IMAGE_HEIGHT})')
-            if not brightness_check:
-                issues.append(f'Brightness issue: {brightness:.1f} (optimal 50-200)')
             if not blur_check:
                 issues.append(f'Image appears blurry (sharpness: {laplacian_var:.1f})')
             if not contrast_check:
@@ -106,11 +438,12 @@ class KYCDocumentAnalyzer:
                 'valid': quality_score >= 40,
                 'quality_score': round(quality_score, 2),
                 'quality_level': quality_level,
-                'resolution': {'width': width, 'height': height, 'passed': resolution_check},
-                'brightness': {'value': round(brightness, 2), 'passed': brightness_check},
+                'resolution': report['resolution'],
+                'brightness': report['brightness'],
                 'sharpness': {'value': round(laplacian_var, 2), 'passed': blur_check},
-                'contrast': {'value': round(contrast, 2), 'passed': contrast_check},
+                'contrast': report['contrast'],
                 'edge_density': round(edge_density, 4),
+                'color_variance': round(metrics['color_variance'], 2),
                 'issues': issues,
                 'recommendations': KYCDocumentAnalyzer._get_recommendations(issues)
             }
@@ -124,14 +457,94 @@ class KYCDocumentAnalyzer:
             }
     
     @staticmethod
-    def detect_document_type(image_path: str) -> Dict:
-        """Phát hiện loại document từ ảnh"""
+    def analyze_tiles(image_path: AnalysisSource, grid: Optional[Tuple[int, int]] = None) -> Dict:
+        """Bản đồ sharpness / độ sáng / glare theo lưới tile
+
+        Tính trên proxy của face detection (đã có sẵn, không resize thêm), giới hạn
+        trong khung giấy tờ nếu detect_document_type đã tìm được. Mỗi metric của cả
+        lưới là một phép reshape + reduce NumPy, không lặp Python theo tile.
+        Laplacian variance ở đây theo thang của proxy, chỉ dùng để so sánh giữa các tile.
+        """
+        try:
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            if not ctx.is_valid:
+                return {'error': 'Cannot read image file'}
+            
+            rows, cols = grid or KYCDocumentAnalyzer.TILE_GRID
+            gray, scale = ctx.scaled_gray(KYC_FACE_DETECTION_MAX_EDGE)
+            region = KYCDocumentAnalyzer._face_search_region(ctx)
+            if region is not None:
+                x, y, w, h = (int(v * scale) for v in region)
+                gray = gray[y:y + h, x:x + w]
+            
+            tile_h, tile_w = gray.shape[0] // rows, gray.shape[1] // cols
+            if tile_h < 3 or tile_w < 3:
+                return {'error': 'Image too small for tile analysis'}
+            gray = gray[:rows * tile_h, :cols * tile_w]
+            
+            # (rows, tile_h, cols, tile_w): reduce trên trục 1 và 3 cho ra lưới rows x cols
+            def tiles(values: np.ndarray) -> np.ndarray:
+                return values.reshape(rows, tile_h, cols, tile_w)
+            
+            laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+            sharpness = tiles(laplacian).var(axis=(1, 3))
+            brightness = tiles(gray).mean(axis=(1, 3), dtype=np.float32)
+            glare = tiles(gray >= KYCDocumentAnalyzer.GLARE_LEVEL).mean(axis=(1, 3))
+            
+            worst = np.unravel_index(np.argmin(sharpness), sharpness.shape)
+            glariest = np.unravel_index(np.argmax(glare), glare.shape)
+            median_sharpness = float(np.median(sharpness))
+            glare_tiles = int(np.count_nonzero(glare > KYCDocumentAnalyzer.MAX_TILE_GLARE_RATIO))
+            
+            issues = []
+            if glare_tiles:
+                issues.append(f'Glare detected on {glare_tiles} of {rows * cols} regions')
+            
+            return {
+                'grid': [rows, cols],
+                'region': (
+                    {'x': region[0], 'y': region[1], 'width': region[2], 'height': region[3]}
+                    if region is not None else None
+                ),
+                'worst_sharpness': {
+                    'value': round(float(sharpness[worst]), 2),
+                    'tile': [int(worst[0]), int(worst[1])],
+                    # Tile mờ nhất so với median: thấp = mờ cục bộ
+                    'ratio_to_median': round(float(sharpness[worst]) / median_sharpness, 3) if median_sharpness else None
+                },
+                'worst_glare': {
+                    'value': round(float(glare[glariest]), 4),
+                    'tile': [int(glariest[0]), int(glariest[1])]
+                },
+                'glare_tiles': glare_tiles,
+                'heatmap': {
+                    'sharpness': np.round(sharpness, 1).tolist(),
+                    'brightness': np.round(brightness, 1).tolist(),
+                    'glare': np.round(glare, 3).tolist()
+                },
+                'issues': issues,
+                'recommendations': KYCDocumentAnalyzer._get_recommendations(issues) if issues else []
+            }
+            
+        except Exception as e:
+            logger.error(f"Error analyzing tiles: {str(e)}")
+            return {'error': str(e)}
+    
+    @staticmethod
+    def detect_document_type(image_path: AnalysisSource, mode: Optional[str] = None) -> Dict:
+        """Phát hiện loại document từ ảnh
+
+        mode: 'full' hoặc 'proxy' (mặc định theo KYC_QUALITY_MODE). Proxy tìm contour
+        trên Canny của proxy (dùng chung với quality metrics), toạ độ khung được nhân
+        lại về ảnh gốc: chi phí không tăng theo megapixel.
+        """
         try:
-            img = cv2.imread(image_path)
-            if img is None:
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            if not ctx.is_valid:
                 return {'type': 'unknown', 'confidence': 0}
+            mode = mode or KYC_QUALITY_MODE
             
-            height, width = img.shape[:2]
+            height, width = ctx.height, ctx.width
             aspect_ratio = width / height
             
             # Detect based on aspect ratio and size
@@ -152,49 +565,107 @@ class KYCDocumentAnalyzer:
                 confidence = 30
             
             # Edge detection for document boundaries
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150)
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            has_rectangular_shape = False
-            for contour in contours:
-                peri = cv2.arcLength(contour, True)
-                approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
-                if len(approx) == 4:  # Rectangle detected
-                    has_rectangular_shape = True
-                    confidence = min(95, confidence + 10)
-                    break
+            with ctx.timed('canny'):
+                if mode == 'proxy':
+                    edges, scale = ctx.scaled_edges(KYC_QUALITY_PROXY_MAX_EDGE)
+                else:
+                    edges, scale = ctx.edges, 1.0
+            with ctx.timed('contours'):
+                contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                
+                # Chỉ thử K contour lớn nhất: khung giấy tờ là contour lớn, nền lộn xộn
+                # sinh ra rất nhiều contour nhỏ không cần approxPolyDP
+                candidates = heapq.nlargest(KYC_DOCUMENT_CONTOUR_TOP_K, contours, key=cv2.contourArea)
+                
+                document_quad = None
+                for contour in candidates:
+                    peri = cv2.arcLength(contour, True)
+                    approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+                    if len(approx) == 4:  # Rectangle detected
+                        # Proxy: nhân hệ số thu nhỏ (số nguyên) ra toạ độ ảnh gốc
+                        document_quad = approx.reshape(4, 2) * round(1 / scale)
+                        confidence = min(95, confidence + 10)
+                        break
             
-            return {
+            # Dùng lại cho detect_face trên cùng context
+            ctx.memo[('document_quad',)] = document_quad
+            
+            result = {
                 'type': doc_type,
                 'confidence': confidence,
                 'aspect_ratio': round(aspect_ratio, 2),
-                'has_document_shape': has_rectangular_shape,
+                'has_document_shape': document_quad is not None,
                 'dimensions': {'width': width, 'height': height}
             }
+            if document_quad is not None:
+                x, y, w, h = cv2.boundingRect(document_quad)
+                result['document_quad'] = [[int(px), int(py)] for px, py in document_quad]
+                result['document_bbox'] = {'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)}
+            return result
             
         except Exception as e:
             logger.error(f"Error detecting document type: {str(e)}")
             return {'type': 'unknown', 'confidence': 0, 'error': str(e)}
     
     @staticmethod
-    def detect_face(image_path: str) -> Dict:
+    def _face_search_region(ctx: ImageAnalysisContext) -> Optional[Tuple[int, int, int, int]]:
+        """Vùng (x, y, w, h) toạ độ gốc để tìm mặt: khung giấy tờ đã tìm được + margin
+
+        None (tìm trên toàn ảnh) nếu chưa chạy detect_document_type trên context này,
+        không có khung, hoặc khung quá nhỏ so với ảnh.
+        """
+        quad = ctx.memo.get(('document_quad',))
+        if quad is None:
+            return None
+        x, y, w, h = cv2.boundingRect(quad)
+        if w * h < KYCDocumentAnalyzer.MIN_DOCUMENT_ROI_RATIO * ctx.width * ctx.height:
+            return None
+        margin_x = int(w * KYCDocumentAnalyzer.DOCUMENT_ROI_MARGIN)
+        margin_y = int(h * KYCDocumentAnalyzer.DOCUMENT_ROI_MARGIN)
+        x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+        x1, y1 = min(ctx.width, x + w + margin_x), min(ctx.height, y + h + margin_y)
+        return x0, y0, x1 - x0, y1 - y0
+    
+    @staticmethod
+    def detect_face(image_path: AnalysisSource) -> Dict:
         """Phát hiện khuôn mặt trong ảnh"""
         try:
-            img = cv2.imread(image_path)
-            if img is None:
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            if not ctx.is_valid:
                 return {'face_detected': False, 'face_count': 0}
             
-            # Load OpenCV's pre-trained face detector
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            # OpenCV's pre-trained face detector (cached per process)
+            face_cascade = get_face_cascade()
+            
+            # Detect trên ảnh proxy, min face size tỉ lệ theo kích thước ảnh
+            with ctx.timed('resize'):
+                gray, scale = ctx.scaled_gray(KYC_FACE_DETECTION_MAX_EDGE)
+            min_face = max(24, round(min(gray.shape[:2]) * KYCDocumentAnalyzer.MIN_FACE_RATIO))
+            
+            # Chỉ tìm trong khung giấy tờ nếu đã có (ít cửa sổ cascade hơn, ít mặt giả ở nền)
+            region = KYCDocumentAnalyzer._face_search_region(ctx)
+            offset_x = offset_y = 0
+            if region is not None:
+                rx, ry, rw, rh = (int(v * scale) for v in region)
+                if rw >= min_face and rh >= min_face:
+                    gray = gray[ry:ry + rh, rx:rx + rw]
+                    offset_x, offset_y = rx, ry
+                else:
+                    region = None
+            
+            with ctx.timed('face_cascade'):
+                detected = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_face, min_face))
             
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+            # Map bounding box về toạ độ ảnh gốc
+            faces = [
+                (round((x + offset_x) / scale), round((y + offset_y) / scale), round(w / scale), round(h / scale))
+                for x, y, w, h in detected
+            ]
             
             face_info = []
             for (x, y, w, h) in faces:
                 face_area = w * h
-                img_area = img.shape[0] * img.shape[1]
+                img_area = ctx.height * ctx.width
                 face_ratio = (face_area / img_area) * 100
                 
                 face_info.append({
@@ -206,7 +677,11 @@ class KYCDocumentAnalyzer:
                 'face_detected': len(faces) > 0,
                 'face_count': len(faces),
                 'faces': face_info,
-                'valid_for_id': len(faces) == 1  # ID should have exactly 1 face
+                'valid_for_id': len(faces) == 1,  # ID should have exactly 1 face
+                'search_region': (
+                    {'x': region[0], 'y': region[1], 'width': region[2], 'height': region[3]}
+                    if region is not None else None
+                )
             }
             
         except Exception as e:
@@ -214,50 +689,334 @@ class KYCDocumentAnalyzer:
             return {'face_detected': False, 'face_count': 0, 'error': str(e)}
     
     @staticmethod
-    def validate_document(image_path: str, id_type: str) -> Dict:
-        """Validate toàn diện document"""
+    def precheck(image_path: AnalysisSource) -> Dict:
+        """Kiểm tra nhanh ảnh preview (client đã thu nhỏ) trước khi upload bản đầy đủ
+
+        Chỉ brightness / contrast / sharpness / khung chữ nhật, không face detection.
+        Sharpness đo trên preview nên chỉ là gợi ý: ảnh thu nhỏ trông nét hơn bản gốc.
+        """
+        start = time.perf_counter()
+        try:
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            if not ctx.is_valid:
+                return {'passed': False, 'error': 'Cannot read image file'}
+            if max(ctx.width, ctx.height) > KYCDocumentAnalyzer.PRECHECK_MAX_EDGE:
+                # Giữ latency cố định: preview lớn hơn được thu nhỏ trước khi kiểm tra
+                ctx = ImageAnalysisContext.from_image(ctx.scaled_image(KYCDocumentAnalyzer.PRECHECK_MAX_EDGE)[0])
+            
+            brightness, contrast = KYCDocumentAnalyzer._brightness_contrast(ctx, 'full')
+            sharpness = float(cv2.Laplacian(ctx.gray, cv2.CV_64F).var())
+            doc_type = KYCDocumentAnalyzer.detect_document_type(ctx)
+            
+            checks = {
+                'brightness': {
+                    'value': round(brightness, 2),
+                    'passed': KYCDocumentAnalyzer.MIN_BRIGHTNESS <= brightness <= KYCDocumentAnalyzer.MAX_BRIGHTNESS
+                },
+                'contrast': {'value': round(contrast, 2), 'passed': contrast >= 30},
+                'sharpness': {'value': round(sharpness, 2), 'passed': sharpness >= KYCDocumentAnalyzer.MIN_SHARPNESS},
+                'document_shape': {'passed': doc_type.get('has_document_shape', False)}
+            }
+            
+            issues = []
+            if not checks['brightness']['passed']:
+                issues.append(f'Brightness issue: {brightness:.1f}')
+            if not checks['contrast']['passed']:
+                issues.append(f'Low contrast detected ({contrast:.1f})')
+            if not checks['sharpness']['passed']:
+                issues.append(f'Image appears blurry (sharpness: {sharpness:.1f})')
+            hints = KYCDocumentAnalyzer._get_recommendations(issues) if issues else []
+            if not checks['document_shape']['passed']:
+                hints.append('Place the whole document inside the frame, with its four corners visible')
+            
+            return {
+                'passed': all(check['passed'] for check in checks.values()),
+                'checks': checks,
+                'issues': issues,
+                'hints': hints,
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+            }
+            
+        except Exception as e:
+            logger.error(f"Error in precheck: {str(e)}")
+            return {'passed': False, 'error': str(e)}
+    
+    @staticmethod
+    def _order_quad(quad: np.ndarray) -> np.ndarray:
+        """Sắp 4 đỉnh theo thứ tự trên-trái, trên-phải, dưới-phải, dưới-trái"""
+        quad = quad.astype(np.float32)
+        sums = quad.sum(axis=1)
+        diffs = np.diff(quad, axis=1).ravel()  # y - x
+        return np.array([
+            quad[np.argmin(sums)], quad[np.argmin(diffs)],
+            quad[np.argmax(sums)], quad[np.argmax(diffs)]
+        ], dtype=np.float32)
+    
+    @staticmethod
+    def normalize_document_crop(image_path: AnalysisSource,
+                                max_edge: int = KYC_DOCUMENT_CROP_MAX_EDGE) -> Optional[np.ndarray]:
+        """Nắn phẳng khung giấy tờ (perspective warp) thành ảnh chữ nhật, cạnh dài <= max_edge
+
+        None nếu không tìm được khung. Dùng khung đã tìm bởi detect_document_type
+        trên cùng context nếu có.
+        """
+        try:
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            if ('document_quad',) not in ctx.memo:
+                KYCDocumentAnalyzer.detect_document_type(ctx)
+            quad = ctx.memo.get(('document_quad',))
+            if quad is None:
+                return None
+            
+            tl, tr, br, bl = KYCDocumentAnalyzer._order_quad(quad)
+            width = max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))
+            height = max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))
+            long_edge = max(width, height)
+            if long_edge < 1:
+                return None
+            
+            # Warp từ proxy thu nhỏ (INTER_AREA, đã memoize) vẫn đủ độ phân giải cho crop,
+            # tránh nội suy tuyến tính trực tiếp từ full-res (răng cưa khi thu nhỏ nhiều)
+            factor = max(1, int(long_edge // max_edge))
+            source, scale = ctx.scaled_image(-(-max(ctx.width, ctx.height) // factor))
+            target_scale = min(1.0, max_edge / long_edge)
+            out_w = max(1, round(width * target_scale))
+            out_h = max(1, round(height * target_scale))
+            
+            src = np.array([tl, tr, br, bl], dtype=np.float32) * scale
+            dst = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+            matrix = cv2.getPerspectiveTransform(src, dst)
+            return cv2.warpPerspective(source, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR)
+            
+        except Exception as e:
+            logger.error(f"Error normalizing document crop: {str(e)}")
+            return None
+    
+    @staticmethod
+    def save_document_crop(image_path: AnalysisSource, output_path: str,
+                           max_edge: int = KYC_DOCUMENT_CROP_MAX_EDGE) -> Optional[Dict]:
+        """Ghi crop đã nắn phẳng ra output_path (JPEG), trả về {'path', 'width', 'height'}
+
+        Ghi vào file tạm rồi rename: consumer không bao giờ đọc phải file ghi dở.
+        """
+        crop = KYCDocumentAnalyzer.normalize_document_crop(image_path, max_edge)
+        if crop is None:
+            return None
+        try:
+            ok, encoded = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, KYC_DOCUMENT_CROP_QUALITY])
+            if not ok:
+                return None
+            # Thư mục đích có thể chưa tồn tại (vd. file tạm của worker)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            tmp_path = f"{output_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(encoded.tobytes())
+            os.replace(tmp_path, output_path)
+            return {'path': output_path, 'width': crop.shape[1], 'height': crop.shape[0]}
+        except Exception as e:
+            logger.error(f"Error saving document crop: {str(e)}")
+            return None
+    
+    @staticmethod
+    def compute_perceptual_hashes(image_path: AnalysisSource) -> Dict:
+        """dHash và pHash 64-bit (hex) để tìm ảnh gần trùng giữa các submission"""
+        try:
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            if not ctx.is_valid:
+                return {}
+            
+            # Dùng chung proxy với face detection, không resize lại từ full-res
+            gray, _ = ctx.scaled_gray(KYC_FACE_DETECTION_MAX_EDGE)
+            
+            # dHash: gradient ngang trên lưới 9x8
+            small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+            dhash_bits = small[:, 1:] > small[:, :-1]
+            
+            # pHash: 8x8 hệ số DCT tần số thấp so với median (bỏ thành phần DC)
+            dct = cv2.dct(cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32))
+            low = dct[:8, :8].flatten()
+            phash_bits = low > np.median(low[1:])
+            
+            return {
+                'dhash': np.packbits(dhash_bits.flatten()).tobytes().hex(),
+                'phash': np.packbits(phash_bits).tobytes().hex()
+            }
+            
+        except Exception as e:
+            logger.error(f"Error computing perceptual hash: {str(e)}")
+            return {}
+    
+    @staticmethod
+    def _header_is_corrupt(ctx: ImageAnalysisContext) -> bool:
+        """Header JPEG/PNG hỏng / bị cắt: biết chắc không decode được, không cần đọc pixel"""
+        if 'image' in ctx.__dict__ or not isinstance(ctx.source, (str, bytes, bytearray, memoryview)):
+            return False
+        try:
+            sniff_image(ctx.source)
+            return False
+        except InvalidImageError:
+            return True
+        except OSError:
+            # File không mở được: để decode báo lỗi như bình thường
+            return False
+    
+    @staticmethod
+    def _decision(quality_valid: bool, quality_good: bool, document_ok: bool, face_ok: bool) -> Tuple[int, bool, bool, bool]:
+        """(validation_score, auto_approved, requires_manual_review, auto_rejected)"""
+        validation_score = 40 * quality_valid + 30 * document_ok + 30 * face_ok
+        return (
+            validation_score,
+            validation_score >= 80 and quality_good,
+            50 <= validation_score < 80,
+            validation_score < 50
+        )
+    
+    @staticmethod
+    def _affects_decision(known: Dict[str, Optional[bool]], checks: Tuple[str, ...]) -> bool:
+        """Các check trong checks (chưa biết) còn có thể làm đổi quyết định cuối không
+
+        Quyết định = (auto_approved, requires_manual_review, auto_rejected); xét mọi
+        giá trị có thể của các check chưa biết khác.
+        """
+        targets = [check for check in checks if known[check] is None]
+        others = [check for check, value in known.items() if value is None and check not in targets]
+        if not targets:
+            return False
+        for other_values in product((False, True), repeat=len(others)):
+            decisions = set()
+            for target_values in product((False, True), repeat=len(targets)):
+                state = {**known, **dict(zip(others, other_values)), **dict(zip(targets, target_values))}
+                if state['quality_good'] and not state['quality_valid']:
+                    continue  # quality_score >= GOOD_QUALITY_SCORE kéo theo >= 40
+                decisions.add(KYCDocumentAnalyzer._decision(**state)[1:])
+            if len(decisions) > 1:
+                return True
+        return False
+    
+    @staticmethod
+    def validate_document(image_path: AnalysisSource, id_type: str, short_circuit: bool = True,
+                          crop_path: Optional[str] = None) -> Dict:
+        """Validate toàn diện document
+
+        Thứ tự stage: header -> resolution / brightness / contrast -> contours ->
+        face detection -> sharpness / edge / color.
+        short_circuit: bỏ qua stage không còn làm đổi được validation_score lẫn quyết
+        định của file (auto-approve / manual review / reject). validation_score luôn
+        chính xác vì kyc_worker lấy trung bình theo submission: chỉ phần quality đầy
+        đủ (chỉ còn ảnh hưởng quality_good) được bỏ qua, khi quality_valid đã xác định
+        từ resolution / brightness / contrast. 'skipped_stages' liệt kê các stage bỏ qua.
+        crop_path: nếu có và tìm được khung giấy tờ, ghi ảnh giấy tờ đã nắn phẳng ra đây
+        ('document_crop' trong kết quả).
+        """
         try:
-            # 1. Quality Analysis
-            quality = KYCDocumentAnalyzer.analyze_image_quality(image_path)
+            start = time.perf_counter()
+            ctx = KYCDocumentAnalyzer._context(image_path)
+            face_required = id_type in KYCDocumentAnalyzer.PHOTO_ID_TYPES
+            # Kết quả các check (None: chưa biết)
+            known = {
+                'quality_valid': None,
+                'quality_good': None,
+                'document_ok': None,
+                'face_ok': None if face_required else True
+            }
+            skipped_stages = []
+            
+            def needed(*checks: str) -> bool:
+                # Check thuộc validation_score chưa biết thì luôn phải chạy
+                if not short_circuit or any(known[check] is None for check in checks if check in KYCDocumentAnalyzer.SCORE_CHECKS):
+                    return True
+                return KYCDocumentAnalyzer._affects_decision(known, checks)
+            
+            def update_quality(quality: Dict):
+                if quality.get('quality_score') is not None:
+                    known['quality_valid'] = quality.get('valid', False)
+                    known['quality_good'] = quality['quality_score'] >= KYCDocumentAnalyzer.GOOD_QUALITY_SCORE
+                else:
+                    low, high = quality['quality_score_range']
+                    known['quality_valid'] = quality['valid']
+                    good = KYCDocumentAnalyzer.GOOD_QUALITY_SCORE
+                    known['quality_good'] = True if low >= good else False if high < good else None
             
-            # 2. Document Type Detection
-            doc_type = KYCDocumentAnalyzer.detect_document_type(image_path)
+            # 1. Header: file hỏng thì không decode, mọi check trả về kết quả "không đọc được"
+            with ctx.timed('header'):
+                if KYCDocumentAnalyzer._header_is_corrupt(ctx):
+                    ctx.image = None
             
-            # 3. Face Detection (for photo IDs)
-            face_info = KYCDocumentAnalyzer.detect_face(image_path)
+            # Decode một lần, dùng chung cho các check
+            with ctx.timed('decode'):
+                ctx.is_valid  # cached_property: ảnh được decode tại đây
             
-            # 4. Overall validation
-            validation_score = 0
+            # 2. Quality (rẻ): resolution, brightness, contrast
+            quality = KYCDocumentAnalyzer.analyze_image_quality(ctx, basic_only=True)
+            update_quality(quality)
+            
+            # 3. Document Type Detection (contours)
+            doc_type = KYCDocumentAnalyzer.detect_document_type(ctx)
+            known['document_ok'] = doc_type['confidence'] >= 70
+            
+            # 4. Face Detection (for photo IDs)
+            face_info = None
+            if needed('face_ok'):
+                face_info = KYCDocumentAnalyzer.detect_face(ctx)
+                if face_required:
+                    known['face_ok'] = face_info.get('valid_for_id', False)
+            else:
+                skipped_stages.append('face_detection')
+            
+            # 5. Quality (đầy đủ): sharpness, edge density, color. Chạy sau cùng để
+            # biết đủ các check khác khi quyết định bỏ qua
+            if quality.get('partial'):
+                if needed('quality_valid', 'quality_good'):
+                    quality = KYCDocumentAnalyzer.analyze_image_quality(ctx)
+                    update_quality(quality)
+                else:
+                    skipped_stages.append('quality_metrics')
+            
+            # Perceptual hash cho near-duplicate index, bản đồ sharpness / glare cho
+            # reviewer (không ảnh hưởng quyết định)
+            perceptual_hash = {}
+            tile_analysis = None
+            if ctx.is_valid:
+                with ctx.timed('perceptual_hash'):
+                    perceptual_hash = KYCDocumentAnalyzer.compute_perceptual_hashes(ctx)
+                with ctx.timed('tiles'):
+                    tile_analysis = KYCDocumentAnalyzer.analyze_tiles(ctx)
+            
+            # Crop giấy tờ đã nắn phẳng cho reviewer / phân tích lại (không ảnh hưởng quyết định)
+            document_crop = None
+            if crop_path and ctx.memo.get(('document_quad',)) is not None:
+                with ctx.timed('document_crop'):
+                    document_crop = KYCDocumentAnalyzer.save_document_crop(ctx, crop_path)
+            
+            # 6. Overall validation. quality_good chỉ còn None khi không đổi được quyết định
+            validation_score, auto_approved, requires_manual_review, auto_rejected = KYCDocumentAnalyzer._decision(
+                **{check: bool(value) for check, value in known.items()}
+            )
             validation_checks = []
             
             # Quality check
-            if quality.get('valid', False):
-                validation_score += 40
+            if known['quality_valid'] and quality.get('partial'):
+                # Phần quality đầy đủ bị bỏ qua: chỉ biết khoảng điểm
+                validation_checks.append({'check': 'Image Quality', 'passed': True, 'skipped': True,
+                                          'quality_score_range': quality['quality_score_range']})
+            elif known['quality_valid']:
                 validation_checks.append({'check': 'Image Quality', 'passed': True, 'score': quality['quality_score']})
             else:
                 validation_checks.append({'check': 'Image Quality', 'passed': False, 'issues': quality.get('issues', [])})
             
             # Document type check
-            if doc_type['confidence'] >= 70:
-                validation_score += 30
+            if known['document_ok']:
                 validation_checks.append({'check': 'Document Type', 'passed': True, 'detected': doc_type['type']})
             else:
                 validation_checks.append({'check': 'Document Type', 'passed': False, 'confidence': doc_type['confidence']})
             
             # Face detection check (for IDs with photos)
-            if id_type in ['passport', 'national_id', 'driver_license']:
-                if face_info['valid_for_id']:
-                    validation_score += 30
-                    validation_checks.append({'check': 'Face Detection', 'passed': True, 'faces': face_info['face_count']})
-                else:
-                    validation_checks.append({'check': 'Face Detection', 'passed': False, 'faces': face_info['face_count']})
-            else:
-                validation_score += 30  # Not required for other types
+            if face_required:
+                validation_checks.append({'check': 'Face Detection', 'passed': known['face_ok'], 'faces': face_info['face_count']})
             
-            # Final decision
-            auto_approved = validation_score >= 80 and quality.get('quality_score', 0) >= 60
-            requires_manual_review = 50 <= validation_score < 80
-            auto_rejected = validation_score < 50
+            # Thời gian từng stage (ms), 'total' gồm cả phần không thuộc stage nào
+            timings = {stage: round(ms, 2) for stage, ms in ctx.timings.items()}
+            timings['total'] = round((time.perf_counter() - start) * 1000, 2)
             
             return {
                 'validation_score': validation_score,
@@ -266,8 +1025,13 @@ class KYCDocumentAnalyzer:
                 'auto_rejected': auto_rejected,
                 'quality_analysis': quality,
                 'document_type': doc_type,
-                'face_detection': face_info,
+                'face_detection': face_info or {'skipped': True},
+                'perceptual_hash': perceptual_hash,
+                'document_crop': document_crop,
+                'tile_analysis': tile_analysis,
                 'validation_checks': validation_checks,
+                'skipped_stages': skipped_stages,
+                'timings_ms': timings,
                 'analyzed_at': datetime.now(timezone.utc).isoformat()
             }
             
@@ -295,6 +1059,8 @@ class KYCDocumentAnalyzer:
                 recommendations.append('Hold camera steady and ensure focus')
             if 'contrast' in issue.lower():
                 recommendations.append('Place document on contrasting background')
+            if 'glare' in issue.lower():
+                recommendations.append('Avoid direct light or flash reflecting on the document')
         
         if not recommendations:
             recommendations.append('Document meets quality standards')
@@ -302,11 +1068,17 @@ class KYCDocumentAnalyzer:
         return recommendations
 
     @staticmethod
-    def generate_thumbnail(image_path: str, output_path: str, size: Tuple[int, int] = (300, 300)) -> bool:
-        """Generate thumbnail cho preview"""
+    def generate_thumbnail(image_path: Union[str, bytes, bytearray, memoryview], output_path: str,
+                           size: Tuple[int, int] = (300, 300)) -> bool:
+        """Generate thumbnail cho preview (từ path hoặc buffer)
+
+        JPEG được decode ở chế độ draft (scale DCT), không giải nén full-res.
+        """
         try:
-            img = Image.open(image_path)
-            img.thumbnail(size, Image.Resampling.LANCZOS)
+            img = Image.open(image_path if isinstance(image_path, str) else io.BytesIO(image_path))
+            img.draft('RGB', size)
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
             img.save(output_path, 'JPEG', quality=85)
             return True
         except Exception as e:
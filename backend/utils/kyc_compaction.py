@@ -0,0 +1,207 @@
+"""Nén lại lossless và archive file KYC gốc của submission đã duyệt xong
+PNG 8 bit/kênh được ghi lại với zlib tối ưu (giữ các chunk màu gAMA / cHRM /
+sRGB...), JPEG được tối ưu bảng Huffman bằng jpegtran (giữ nguyên hệ số DCT,
+không encode lại). Bản nén lại chỉ được dùng khi nhỏ hơn và decode ra đúng từng
+pixel như bản gốc. Bytes mới lưu theo hash của chính nó
+(blob_key / blob_hash trong kyc_files); content_hash, thumbnail, analysis cache
+vẫn theo file gốc. Sau KYC_ARCHIVE_AFTER_DAYS ngày blob được chuyển sang tier
+archive của storage backend.
+
+recompress() chạy trong process pool; các hàm async chạy trong event loop của job.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from utils.kyc_file_store import FILE_COLLECTION, UPLOAD_DIR, blob_key, record_key
+from utils.kyc_storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Số ngày sau khi duyệt thì blob chuyển sang tier archive
+KYC_ARCHIVE_AFTER_DAYS = int(os.getenv("KYC_ARCHIVE_AFTER_DAYS", 90))
+JPEGTRAN_TIMEOUT_SECONDS = 60
+
+# Tham số PNG giữ nguyên khi ghi lại (metadata ảnh hưởng tới hiển thị)
+_PNG_SAVE_INFO = ('icc_profile', 'exif', 'transparency', 'dpi')
+# Chunk màu / text chép nguyên bytes sang file mới (Pillow không tự ghi lại các chunk màu)
+_PNG_COLOR_CHUNKS = (b'cHRM', b'cICP', b'gAMA', b'sBIT', b'sRGB')
+_PNG_COPY_CHUNKS = _PNG_COLOR_CHUNKS + (b'tEXt', b'zTXt', b'iTXt')
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _png_chunks(content: bytes) -> List[Tuple[bytes, bytes]]:
+    """(type, data) của các chunk PNG theo thứ tự trong file"""
+    if not content.startswith(_PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    chunks, offset = [], len(_PNG_SIGNATURE)
+    while offset + 8 <= len(content):
+        length, cid = struct.unpack('>I4s', content[offset:offset + 8])
+        chunks.append((cid, content[offset + 8:offset + 8 + length]))
+        if cid == b'IEND':
+            break
+        # length + type + data + CRC
+        offset += 12 + length
+    return chunks
+
+
+def _png_color_chunks(content: bytes) -> List[Tuple[bytes, bytes]]:
+    return sorted(chunk for chunk in _png_chunks(content) if chunk[0] in _PNG_COLOR_CHUNKS)
+
+
+def _optimize_png(content: bytes) -> Optional[bytes]:
+    chunks = _png_chunks(content)
+    # Byte 8 của IHDR: bit depth. Pillow đọc PNG 16 bit RGB / RGBA thành 8 bit
+    # (và so sánh pixel bằng chính decoder đó) nên chỉ nén PNG 8 bit
+    if not chunks or chunks[0][0] != b'IHDR' or chunks[0][1][8] != 8:
+        return None
+    img = Image.open(io.BytesIO(content))
+    if getattr(img, 'is_animated', False):
+        return None
+    pnginfo = PngInfo()
+    for cid, data in chunks:
+        if cid in _PNG_COPY_CHUNKS:
+            pnginfo.add(cid, data)
+    params = {key: img.info[key] for key in _PNG_SAVE_INFO if key in img.info}
+    output = io.BytesIO()
+    img.save(output, 'PNG', optimize=True, pnginfo=pnginfo, **params)
+    candidate = output.getvalue()
+    # Chunk màu bị mất / đổi (vd. sRGB cùng iCCP: Pillow bỏ sRGB) thì không dùng
+    if _png_color_chunks(candidate) != _png_color_chunks(content):
+        return None
+    return candidate
+
+
+def _optimize_jpeg(content: bytes) -> Optional[bytes]:
+    jpegtran = shutil.which('jpegtran')
+    if not jpegtran:
+        return None
+    # -optimize: bảng Huffman tối ưu cho ảnh; -copy all: giữ EXIF / ICC
+    result = subprocess.run([jpegtran, '-copy', 'all', '-optimize'], input=content,
+                            capture_output=True, check=True, timeout=JPEGTRAN_TIMEOUT_SECONDS)
+    return result.stdout
+
+
+def _same_pixels(original: bytes, candidate: bytes) -> bool:
+    a, b = Image.open(io.BytesIO(original)), Image.open(io.BytesIO(candidate))
+    return (a.mode == b.mode and a.size == b.size and a.getpalette() == b.getpalette()
+            and a.info.get('icc_profile') == b.info.get('icc_profile') and a.tobytes() == b.tobytes())
+
+
+def recompress(content: bytes, file_ext: str) -> Optional[bytes]:
+    """Bản nén lại lossless của file, None nếu không nhỏ hơn / không hỗ trợ / không chắc lossless"""
+    try:
+        if file_ext == '.png':
+            candidate = _optimize_png(content)
+        elif file_ext in ('.jpg', '.jpeg'):
+            candidate = _optimize_jpeg(content)
+        else:
+            return None
+        if candidate is None or len(candidate) >= len(content):
+            return None
+        return candidate if _same_pixels(content, candidate) else None
+    except Exception as e:
+        logger.error(f"Error recompressing KYC file: {str(e)}")
+        return None
+
+
+def _put_bytes(key: str, content: bytes):
+    """Ghi bytes vào storage qua file tạm cùng thư mục upload"""
+    temp_path = UPLOAD_DIR / f".compact-{uuid.uuid4()}.tmp"
+    temp_path.write_bytes(content)
+    try:
+        get_storage().put_file(temp_path, key)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def _same_blob_query(record: Dict, key: str) -> Dict:
+    """Các record cùng nội dung gốc đang trỏ tới key"""
+    query = {"content_hash": record["content_hash"]}
+    if key == blob_key(record["content_hash"], record["extension"]):
+        query["$or"] = [{"blob_key": key}, {"blob_key": {"$exists": False}}]
+    else:
+        query["blob_key"] = key
+    return query
+
+
+async def compact_content(db, executor, records: List[Dict]) -> Dict:
+    """Nén lại blob của các record chưa nén có cùng content_hash
+
+    Idempotent: record đã có compacted_at không được xử lý lại; chạy lại sau
+    khi dừng giữa chừng chỉ tạo lại đúng blob đã có (cùng hash). Chỉ các record
+    được truyền vào được chuyển sang blob mới: submission khác cùng nội dung
+    (vd. đang chờ phân tích) vẫn đọc blob gốc tới khi chính nó được duyệt.
+    Trả về {'files', 'bytes_before', 'bytes_after'}.
+    """
+    storage = get_storage()
+    record = records[0]
+    source_key = record_key(record)
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        content = await asyncio.to_thread(storage.read_bytes, source_key)
+    except Exception as e:
+        logger.error(f"Cannot read KYC blob {source_key}: {e}")
+        return {'files': 0, 'bytes_before': 0, 'bytes_after': 0}
+
+    loop = asyncio.get_running_loop()
+    compressed = await loop.run_in_executor(executor, recompress, content, record['extension'])
+    pending = {"file_id": {"$in": [r["file_id"] for r in records]}, "compacted_at": {"$exists": False}}
+    if compressed is None:
+        await db[FILE_COLLECTION].update_many(pending, {"$set": {"compacted_at": now, "original_size": len(content)}})
+        return {'files': len(records), 'bytes_before': len(content), 'bytes_after': len(content)}
+
+    compressed_hash = hashlib.sha256(compressed).hexdigest()
+    compressed_key = blob_key(compressed_hash, record['extension'])
+    if not await asyncio.to_thread(storage.exists, compressed_key):
+        await asyncio.to_thread(_put_bytes, compressed_key, compressed)
+    await db[FILE_COLLECTION].update_many(pending, {"$set": {
+        "blob_key": compressed_key,
+        "blob_hash": compressed_hash,
+        "size": len(compressed),
+        "original_size": len(content),
+        "compacted_at": now
+    }})
+
+    # Blob gốc chỉ bị xóa khi không còn record nào trỏ tới; chưa xóa được thì chưa tiết kiệm được gì
+    if source_key == compressed_key or await db[FILE_COLLECTION].count_documents(
+        _same_blob_query(record, source_key), limit=1
+    ):
+        return {'files': len(records), 'bytes_before': len(content), 'bytes_after': len(content)}
+    await asyncio.to_thread(storage.delete, source_key)
+    return {'files': len(records), 'bytes_before': len(content), 'bytes_after': len(compressed)}
+
+
+async def archive_content(db, record: Dict) -> int:
+    """Chuyển blob của record (và các record cùng blob) sang tier archive, trả về số record
+
+    Bỏ qua nếu blob còn được dùng bởi file chưa duyệt xong (chưa nén lại).
+    """
+    key = record_key(record)
+    if await db[FILE_COLLECTION].count_documents(
+        {**_same_blob_query(record, key), "compacted_at": {"$exists": False}}, limit=1
+    ):
+        return 0
+    try:
+        archive_key = await asyncio.to_thread(get_storage().archive, key)
+    except Exception as e:
+        logger.error(f"Cannot archive KYC blob {key}: {e}")
+        return 0
+    result = await db[FILE_COLLECTION].update_many(_same_blob_query(record, key), {"$set": {
+        "blob_key": archive_key,
+        "tier": "archive",
+        "archived_at": datetime.now(timezone.utc).isoformat()
+    }})
+    return result.modified_count
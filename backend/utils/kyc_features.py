@@ -0,0 +1,171 @@
+"""Feature vector của từng file KYC và re-scoring không cần decode lại ảnh
+Mỗi file lưu một vector số nhỏ (kyc_feature_vectors). Khi đổi
+kyc_auto_approval_threshold trong SystemSettings, validation_score và quyết
+định của toàn bộ collection được tính lại bằng NumPy (vector hoá trên cả ma
+trận), cùng công thức với KYCDocumentAnalyzer và kyc_worker.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+from utils.kyc_analyzer import KYCDocumentAnalyzer
+
+FEATURE_COLLECTION = "kyc_feature_vectors"
+
+# Thứ tự cột của vector 'v' (None / NaN: stage không chạy hoặc lỗi)
+FEATURE_NAMES = (
+    'width', 'height', 'brightness', 'contrast', 'laplacian_var', 'edge_density',
+    'color_variance', 'aspect_ratio', 'has_document_shape', 'face_count'
+)
+_COLUMN = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+# Ngưỡng mặc định, trùng với SystemSettings
+DEFAULT_AUTO_APPROVAL_THRESHOLD = 80.0
+
+
+def feature_vector(result: Dict) -> List[Optional[float]]:
+    """Vector FEATURE_NAMES lấy từ kết quả validate_document (không đọc lại ảnh)"""
+    quality = result.get('quality_analysis') or {}
+    resolution = quality.get('resolution') or {}
+    doc_type = result.get('document_type') or {}
+    face_info = result.get('face_detection') or {}
+    width, height = resolution.get('width'), resolution.get('height')
+
+    def value(section: Dict, key: str) -> Optional[float]:
+        item = section.get(key)
+        return item.get('value') if isinstance(item, dict) else item
+
+    has_shape = None if doc_type.get('skipped') or 'has_document_shape' not in doc_type else doc_type['has_document_shape']
+    face_count = None if face_info.get('skipped') or face_info.get('error') else face_info.get('face_count')
+    return [
+        width,
+        height,
+        value(quality, 'brightness'),
+        value(quality, 'contrast'),
+        value(quality, 'sharpness'),
+        quality.get('edge_density'),
+        quality.get('color_variance'),
+        # Tính lại từ kích thước: aspect_ratio trong kết quả đã bị làm tròn
+        width / height if width and height else None,
+        None if has_shape is None else float(has_shape),
+        face_count,
+    ]
+
+
+def feature_vector_updates(kyc_id: str, id_type: str, entries: List[Tuple[str, Dict]],
+                           analyzer_version: str) -> List[UpdateOne]:
+    """Các UpdateOne (upsert theo file_id) cho (file_id, validation_result) của một submission"""
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        UpdateOne(
+            {"file_id": file_id},
+            {"$set": {
+                "kyc_id": kyc_id,
+                "face_required": id_type in KYCDocumentAnalyzer.PHOTO_ID_TYPES,
+                "v": feature_vector(result),
+                "analyzer_version": analyzer_version,
+                "updated_at": now
+            }},
+            upsert=True
+        )
+        for file_id, result in entries if not result.get('error')
+    ]
+
+
+async def store_feature_vectors(db, kyc_id: str, id_type: str, entries: List[Tuple[str, Dict]],
+                                analyzer_version: str):
+    """Lưu vector cho các (file_id, validation_result) của một submission (idempotent)"""
+    operations = feature_vector_updates(kyc_id, id_type, entries, analyzer_version)
+    if operations:
+        await db[FEATURE_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def load_feature_matrix(db, query: Optional[Dict] = None,
+                              batch_size: int = 10000) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(kyc_ids, face_required, matrix N x len(FEATURE_NAMES)) cho các file khớp query"""
+    kyc_ids, face_required, rows = [], [], []
+    cursor = db[FEATURE_COLLECTION].find(
+        query or {}, {"_id": 0, "kyc_id": 1, "face_required": 1, "v": 1}
+    ).batch_size(batch_size)
+    async for doc in cursor:
+        kyc_ids.append(doc['kyc_id'])
+        face_required.append(doc.get('face_required', True))
+        rows.append(doc['v'])
+
+    # None -> NaN khi ép kiểu float64
+    matrix = np.array(rows, dtype=np.float64).reshape(len(rows), len(FEATURE_NAMES))
+    return np.array(kyc_ids, dtype=object), np.array(face_required, dtype=bool), matrix
+
+
+def score_features(matrix: np.ndarray, face_required: np.ndarray,
+                   auto_approval_threshold: float = DEFAULT_AUTO_APPROVAL_THRESHOLD) -> Dict[str, np.ndarray]:
+    """Tính lại quality_score, validation_score và quyết định cho từng dòng
+
+    Cùng công thức với analyze_image_quality / detect_document_type / _decision;
+    quality_good của từng file theo GOOD_QUALITY_SCORE của analyzer.
+    Giá trị NaN (stage lỗi, hoặc quality đầy đủ bị short-circuit) tính là không
+    đạt, giống validation_score gốc.
+    """
+    A = KYCDocumentAnalyzer
+    col = {name: matrix[:, i] for name, i in _COLUMN.items()}
+
+    with np.errstate(invalid='ignore'):
+        resolution = np.minimum(100, col['width'] / A.MIN_IMAGE_WIDTH * 50 + col['height'] / A.MIN_IMAGE_HEIGHT * 50)
+        brightness = col['brightness']
+        brightness_ok = (brightness >= A.MIN_BRIGHTNESS) & (brightness <= A.MAX_BRIGHTNESS)
+        brightness_score = np.where(brightness_ok, 100, np.maximum(0, 100 - np.abs(brightness - 127) / 127 * 100))
+        components = {
+            'resolution': resolution,
+            'brightness': brightness_score,
+            'contrast': np.minimum(100, col['contrast'] / 50 * 100),
+            'sharpness': np.minimum(100, col['laplacian_var'] / 300 * 100),
+            'edge': np.minimum(100, col['edge_density'] * 500),
+            'color': np.minimum(100, col['color_variance'] / 1000),
+        }
+        # Component thiếu (quality đầy đủ bị short-circuit) tính 0: cận dưới như
+        # _quality_score_bounds, cũng là giá trị analyzer dùng để quyết định
+        quality_score = sum(np.nan_to_num(components[name]) * weight for name, weight in A.QUALITY_WEIGHTS.items())
+        quality_valid = quality_score >= 40
+        quality_good = quality_score >= A.GOOD_QUALITY_SCORE
+
+        # Giữ đồng bộ với bảng aspect ratio trong detect_document_type
+        aspect = col['aspect_ratio']
+        confidence = np.select(
+            [(aspect >= 1.5) & (aspect <= 1.7), (aspect >= 1.3) & (aspect <= 1.5),
+             (aspect >= 0.6) & (aspect <= 0.8), aspect > 2.0],
+            [85, 80, 75, 70],
+            default=30
+        )
+        confidence = np.where(col['has_document_shape'] == 1, np.minimum(95, confidence + 10), confidence)
+        document_ok = ~np.isnan(col['has_document_shape']) & (confidence >= 70)
+
+        face_ok = np.where(face_required, col['face_count'] == 1, True)
+
+    validation_score = 40 * quality_valid + 30 * document_ok + 30 * face_ok
+    auto_approved = (validation_score >= auto_approval_threshold) & quality_good
+    return {
+        'quality_score': quality_score,
+        'validation_score': validation_score,
+        'auto_approved': auto_approved,
+        'requires_manual_review': (validation_score >= 50) & (validation_score < auto_approval_threshold),
+        'auto_rejected': validation_score < 50,
+    }
+
+
+def score_submissions(kyc_ids: np.ndarray, validation_score: np.ndarray,
+                      auto_approval_threshold: float = DEFAULT_AUTO_APPROVAL_THRESHOLD) -> Dict[str, np.ndarray]:
+    """Điểm trung bình theo submission và quyết định auto-approve, như kyc_worker
+
+    Quyết định của submission chỉ dựa trên điểm trung bình (không xét quality
+    từng file): quality đầy đủ có thể bị short-circuit, quality_score khi đó chỉ
+    là cận dưới.
+    """
+    unique_ids, inverse = np.unique(kyc_ids, return_inverse=True)
+    mean_score = np.bincount(inverse, weights=validation_score) / np.bincount(inverse)
+    return {
+        'kyc_id': unique_ids,
+        'validation_score': mean_score,
+        'auto_approved': mean_score >= auto_approval_threshold,
+    }
@@ -0,0 +1,91 @@
+"""Response stream file KYC: HTTP Range, ETag mạnh, sendfile khi server hỗ trợ
+FileResponse của Starlette (0.37) không hỗ trợ Range nên reviewer phải tải lại
+cả file scan lớn. File được gửi theo đoạn, không bao giờ đọc hết vào bộ nhớ
+Python; nếu ASGI server có extension http.response.zerocopysend thì kernel gửi
+thẳng từ file descriptor (sendfile), không copy qua user space.
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from utils.kyc_file_store import MEDIA_TYPES
+
+CHUNK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive của header Range một đoạn; None nếu không có / không hiểu
+
+    Nhiều đoạn (multipart/byteranges) không được hỗ trợ: trả về cả file như
+    RFC 9110 cho phép. Đoạn nằm ngoài file -> RangeNotSatisfiable.
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start_text, _, end_text = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if not start_text:
+            # bytes=-N: N byte cuối
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+        start = int(start_text)
+        end = min(int(end_text), size - 1) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def file_etag(record: Dict, stat: os.stat_result) -> str:
+    """ETag mạnh theo SHA-256 bytes đang lưu; file cũ chưa có hash dùng size + mtime"""
+    if record.get('blob_hash') or record.get('content_hash'):
+        return f'"{record.get("blob_hash") or record["content_hash"]}"'
+    return f'"{record["file_id"]}-{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+
+class RangeFileResponse(Response):
+    """Gửi [start, end] của file (cả file nếu không có Range) với status 200 / 206"""
+
+    def __init__(self, path: str, size: int, media_type: str,
+                 byte_range: Optional[Tuple[int, int]] = None, headers: Optional[Dict] = None):
+        self.path = path
+        self.start, self.end = byte_range or (0, size - 1)
+        super().__init__(status_code=206 if byte_range else 200, headers=headers, media_type=media_type)
+        self.headers['accept-ranges'] = 'bytes'
+        self.headers['content-length'] = str(self.end - self.start + 1)
+        if byte_range:
+            self.headers['content-range'] = f'bytes {self.start}-{self.end}/{size}'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        count = self.end - self.start + 1
+        if scope.get('method') == 'HEAD' or count <= 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            with open(self.path, 'rb') as file:
+                await send({'type': 'http.response.zerocopysend', 'file': file,
+                            'offset': self.start, 'count': count, 'more_body': False})
+            return
+
+        async with await anyio.open_file(self.path, 'rb') as file:
+            await file.seek(self.start)
+            while count > 0:
+                chunk = await file.read(min(CHUNK_SIZE, count))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': count > 0})
+        if count > 0:
+            # File bị cắt ngắn giữa chừng: đóng body để client không chờ mãi
+            await send({'type': 'http.response.body', 'body': b''})
@@ -0,0 +1,180 @@
+"""Kho file KYC content-addressed, metadata trong Mongo
+File được lưu theo SHA-256 nội dung trong thư mục shard 2 cấp
+(store/ab/cd/abcd...ext): mỗi thư mục chỉ vài chục file kể cả khi có hàng
+triệu file, nội dung trùng nhau chỉ lưu một lần. Collection kyc_files map
+file_id -> hash / extension / size / kích thước ảnh, tra cứu bằng một lần đọc
+theo index thay vì thử exists() từng extension. Bytes nằm trên storage backend
+(kyc_storage: disk local hoặc S3) với key là path tương đối trong STORE_DIR.
+Sau khi nén lại / archive (kyc_compaction) record có blob_key / blob_hash trỏ
+tới bytes thực sự đang lưu; content_hash vẫn là hash của file gốc.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.kyc_storage import get_storage
+
+FILE_COLLECTION = "kyc_files"
+
+UPLOAD_DIR = Path("/app/backend/uploads/kyc")
+STORE_DIR = UPLOAD_DIR / "store"
+# Extension của file KYC cũ (trước store) nằm phẳng trong UPLOAD_DIR
+LEGACY_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf')
+
+MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.pdf': 'application/pdf'
+}
+
+
+def blob_key(content_hash: str, file_ext: str) -> str:
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{file_ext}"
+
+
+def blob_path(content_hash: str, file_ext: str) -> Path:
+    """Path của blob trên disk local (với backend S3: path logic, không có trên disk)"""
+    return STORE_DIR / blob_key(content_hash, file_ext)
+
+
+def document_crop_key(content_hash: str) -> str:
+    """Crop giấy tờ đã nắn phẳng, cạnh blob gốc (backend local: cùng thư mục như trước)"""
+    return blob_key(content_hash, ".document.jpg")
+
+
+def document_crop_temp_path() -> str:
+    """File tạm để analyzer (process pool) ghi crop trước khi đưa vào storage"""
+    return str(UPLOAD_DIR / f".crop-{uuid.uuid4()}.jpg")
+
+
+def store_document_crop(result: Dict, content_hash: str):
+    """Đưa crop analyzer vừa ghi ra file tạm vào storage
+
+    result['document_crop'] được đổi thành {'key', 'width', 'height'}: mọi API
+    replica đọc được qua storage, kể cả kết quả lấy từ analysis cache (cùng hash,
+    cùng key). Crop đã có (cùng nội dung) thì chỉ xóa file tạm.
+    """
+    crop = result.get('document_crop')
+    if not crop or not crop.get('path'):
+        return
+    storage = get_storage()
+    key = document_crop_key(content_hash)
+    if storage.exists(key):
+        os.remove(crop['path'])
+    else:
+        storage.put_file(Path(crop['path']), key, 'image/jpeg')
+    result['document_crop'] = {'key': key, 'width': crop['width'], 'height': crop['height']}
+
+
+async def store_blob(db, temp_path: Path, file_id: str, content_hash: str, file_ext: str, size: int,
+                     user_id: str, header: Optional[Dict] = None) -> Path:
+    """Ghi metadata rồi chuyển file tạm vào storage (local: rename atomic), trả về blob_path
+
+    Nội dung đã có trong store thì chỉ xóa file tạm (dedup). Metadata được ghi
+    trước khi kiểm tra dedup: discard_files đếm reference theo content_hash nên
+    từ lúc này không xóa blob dùng chung nữa; blob đã bị xóa trước đó thì lần
+    kiểm tra exists thấy thiếu và upload lại từ file tạm.
+    """
+    await register_file(db, file_id, content_hash, file_ext, size, user_id, header)
+    storage = get_storage()
+    key = blob_key(content_hash, file_ext)
+    if await asyncio.to_thread(storage.exists, key):
+        await asyncio.to_thread(os.remove, temp_path)
+    else:
+        await asyncio.to_thread(storage.put_file, temp_path, key, MEDIA_TYPES.get(file_ext))
+    return blob_path(content_hash, file_ext)
+
+
+def read_blob(path: str) -> bytes:
+    """Nội dung file theo path trả về từ get_file / job phân tích
+
+    Path trong STORE_DIR được đọc qua storage backend, file cũ ngoài store đọc từ disk.
+    """
+    try:
+        key = Path(path).relative_to(STORE_DIR).as_posix()
+    except ValueError:
+        key = None
+    storage = get_storage()
+    if key is None or storage.local_path(key) is not None:
+        with open(path, "rb") as f:
+            return f.read()
+    return storage.read_bytes(key)
+
+
+async def register_file(db, file_id: str, content_hash: str, file_ext: str, size: int,
+                        user_id: str, header: Optional[Dict] = None) -> Dict:
+    """Ghi metadata của file vừa lưu vào store"""
+    header = header or {}
+    record = {
+        "file_id": file_id,
+        "content_hash": content_hash,
+        "extension": file_ext,
+        "size": size,
+        "format": header.get("format"),
+        "width": header.get("width"),
+        "height": header.get("height"),
+        "user_id": user_id,
+        "storage": get_storage().name,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db[FILE_COLLECTION].update_one({"file_id": file_id}, {"$set": record}, upsert=True)
+    return record
+
+
+def record_key(record: Dict) -> str:
+    """Key của bytes đang lưu cho record (blob đã nén lại / archive nếu có)"""
+    return record.get("blob_key") or blob_key(record["content_hash"], record["extension"])
+
+
+def _with_location(record: Dict) -> Dict:
+    key = record_key(record)
+    return {**record, "key": key, "path": str(STORE_DIR / key)}
+
+
+async def get_file(db, file_id: str) -> Optional[Dict]:
+    """Metadata + 'path' của file; file cũ chưa migrate được tìm trong UPLOAD_DIR"""
+    record = await db[FILE_COLLECTION].find_one({"file_id": file_id}, {"_id": 0})
+    if record:
+        return _with_location(record)
+
+    for ext in LEGACY_EXTENSIONS:
+        path = UPLOAD_DIR / f"{file_id}{ext}"
+        if path.exists():
+            return {"file_id": file_id, "extension": ext, "size": path.stat().st_size, "key": None, "path": str(path)}
+    return None
+
+
+async def get_files(db, file_ids: List[str]) -> Dict[str, Dict]:
+    """get_file cho nhiều file, một query cho các file đã có trong store"""
+    records = {
+        record["file_id"]: _with_location(record)
+        async for record in db[FILE_COLLECTION].find({"file_id": {"$in": file_ids}}, {"_id": 0})
+    }
+    for file_id in file_ids:
+        if file_id not in records:
+            legacy = await get_file(db, file_id)
+            if legacy:
+                records[file_id] = legacy
+    return records
+
+
+async def discard_files(db, file_ids: List[str]):
+    """Xóa metadata của các file; blob chỉ bị xóa khi không còn file nào cùng nội dung"""
+    records = await db[FILE_COLLECTION].find(
+        {"file_id": {"$in": file_ids}}, {"_id": 0, "content_hash": 1, "extension": 1, "blob_key": 1}
+    ).to_list(None)
+    if not records:
+        return
+    await db[FILE_COLLECTION].delete_many({"file_id": {"$in": file_ids}})
+    for record in records:
+        key = record_key(record)
+        if await db[FILE_COLLECTION].count_documents({"content_hash": record["content_hash"]}, limit=1):
+            continue
+        # Blob nén lại của file khác có thể trùng đúng bytes với file này
+        if await db[FILE_COLLECTION].count_documents({"blob_key": key}, limit=1):
+            continue
+        await asyncio.to_thread(get_storage().delete, key)
@@ -0,0 +1,155 @@
+"""Durable job queue cho phân tích KYC (Mongo-backed)
+Job được lease với visibility timeout; worker chết giữa chừng thì job tự được
+lease lại sau khi hết hạn. Lỗi được retry với backoff, quá số lần thì dead-letter.
+"""
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+JOB_COLLECTION = "kyc_analysis_jobs"
+
+KYC_JOB_MAX_ATTEMPTS = int(os.getenv("KYC_JOB_MAX_ATTEMPTS", 5))
+KYC_JOB_LEASE_SECONDS = int(os.getenv("KYC_JOB_LEASE_SECONDS", 120))
+KYC_JOB_RETRY_BACKOFF_SECONDS = int(os.getenv("KYC_JOB_RETRY_BACKOFF_SECONDS", 30))
+
+# Job status: queued -> running -> done
+#                          \-> queued (retry) -> ... -> dead
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_DEAD = "dead"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def enqueue_analysis_job(db, kyc_id: str, user_id: str, id_type: str, files: List[Dict]) -> Dict:
+    """Tạo job phân tích cho một submission
+
+    files: [{'file_id': ..., 'path': ..., 'sha256': ...}]
+    """
+    now = _now().isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "kyc_id": kyc_id,
+        "user_id": user_id,
+        "id_type": id_type,
+        "files": files,
+        "status": JOB_QUEUED,
+        "attempts": 0,
+        "remaining_attempts": KYC_JOB_MAX_ATTEMPTS,
+        "available_at": now,
+        "lease_expires_at": None,
+        "worker_id": None,
+        "last_error": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    await db[JOB_COLLECTION].insert_one(job)
+    job.pop("_id", None)
+    return job
+
+
+async def lease_next_job(db, worker_id: str, lease_seconds: int = KYC_JOB_LEASE_SECONDS) -> Optional[Dict]:
+    """Lease job kế tiếp: job đang chờ đến hạn, hoặc job running đã hết lease"""
+    now = _now()
+    now_iso = now.isoformat()
+    return await db[JOB_COLLECTION].find_one_and_update(
+        {
+            "$or": [
+                {"status": JOB_QUEUED, "available_at": {"$lte": now_iso}},
+                {
+                    "status": JOB_RUNNING,
+                    "lease_expires_at": {"$lte": now_iso},
+                    "remaining_attempts": {"$gt": 0}
+                }
+            ]
+        },
+        {
+            "$set": {
+                "status": JOB_RUNNING,
+                "worker_id": worker_id,
+                "lease_expires_at": (now + timedelta(seconds=lease_seconds)).isoformat(),
+                "updated_at": now_iso
+            },
+            "$inc": {"attempts": 1, "remaining_attempts": -1}
+        },
+        sort=[("available_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def extend_lease(db, job: Dict, lease_seconds: int = KYC_JOB_LEASE_SECONDS) -> bool:
+    """Heartbeat: gia hạn lease nếu job vẫn thuộc worker này"""
+    now = _now()
+    result = await db[JOB_COLLECTION].update_one(
+        {"id": job["id"], "status": JOB_RUNNING, "worker_id": job["worker_id"]},
+        {"$set": {
+            "lease_expires_at": (now + timedelta(seconds=lease_seconds)).isoformat(),
+            "updated_at": now.isoformat()
+        }}
+    )
+    return result.modified_count == 1
+
+
+async def complete_job(db, job: Dict):
+    now_iso = _now().isoformat()
+    await db[JOB_COLLECTION].update_one(
+        {"id": job["id"], "worker_id": job["worker_id"]},
+        {"$set": {
+            "status": JOB_DONE,
+            "lease_expires_at": None,
+            "completed_at": now_iso,
+            "updated_at": now_iso
+        }}
+    )
+
+
+async def fail_job(db, job: Dict, error: str) -> str:
+    """Ghi nhận lỗi: retry với exponential backoff hoặc dead-letter
+
+    Trả về status mới của job.
+    """
+    now = _now()
+    if job["remaining_attempts"] <= 0:
+        new_status = JOB_DEAD
+        update = {"status": JOB_DEAD, "dead_lettered_at": now.isoformat()}
+    else:
+        new_status = JOB_QUEUED
+        delay = KYC_JOB_RETRY_BACKOFF_SECONDS * (2 ** (job["attempts"] - 1))
+        update = {"status": JOB_QUEUED, "available_at": (now + timedelta(seconds=delay)).isoformat()}
+
+    update.update({"lease_expires_at": None, "last_error": error, "updated_at": now.isoformat()})
+    await db[JOB_COLLECTION].update_one(
+        {"id": job["id"], "worker_id": job["worker_id"]},
+        {"$set": update}
+    )
+    return new_status
+
+
+async def dead_letter_expired_jobs(db) -> List[Dict]:
+    """Job running hết lease và đã dùng hết số lần thử (worker crash liên tục)"""
+    now_iso = _now().isoformat()
+    query = {
+        "status": JOB_RUNNING,
+        "lease_expires_at": {"$lte": now_iso},
+        "remaining_attempts": {"$lte": 0}
+    }
+    jobs = await db[JOB_COLLECTION].find(query, {"_id": 0}).to_list(100)
+    for job in jobs:
+        await db[JOB_COLLECTION].update_one(
+            {"id": job["id"], "status": JOB_RUNNING},
+            {"$set": {
+                "status": JOB_DEAD,
+                "dead_lettered_at": now_iso,
+                "lease_expires_at": None,
+                "last_error": job.get("last_error") or "Lease expired too many times",
+                "updated_at": now_iso
+            }}
+        )
+    return jobs
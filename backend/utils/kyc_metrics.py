@@ -0,0 +1,99 @@
+"""Histogram thời gian phân tích KYC theo stage và độ phân giải
+Mỗi (ngày, stage, resolution bucket) là một document đếm theo bucket latency,
+cập nhật bằng $inc nên nhiều worker process / host ghi chung được.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+METRICS_COLLECTION = "kyc_analysis_metrics"
+
+# Cận trên (ms) của các bucket latency, bucket cuối là +inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Cận trên (megapixel) của resolution bucket
+RESOLUTION_BUCKETS_MP = ((1, '<1MP'), (3, '1-3MP'), (6, '3-6MP'), (10, '6-10MP'))
+
+
+def resolution_bucket(width: int, height: int) -> str:
+    megapixels = width * height / 1_000_000
+    for upper, label in RESOLUTION_BUCKETS_MP:
+        if megapixels < upper:
+            return label
+    return '>=10MP'
+
+
+def _bucket_label(ms: float) -> str:
+    for upper in LATENCY_BUCKETS_MS:
+        if ms <= upper:
+            return f"le_{upper}"
+    return "le_inf"
+
+
+def _bucket_upper(label: str) -> float:
+    return float('inf') if label == "le_inf" else float(label[3:])
+
+
+async def record_stage_timings(db, timings: Dict[str, float], width: Optional[int], height: Optional[int]):
+    """Ghi timings_ms của một kết quả validate_document vào histogram"""
+    if not timings:
+        return
+
+    bucket = resolution_bucket(width, height) if width and height else 'unknown'
+    day = datetime.now(timezone.utc).date().isoformat()
+    await db[METRICS_COLLECTION].bulk_write([
+        UpdateOne(
+            {"day": day, "stage": stage, "resolution": bucket},
+            {"$inc": {"count": 1, "sum_ms": ms, f"buckets.{_bucket_label(ms)}": 1}},
+            upsert=True
+        )
+        for stage, ms in timings.items()
+    ], ordered=False)
+
+
+def estimate_quantile(buckets: Dict[str, int], count: int, q: float) -> Optional[float]:
+    """Ước lượng quantile = cận trên của bucket chứa quantile đó"""
+    if not count:
+        return None
+    target = q * count
+    seen = 0
+    for label in sorted(buckets, key=_bucket_upper):
+        seen += buckets[label]
+        if seen >= target:
+            return _bucket_upper(label)
+    return float('inf')
+
+
+async def get_stage_histograms(db, days: int = 7) -> List[Dict]:
+    """Gộp histogram N ngày gần nhất theo (stage, resolution)"""
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date().isoformat()
+    merged: Dict[tuple, Dict] = {}
+    async for doc in db[METRICS_COLLECTION].find({"day": {"$gte": since}}, {"_id": 0}):
+        key = (doc['stage'], doc['resolution'])
+        entry = merged.setdefault(key, {
+            'stage': doc['stage'], 'resolution': doc['resolution'],
+            'count': 0, 'sum_ms': 0.0, 'buckets': {}
+        })
+        entry['count'] += doc.get('count', 0)
+        entry['sum_ms'] += doc.get('sum_ms', 0.0)
+        for label, value in doc.get('buckets', {}).items():
+            entry['buckets'][label] = entry['buckets'].get(label, 0) + value
+
+    results = []
+    for entry in merged.values():
+        count = entry['count']
+        results.append({
+            **entry,
+            'sum_ms': round(entry['sum_ms'], 2),
+            'mean_ms': round(entry['sum_ms'] / count, 2) if count else None,
+            # None: nằm ở bucket +inf (float('inf') không serialize được ra JSON)
+            'p50_ms': _finite(estimate_quantile(entry['buckets'], count, 0.5)),
+            'p95_ms': _finite(estimate_quantile(entry['buckets'], count, 0.95)),
+        })
+    results.sort(key=lambda item: (item['stage'], item['resolution']))
+    return results
+
+
+def _finite(value: Optional[float]) -> Optional[float]:
+    return None if value is None or value == float('inf') else value
@@ -0,0 +1,91 @@
+"""Đọc body multipart/form-data theo stream, không spool
+Với File(...) FastAPI / Starlette đọc hết body ra SpooledTemporaryFile trước khi
+handler chạy: giới hạn kích thước kiểm tra trong handler chỉ có tác dụng sau khi
+client đã gửi xong. iter_multipart() đọc request.stream() và trả dữ liệu từng part
+ngay khi nhận, caller dừng (raise) ngay khi một part vượt giới hạn; bộ nhớ mỗi
+request chỉ một chunk ASGI.
+"""
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
+from starlette.requests import Request
+
+# Event của iter_multipart
+PART_BEGIN = 'part'
+PART_DATA = 'data'
+PART_END = 'end'
+
+
+class MultipartError(Exception):
+    pass
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def iter_multipart(request: Request,
+                         max_body_bytes: Optional[int] = None) -> AsyncIterator[Tuple[str, object]]:
+    """(event, value) theo thứ tự trong body
+
+    PART_BEGIN: (field name, filename hoặc None); PART_DATA: bytes; PART_END: None.
+    max_body_bytes: tổng số byte body tối đa (cả khi không có Content-Length,
+    vd. chunked), vượt thì raise BodyTooLarge.
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or not params.get(b'boundary'):
+        raise MultipartError("Expected multipart/form-data")
+
+    events = []
+    headers: Dict[bytes, bytes] = {}
+    header = {'field': b'', 'value': b''}
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header['field'] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header['value'] += data[start:end]
+
+    def on_header_end():
+        headers[header['field'].lower()] = header['value']
+        header['field'] = header['value'] = b''
+
+    def on_headers_finished():
+        _, options = parse_options_header(headers.get(b'content-disposition', b''))
+        filename = options.get(b'filename')
+        events.append((PART_BEGIN, (
+            options.get(b'name', b'').decode('utf-8', 'replace'),
+            None if filename is None else filename.decode('utf-8', 'replace')
+        )))
+        headers.clear()
+
+    def on_part_data(data: bytes, start: int, end: int):
+        events.append((PART_DATA, data[start:end]))
+
+    def on_part_end():
+        events.append((PART_END, None))
+
+    parser = MultipartParser(params[b'boundary'], {
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if max_body_bytes is not None and received > max_body_bytes:
+                raise BodyTooLarge()
+            parser.write(chunk)
+            for event in events:
+                yield event
+            events.clear()
+        parser.finalize()
+    except MultipartParseError as e:
+        raise MultipartError(str(e))
+    for event in events:
+        yield event
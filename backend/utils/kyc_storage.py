@@ -0,0 +1,274 @@
+"""Storage backend cho blob KYC: disk local hoặc object storage S3-compatible
+Key là path tương đối trong store (ab/cd/<sha256><ext>, xem kyc_file_store).
+Backend S3 (AWS, MinIO, moto server...) hỗ trợ presigned GET / PUT để browser
+tải lên / tải về trực tiếp, API không proxy bytes; upload từ server dùng
+multipart khi file lớn hơn ngưỡng. Các method đều blocking (boto3 / file IO),
+caller async gọi qua asyncio.to_thread.
+
+    KYC_STORAGE_BACKEND=s3 KYC_S3_BUCKET=kyc KYC_S3_ENDPOINT_URL=http://localhost:5000
+"""
+import os
+import shutil
+import base64
+import hashlib
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+KYC_STORAGE_BACKEND = os.getenv("KYC_STORAGE_BACKEND", "local")
+KYC_S3_BUCKET = os.getenv("KYC_S3_BUCKET", "")
+KYC_S3_PREFIX = os.getenv("KYC_S3_PREFIX", "kyc/")
+# Endpoint cho S3-compatible ngoài AWS (MinIO, moto server); rỗng: AWS
+KYC_S3_ENDPOINT_URL = os.getenv("KYC_S3_ENDPOINT_URL") or None
+KYC_S3_REGION = os.getenv("KYC_S3_REGION") or None
+KYC_PRESIGNED_URL_TTL = int(os.getenv("KYC_PRESIGNED_URL_TTL", 900))
+# Upload từ server lớn hơn ngưỡng này chuyển sang multipart (mỗi part cùng kích thước)
+KYC_S3_MULTIPART_THRESHOLD = int(os.getenv("KYC_S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024))
+# Storage class của tier archive trên S3; *_IR (instant retrieval) để presigned GET vẫn dùng được
+KYC_ARCHIVE_STORAGE_CLASS = os.getenv("KYC_ARCHIVE_STORAGE_CLASS", "GLACIER_IR")
+# Tier archive trên disk local: thư mục con của root (mount volume rẻ hơn vào đây)
+ARCHIVE_PREFIX = "archive/"
+# Kích thước mỗi lần đọc khi phải tự tính checksum
+CHECKSUM_READ_SIZE = 8 * 1024 * 1024
+
+
+def sha256_checksum(content_hash: str) -> str:
+    """SHA-256 hex -> base64 (định dạng header x-amz-checksum-sha256)"""
+    return base64.b64encode(bytes.fromhex(content_hash)).decode()
+
+
+class StorageBackend:
+    """Interface chung; backend không hỗ trợ presigned URL trả về None"""
+    name = "base"
+    supports_presigned_urls = False
+
+    def put_file(self, local_path: Path, key: str, content_type: Optional[str] = None):
+        """Chuyển file local vào storage (file local bị xóa / di chuyển)"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> Optional[int]:
+        """Kích thước object, None nếu không tồn tại"""
+        raise NotImplementedError
+
+    def read_bytes(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Nội dung [start, end] (inclusive) của object; end None: tới hết
+
+        Object không tồn tại: FileNotFoundError.
+        """
+        raise NotImplementedError
+
+    def checksum_sha256(self, key: str) -> Optional[str]:
+        """SHA-256 (base64, như sha256_checksum) của object, None nếu không tồn tại
+
+        Mặc định đọc lại toàn bộ object theo đoạn; backend lưu sẵn checksum thì override.
+        """
+        size = self.size(key)
+        if size is None:
+            return None
+        hasher = hashlib.sha256()
+        for start in range(0, size, CHECKSUM_READ_SIZE):
+            hasher.update(self.read_bytes(key, start, min(start + CHECKSUM_READ_SIZE, size) - 1))
+        return base64.b64encode(hasher.digest()).decode()
+
+    def copy(self, source_key: str, key: str):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def archive(self, key: str) -> str:
+        """Chuyển object sang tier archive, trả về key mới (có thể giữ nguyên)"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path trên disk nếu backend là local (stream / sendfile trực tiếp)"""
+        return None
+
+    def presigned_get_url(self, key: str, filename: Optional[str] = None,
+                          content_type: Optional[str] = None) -> Optional[str]:
+        return None
+
+    def presigned_put_url(self, key: str, content_hash: str,
+                          content_type: Optional[str] = None) -> Optional[Dict]:
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Blob nằm trên disk dưới root (mặc định: một node, volume dùng chung)"""
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def local_path(self, key: str) -> Path:
+        return self.root / key
+
+    def put_file(self, local_path: Path, key: str, content_type: Optional[str] = None):
+        path = self.local_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Cùng filesystem: rename atomic; khác filesystem: copy rồi xóa
+        try:
+            os.replace(local_path, path)
+        except OSError:
+            shutil.move(str(local_path), str(path))
+
+    def exists(self, key: str) -> bool:
+        return self.local_path(key).exists()
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self.local_path(key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def read_bytes(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        with open(self.local_path(key), 'rb') as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start + 1)
+
+    def copy(self, source_key: str, key: str):
+        path = self.local_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.local_path(source_key), path)
+
+    def delete(self, key: str):
+        try:
+            self.local_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def archive(self, key: str) -> str:
+        if key.startswith(ARCHIVE_PREFIX):
+            return key
+        archive_key = f"{ARCHIVE_PREFIX}{key}"
+        self.put_file(self.local_path(key), archive_key)
+        return archive_key
+
+
+_NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+
+
+class S3Storage(StorageBackend):
+    """Object storage S3-compatible qua boto3"""
+    name = "s3"
+    supports_presigned_urls = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, client=None):
+        # boto3 chỉ cần khi dùng backend S3
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=KYC_S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=KYC_S3_MULTIPART_THRESHOLD
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def put_file(self, local_path: Path, key: str, content_type: Optional[str] = None):
+        extra_args = {"ContentType": content_type} if content_type else None
+        # upload_file tự chia multipart (song song) khi file > multipart_threshold
+        self.client.upload_file(str(local_path), self.bucket, self._key(key),
+                                ExtraArgs=extra_args, Config=self.transfer_config)
+        os.remove(local_path)
+
+    def _head(self, key: str, **params) -> Optional[Dict]:
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key), **params)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in _NOT_FOUND_CODES:
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> Optional[int]:
+        head = self._head(key)
+        return head["ContentLength"] if head else None
+
+    def read_bytes(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.get_object(**params)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in _NOT_FOUND_CODES:
+                raise FileNotFoundError(key)
+            raise
+
+    def checksum_sha256(self, key: str) -> Optional[str]:
+        # Checksum S3 đã kiểm tra lúc PUT (presigned_put_url); object không có checksum
+        # (S3-compatible không hỗ trợ, upload multipart) thì đọc lại để tính
+        head = self._head(key, ChecksumMode="ENABLED")
+        if head is None:
+            return None
+        checksum = head.get("ChecksumSHA256")
+        if checksum and "-" not in checksum:
+            return checksum
+        return super().checksum_sha256(key)
+
+    def copy(self, source_key: str, key: str):
+        # Copy phía server, bytes không đi qua API; object mới giữ checksum SHA-256
+        self.client.copy_object(Bucket=self.bucket, Key=self._key(key), ChecksumAlgorithm="SHA256",
+                                CopySource={"Bucket": self.bucket, "Key": self._key(source_key)})
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def archive(self, key: str) -> str:
+        # Đổi storage class tại chỗ (copy lên chính nó), key không đổi
+        self.client.copy_object(Bucket=self.bucket, Key=self._key(key),
+                                CopySource={"Bucket": self.bucket, "Key": self._key(key)},
+                                StorageClass=KYC_ARCHIVE_STORAGE_CLASS, MetadataDirective="COPY")
+        return key
+
+    def presigned_get_url(self, key: str, filename: Optional[str] = None,
+                          content_type: Optional[str] = None) -> str:
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if filename:
+            params["ResponseContentDisposition"] = f'inline; filename="{filename}"'
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=KYC_PRESIGNED_URL_TTL)
+
+    def presigned_put_url(self, key: str, content_hash: str,
+                          content_type: Optional[str] = None) -> Dict:
+        """URL + header bắt buộc cho PUT trực tiếp từ browser
+
+        Checksum SHA-256 nằm trong chữ ký: S3 từ chối body có hash khác hash đã khai báo.
+        """
+        checksum = sha256_checksum(content_hash)
+        params = {"Bucket": self.bucket, "Key": self._key(key), "ChecksumSHA256": checksum}
+        headers = {"x-amz-checksum-sha256": checksum}
+        if content_type:
+            params["ContentType"] = content_type
+            headers["Content-Type"] = content_type
+        url = self.client.generate_presigned_url("put_object", Params=params, ExpiresIn=KYC_PRESIGNED_URL_TTL)
+        return {"method": "PUT", "url": url, "headers": headers, "expires_in": KYC_PRESIGNED_URL_TTL}
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> StorageBackend:
+    """Backend theo KYC_STORAGE_BACKEND (local | s3), tạo một lần mỗi process"""
+    from utils.kyc_file_store import STORE_DIR
+
+    if KYC_STORAGE_BACKEND == "s3":
+        if not KYC_S3_BUCKET:
+            raise RuntimeError("KYC_STORAGE_BACKEND=s3 requires KYC_S3_BUCKET")
+        return S3Storage(KYC_S3_BUCKET, KYC_S3_PREFIX, KYC_S3_ENDPOINT_URL, KYC_S3_REGION)
+    return LocalStorage(STORE_DIR)
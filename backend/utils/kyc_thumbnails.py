@@ -0,0 +1,71 @@
+"""Thumbnail nhiều kích thước cho ảnh KYC, tạo lúc upload
+JPEG được decode ở chế độ draft (libjpeg scale DCT 1/2, 1/4, 1/8 ngay khi
+decode) nên không phải giải nén full-res chỉ để thu nhỏ; orientation EXIF
+được áp dụng để thumbnail đúng chiều. File lưu theo SHA-256 nội dung
+(content-addressed): cùng nội dung luôn cùng thumbnail, có thể cache vĩnh viễn.
+Thumbnail nằm trên storage backend (kyc_storage) như blob gốc, mọi API replica
+đều đọc được.
+"""
+import io
+import logging
+import re
+import uuid
+from typing import List, Optional, Union
+
+from PIL import Image, ImageOps
+
+from utils.kyc_file_store import UPLOAD_DIR
+from utils.kyc_storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Prefix key của thumbnail trong storage (backend local: uploads/kyc/store/thumbnails)
+THUMBNAIL_PREFIX = "thumbnails/"
+# Cạnh dài (px) của các thumbnail, từ lớn đến nhỏ
+THUMBNAIL_SIZES = (640, 320, 160)
+THUMBNAIL_QUALITY = 80
+
+_CONTENT_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_content_hash(value: str) -> bool:
+    return bool(_CONTENT_HASH.match(value))
+
+
+def thumbnail_key(content_hash: str, size: int) -> str:
+    """Shard theo 2 ký tự đầu của hash để thư mục không quá lớn"""
+    return f"{THUMBNAIL_PREFIX}{content_hash[:2]}/{content_hash}_{size}.jpg"
+
+
+def generate_thumbnails(source: Union[str, bytes], content_hash: str) -> Optional[List[int]]:
+    """Tạo thumbnail các kích thước THUMBNAIL_SIZES, trả về danh sách size đã có
+
+    source: path hoặc nội dung file. Thumbnail đã có (cùng hash) không tạo lại.
+    None nếu ảnh không đọc được.
+    """
+    storage = get_storage()
+    if all(storage.exists(thumbnail_key(content_hash, size)) for size in THUMBNAIL_SIZES):
+        return list(THUMBNAIL_SIZES)
+
+    tmp_path = UPLOAD_DIR / f".thumbnail-{uuid.uuid4()}.jpg"
+    try:
+        img = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+        # draft chọn hệ số scale DCT lớn nhất mà ảnh vẫn >= kích thước yêu cầu (chỉ JPEG)
+        largest = THUMBNAIL_SIZES[0]
+        img.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+
+        for size in THUMBNAIL_SIZES:
+            # Mỗi size thu nhỏ từ size lớn hơn liền trước, không quay lại ảnh gốc
+            img.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            # Ghi file tạm rồi put_file (local: rename atomic), không ai đọc phải file ghi dở
+            img.save(tmp_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            storage.put_file(tmp_path, thumbnail_key(content_hash, size), 'image/jpeg')
+        return list(THUMBNAIL_SIZES)
+
+    except Exception as e:
+        logger.error(f"Error generating KYC thumbnails for {content_hash}: {str(e)}")
+        return None
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -0,0 +1,145 @@
+"""Upload session cho KYC upload resumable (client mobile, mạng chập chờn)
+Session giữ offset đã nhận; client PUT từng chunk tại offset, mất kết nối thì
+hỏi lại offset và gửi tiếp. Dữ liệu được ghi thẳng vào file tạm trên disk
+local của replica tạo session (node), session hết hạn mà chưa finalize thì bị
+xóa cùng file tạm (gc_upload_sessions).
+Nhiều replica API: load balancer phải route mọi request của một session
+chunked về cùng replica (sticky theo upload_id / header Upload-Node); request
+tới replica khác bị từ chối (421) thay vì ghi vào một file tạm không tồn tại.
+Session 'direct': client PUT thẳng lên object storage (storage_key) bằng
+presigned URL, API không nhận bytes.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from utils.kyc_storage import get_storage
+
+SESSION_COLLECTION = "kyc_upload_sessions"
+
+KYC_UPLOAD_SESSION_TTL_HOURS = int(os.getenv("KYC_UPLOAD_SESSION_TTL_HOURS", 24))
+# Số session đang mở tối đa của một user
+KYC_UPLOAD_MAX_OPEN_SESSIONS = int(os.getenv("KYC_UPLOAD_MAX_OPEN_SESSIONS", 10))
+# Tên replica giữ file tạm của session chunked (mặc định: hostname, ổn định qua restart)
+KYC_UPLOAD_NODE = os.getenv("KYC_UPLOAD_NODE") or socket.gethostname()
+
+# Session status: open -> finalized
+SESSION_OPEN = "open"
+SESSION_FINALIZED = "finalized"
+
+# Session mode: chunked (PUT chunk qua API) hoặc direct (presigned URL tới object storage)
+MODE_CHUNKED = "chunked"
+MODE_DIRECT = "direct"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def count_open_sessions(db, user_id: str) -> int:
+    return await db[SESSION_COLLECTION].count_documents({"user_id": user_id, "status": SESSION_OPEN})
+
+
+async def create_session(db, user_id: str, filename: str, file_ext: str, size: int, temp_path: Optional[str],
+                         upload_id: Optional[str] = None, mode: str = MODE_CHUNKED,
+                         storage_key: Optional[str] = None, sha256: Optional[str] = None) -> Dict:
+    """Tạo session, file tạm (rỗng) do caller tạo ở temp_path
+
+    Session direct không có temp_path (và node): bytes nằm ở storage_key, sha256 do client khai báo.
+    """
+    now = _now()
+    session = {
+        "id": upload_id or str(uuid.uuid4()),
+        "user_id": user_id,
+        "filename": filename,
+        "file_ext": file_ext,
+        "size": size,
+        "offset": 0,
+        "temp_path": temp_path,
+        "node": KYC_UPLOAD_NODE if temp_path else None,
+        "mode": mode,
+        "storage_key": storage_key,
+        "sha256": sha256,
+        "status": SESSION_OPEN,
+        "created_at": now.isoformat(),
+        # datetime (không phải ISO string) để so sánh / sort trong gc_upload_sessions
+        "expires_at": now + timedelta(hours=KYC_UPLOAD_SESSION_TTL_HOURS)
+    }
+    await db[SESSION_COLLECTION].insert_one(session)
+    session.pop("_id", None)
+    return session
+
+
+def is_staged_here(session: Dict) -> bool:
+    """File tạm của session chunked nằm trên disk của replica này (session direct: luôn đúng)"""
+    if not session.get("temp_path"):
+        return True
+    return session.get("node", KYC_UPLOAD_NODE) == KYC_UPLOAD_NODE and os.path.exists(session["temp_path"])
+
+
+async def get_session(db, upload_id: str, user_id: str) -> Optional[Dict]:
+    return await db[SESSION_COLLECTION].find_one({"id": upload_id, "user_id": user_id}, {"_id": 0})
+
+
+async def get_sessions(db, upload_ids: List[str], user_id: str) -> List[Dict]:
+    return await db[SESSION_COLLECTION].find(
+        {"id": {"$in": upload_ids}, "user_id": user_id}, {"_id": 0}
+    ).to_list(None)
+
+
+async def advance_offset(db, session: Dict, old_offset: int, new_offset: int) -> bool:
+    """Ghi nhận đã nhận tới new_offset (chỉ khi offset chưa bị request khác thay đổi)
+
+    Mỗi chunk nhận được gia hạn session.
+    """
+    result = await db[SESSION_COLLECTION].update_one(
+        {"id": session["id"], "status": SESSION_OPEN, "offset": old_offset},
+        {"$set": {
+            "offset": new_offset,
+            "expires_at": _now() + timedelta(hours=KYC_UPLOAD_SESSION_TTL_HOURS)
+        }}
+    )
+    return result.modified_count == 1
+
+
+async def mark_finalized(db, upload_ids: List[str], kyc_id: str) -> int:
+    result = await db[SESSION_COLLECTION].update_many(
+        {"id": {"$in": upload_ids}, "status": SESSION_OPEN},
+        {"$set": {"status": SESSION_FINALIZED, "kyc_id": kyc_id, "finalized_at": _now().isoformat()}}
+    )
+    return result.modified_count
+
+
+async def gc_upload_sessions(db, limit: int = 100) -> int:
+    """Xóa session đã hết hạn (kể cả đã finalize) và file tạm còn sót lại
+
+    Session chunked của replica khác chỉ bị xóa sau thêm một TTL: replica đó
+    tự xóa file tạm trên disk của nó trước (replica đã bị gỡ thì không còn file).
+    Trả về số session đã xóa.
+    """
+    now = _now()
+    expired = await db[SESSION_COLLECTION].find(
+        {"$or": [
+            {"expires_at": {"$lt": now}, "node": {"$in": [KYC_UPLOAD_NODE, None]}},
+            {"expires_at": {"$lt": now - timedelta(hours=KYC_UPLOAD_SESSION_TTL_HOURS)}}
+        ]},
+        {"_id": 0, "id": 1, "status": 1, "temp_path": 1, "storage_key": 1}
+    ).limit(limit).to_list(None)
+    for session in expired:
+        # Session đã finalize: file tạm đã được rename thành file KYC, không xóa
+        if session["status"] != SESSION_OPEN:
+            continue
+        if session.get("temp_path"):
+            try:
+                await asyncio.to_thread(os.remove, session["temp_path"])
+            except FileNotFoundError:
+                pass
+        if session.get("storage_key"):
+            # Object staging của session direct (có thể chưa từng được upload)
+            await asyncio.to_thread(get_storage().delete, session["storage_key"])
+    if expired:
+        await db[SESSION_COLLECTION].delete_many({"id": {"$in": [session["id"] for session in expired]}})
+    return len(expired)
@@ -0,0 +1,91 @@
+"""Near-duplicate index cho ảnh KYC (multi-index hashing trên Mongo)
+pHash 64-bit được chia thành 4 chunk 16-bit, mỗi chunk có index riêng.
+Hai hash cách nhau <= k bit thì ít nhất một chunk cách nhau <= k // 4 bit
+(pigeonhole), nên chỉ cần tra các chunk lân cận rồi lọc lại bằng Hamming
+distance đầy đủ: không phải scan toàn bộ collection.
+"""
+from datetime import datetime, timezone
+from itertools import combinations
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+HASH_COLLECTION = "kyc_image_hashes"
+
+HASH_BITS = 64
+HASH_CHUNKS = 4
+CHUNK_BITS = HASH_BITS // HASH_CHUNKS
+# k tối đa cho phép khi tra cứu (radius mỗi chunk <= 2 -> tối đa 137 giá trị / chunk)
+MAX_SEARCH_DISTANCE = 11
+
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def _split_chunks(hash_hex: str) -> List[int]:
+    value = int(hash_hex, 16)
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(HASH_CHUNKS)]
+
+
+def _chunk_neighbors(chunk: int, radius: int) -> List[int]:
+    """Mọi giá trị chunk cách chunk <= radius bit"""
+    neighbors = [chunk]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            neighbors.append(flipped)
+    return neighbors
+
+
+def image_hash_update(file_id: str, kyc_id: str, user_id: str, hashes: Dict) -> Optional[UpdateOne]:
+    """UpdateOne (upsert theo file_id) cho hash của một file; None nếu không có pHash"""
+    if not hashes.get('phash'):
+        return None
+
+    doc = {
+        "kyc_id": kyc_id,
+        "user_id": user_id,
+        "phash": hashes['phash'],
+        "dhash": hashes.get('dhash'),
+        **{f"p{i}": chunk for i, chunk in enumerate(_split_chunks(hashes['phash']))}
+    }
+    return UpdateOne(
+        {"file_id": file_id},
+        {"$set": doc, "$setOnInsert": {"created_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+
+
+async def index_image_hash(db, file_id: str, kyc_id: str, user_id: str, hashes: Dict):
+    """Thêm / cập nhật hash của một file (idempotent theo file_id)"""
+    update = image_hash_update(file_id, kyc_id, user_id, hashes)
+    if update:
+        await db[HASH_COLLECTION].bulk_write([update])
+
+
+async def find_similar_images(db, phash: str, max_distance: int,
+                              exclude_kyc_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+    """Các file có pHash cách phash <= max_distance bit, gần nhất trước"""
+    max_distance = min(max_distance, MAX_SEARCH_DISTANCE)
+    radius = max_distance // HASH_CHUNKS
+
+    query = {"$or": [
+        {f"p{i}": {"$in": _chunk_neighbors(chunk, radius)}}
+        for i, chunk in enumerate(_split_chunks(phash))
+    ]}
+    if exclude_kyc_id:
+        query["kyc_id"] = {"$ne": exclude_kyc_id}
+
+    matches = []
+    projection = {"_id": 0, "file_id": 1, "kyc_id": 1, "user_id": 1, "phash": 1}
+    async for candidate in db[HASH_COLLECTION].find(query, projection):
+        distance = hamming_distance(phash, candidate['phash'])
+        if distance <= max_distance:
+            matches.append({**candidate, "distance": distance})
+
+    matches.sort(key=lambda match: match['distance'])
+    return matches[:limit]
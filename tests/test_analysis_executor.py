@@ -0,0 +1,30 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils.analysis_executor import AnalysisExecutor  # noqa: E402
+
+
+def test_warm_up_starts_every_worker():
+    executor = AnalysisExecutor(max_workers=2)
+    try:
+        asyncio.run(executor.warm_up())
+        processes = executor._pool._processes
+        assert len(processes) == 2
+        assert all(process.is_alive() for process in processes.values())
+    finally:
+        executor.shutdown()
+
+
+def test_warm_up_failure_is_logged_not_raised(monkeypatch, caplog):
+    executor = AnalysisExecutor(max_workers=1)
+
+    def broken_pool():
+        raise OSError("cannot spawn")
+
+    monkeypatch.setattr(executor, '_get_pool', broken_pool)
+    asyncio.run(executor.warm_up())
+    assert executor._pool is None
+    assert 'warm up failed: cannot spawn' in caplog.text
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from scripts.benchmark_kyc_analyzer import build_corpus  # noqa: E402
+
+
+def _contents(corpus):
+    result = {}
+    for entry in corpus:
+        with open(entry['path'], 'rb') as f:
+            result[os.path.basename(entry['path'])] = f.read()
+    return result
+
+
+def test_corpus_does_not_depend_on_selected_resolutions(tmp_path):
+    (tmp_path / 'all').mkdir()
+    (tmp_path / 'one').mkdir()
+    both = _contents(build_corpus(str(tmp_path / 'all'), ['0.5MP', '2MP']))
+    only = _contents(build_corpus(str(tmp_path / 'one'), ['2MP']))
+    assert only and all(both[name] == content for name, content in only.items())
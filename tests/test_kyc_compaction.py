@@ -0,0 +1,57 @@
+import io
+import os
+import sys
+
+import cv2
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils.kyc_compaction import _png_chunks, recompress  # noqa: E402
+
+
+def _pattern(dtype=np.uint8, maximum=255) -> np.ndarray:
+    # Ảnh có vùng phẳng lớn: nén lại bằng zlib tối ưu chắc chắn nhỏ hơn compress_level=0
+    image = np.zeros((96, 128, 3), dtype=dtype)
+    image[:, 64:] = maximum // 3
+    image[32:64, :, 1] = maximum // 2
+    image[5, 7] = (1, 2, 3)
+    return image
+
+
+def _png(image: Image.Image, **params) -> bytes:
+    output = io.BytesIO()
+    image.save(output, 'PNG', compress_level=0, **params)
+    return output.getvalue()
+
+
+def test_recompress_png_is_pixel_exact():
+    content = _png(Image.fromarray(_pattern()))
+    candidate = recompress(content, '.png')
+    assert candidate is not None and len(candidate) < len(content)
+    decode = lambda data: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(decode(content), decode(candidate))
+
+
+def test_recompress_skips_16_bit_png():
+    ok, encoded = cv2.imencode('.png', _pattern(np.uint16, 65535), [cv2.IMWRITE_PNG_COMPRESSION, 0])
+    assert ok
+    content = encoded.tobytes()
+    assert _png_chunks(content)[0][1][8] == 16
+    assert recompress(content, '.png') is None
+
+
+def test_recompress_keeps_color_chunks():
+    pnginfo = PngInfo()
+    pnginfo.add(b'gAMA', (45455).to_bytes(4, 'big'))
+    pnginfo.add(b'sRGB', b'\x00')
+    pnginfo.add_text('Software', 'scanner')
+    content = _png(Image.fromarray(_pattern()), pnginfo=pnginfo)
+    candidate = recompress(content, '.png')
+    assert candidate is not None
+    chunks = dict(_png_chunks(candidate))
+    assert chunks[b'gAMA'] == (45455).to_bytes(4, 'big')
+    assert chunks[b'sRGB'] == b'\x00'
+    assert chunks[b'tEXt'] == b'Software\x00scanner'
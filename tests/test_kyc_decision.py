@@ -0,0 +1,119 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils.kyc_analyzer import KYCDocumentAnalyzer  # noqa: E402
+
+UNKNOWN = {'quality_valid': None, 'quality_good': None, 'document_ok': None, 'face_ok': None}
+
+
+def test_decision_scores_and_thresholds():
+    assert KYCDocumentAnalyzer._decision(True, True, True, True) == (100, True, False, False)
+    # Điểm đủ nhưng quality dưới mức tốt: không tự duyệt file
+    assert KYCDocumentAnalyzer._decision(True, False, True, True) == (100, False, False, False)
+    assert KYCDocumentAnalyzer._decision(True, True, True, False) == (70, False, True, False)
+    assert KYCDocumentAnalyzer._decision(False, False, True, True) == (60, False, True, False)
+    assert KYCDocumentAnalyzer._decision(True, True, False, False) == (40, False, False, True)
+    assert KYCDocumentAnalyzer._decision(False, False, False, True) == (30, False, False, True)
+
+
+def test_affects_decision_everything_unknown():
+    for check in ('quality_valid', 'quality_good', 'document_ok', 'face_ok'):
+        assert KYCDocumentAnalyzer._affects_decision(dict(UNKNOWN), (check,))
+
+
+def test_affects_decision_known_check_is_not_needed():
+    known = {**UNKNOWN, 'face_ok': True}
+    assert not KYCDocumentAnalyzer._affects_decision(known, ('face_ok',))
+
+
+def test_affects_decision_quality_good_after_failed_document():
+    # Document hỏng: điểm tối đa 70 < 80, quality_good không đổi được quyết định của file
+    known = {'quality_valid': True, 'quality_good': None, 'document_ok': False, 'face_ok': True}
+    assert not KYCDocumentAnalyzer._affects_decision(known, ('quality_good',))
+    known['document_ok'] = True
+    assert KYCDocumentAnalyzer._affects_decision(known, ('quality_good',))
+
+
+def test_affects_decision_ignores_impossible_quality_states():
+    # quality_good kéo theo quality_valid: (good, not valid) không được xét
+    known = {'quality_valid': False, 'quality_good': None, 'document_ok': True, 'face_ok': True}
+    assert not KYCDocumentAnalyzer._affects_decision(known, ('quality_good',))
+
+
+def test_affects_decision_face_after_failed_quality_and_document():
+    # Quyết định của file đã là reject, nhưng face_ok vẫn đổi validation_score (0 / 30)
+    known = {'quality_valid': False, 'quality_good': False, 'document_ok': False, 'face_ok': None}
+    assert not KYCDocumentAnalyzer._affects_decision(known, ('face_ok',))
+
+
+@pytest.fixture
+def image_bytes():
+    ok, encoded = cv2.imencode('.png', np.full((120, 160, 3), 128, dtype=np.uint8))
+    assert ok
+    return encoded.tobytes()
+
+
+def _stub_stages(monkeypatch, calls, quality_valid, document_ok, face_ok, quality_score):
+    def analyze_image_quality(ctx, mode=None, basic_only=False):
+        calls.append('quality_basic' if basic_only else 'quality_full')
+        if basic_only:
+            low, high = (45, 90) if quality_valid else (10, 35)
+            return {'valid': quality_valid, 'quality_score': None, 'quality_score_range': [low, high],
+                    'issues': [], 'partial': True}
+        return {'valid': quality_score >= 40, 'quality_score': quality_score, 'issues': []}
+
+    def detect_document_type(ctx):
+        calls.append('document')
+        return {'type': 'id_card' if document_ok else 'unknown', 'confidence': 85 if document_ok else 30}
+
+    def detect_face(ctx):
+        calls.append('face')
+        return {'face_count': int(face_ok), 'valid_for_id': face_ok}
+
+    monkeypatch.setattr(KYCDocumentAnalyzer, 'analyze_image_quality', staticmethod(analyze_image_quality))
+    monkeypatch.setattr(KYCDocumentAnalyzer, 'detect_document_type', staticmethod(detect_document_type))
+    monkeypatch.setattr(KYCDocumentAnalyzer, 'detect_face', staticmethod(detect_face))
+
+
+def test_validate_document_short_circuit_keeps_score_exact(monkeypatch, image_bytes):
+    # File hỏng quality và document nhưng có mặt: 30 điểm, không phải 0
+    calls = []
+    _stub_stages(monkeypatch, calls, quality_valid=False, document_ok=False, face_ok=True, quality_score=20)
+    result = KYCDocumentAnalyzer.validate_document(image_bytes, 'national_id')
+    assert 'face' in calls
+    assert result['validation_score'] == 30
+    assert result['auto_rejected']
+
+    # Cùng điểm và quyết định như khi chạy đủ mọi stage
+    full = KYCDocumentAnalyzer.validate_document(image_bytes, 'national_id', short_circuit=False)
+    keys = ('validation_score', 'auto_approved', 'requires_manual_review', 'auto_rejected')
+    assert [result[key] for key in keys] == [full[key] for key in keys]
+
+    # Submission 3 file 100 điểm + file này: trung bình 82.5, vẫn đạt ngưỡng 80
+    assert (3 * 100 + result['validation_score']) / 4 == 82.5
+
+
+def test_validate_document_skips_only_quality_metrics(monkeypatch, image_bytes):
+    calls = []
+    _stub_stages(monkeypatch, calls, quality_valid=True, document_ok=False, face_ok=True, quality_score=75)
+    result = KYCDocumentAnalyzer.validate_document(image_bytes, 'national_id')
+    assert calls == ['quality_basic', 'document', 'face']
+    assert result['skipped_stages'] == ['quality_metrics']
+    assert result['validation_checks'][0] == {
+        'check': 'Image Quality', 'passed': True, 'skipped': True, 'quality_score_range': [45, 90]
+    }
+    assert result['validation_score'] == 70
+    assert result['requires_manual_review']
+
+    # Đủ điểm tự duyệt: quality_good quyết định nên phần quality đầy đủ phải chạy
+    calls.clear()
+    _stub_stages(monkeypatch, calls, quality_valid=True, document_ok=True, face_ok=True, quality_score=75)
+    result = KYCDocumentAnalyzer.validate_document(image_bytes, 'national_id')
+    assert 'quality_full' in calls
+    assert result['validation_score'] == 100 and result['auto_approved']
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils.kyc_features import score_features, score_submissions  # noqa: E402
+
+# width, height, brightness, contrast, laplacian_var, edge_density, color_variance, aspect_ratio,
+# has_document_shape, face_count
+GOOD = [2000, 1260, 127, 60, 400, 0.3, 200000, 2000 / 1260, 1, 1]
+# Hỏng quality và document nhưng có đúng một mặt: 30 điểm
+POOR_WITH_FACE = [100, 100, 10, 2, 0, 0, 0, 1.0, 0, 1]
+# Đủ điểm nhưng quality_score dưới GOOD_QUALITY_SCORE (thiếu sharpness / edge / color)
+SOFT = [2000, 1260, 127, 20, np.nan, np.nan, np.nan, 2000 / 1260, 1, 1]
+
+
+def test_score_features_matches_analyzer_decision():
+    matrix = np.array([GOOD, POOR_WITH_FACE, SOFT], dtype=np.float64)
+    files = score_features(matrix, np.ones(3, dtype=bool))
+    assert files['validation_score'].tolist() == [100, 30, 100]
+    assert files['auto_approved'].tolist() == [True, False, False]
+    assert files['auto_rejected'].tolist() == [False, True, False]
+
+
+def test_score_submissions_uses_mean_and_threshold():
+    kyc_ids = np.array(['a', 'a', 'a', 'a', 'b'], dtype=object)
+    scores = np.array([100, 100, 100, 30, 70], dtype=np.float64)
+    rescored = score_submissions(kyc_ids, scores, auto_approval_threshold=80)
+    assert rescored['kyc_id'].tolist() == ['a', 'b']
+    assert rescored['validation_score'].tolist() == [82.5, 70]
+    assert rescored['auto_approved'].tolist() == [True, False]
+    assert not score_submissions(kyc_ids, scores, auto_approval_threshold=85)['auto_approved'].any()
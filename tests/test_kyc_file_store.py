@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils import kyc_file_store  # noqa: E402
+from utils.kyc_file_store import FILE_COLLECTION, blob_key, discard_files, register_file, store_blob  # noqa: E402
+from utils.kyc_storage import LocalStorage  # noqa: E402
+
+CONTENT = b'\xff\xd8\xff' + bytes(range(256)) * 4
+CONTENT_HASH = 'ab' * 32
+KEY = blob_key(CONTENT_HASH, '.jpg')
+
+
+class InterleavedStorage(LocalStorage):
+    """LocalStorage chạy một coroutine trên event loop ngay sau lần exists() đầu tiên"""
+
+    def __init__(self, root, loop, after_exists=None):
+        super().__init__(root)
+        self.loop = loop
+        self.after_exists = after_exists
+
+    def exists(self, key):
+        exists = super().exists(key)
+        if self.after_exists:
+            coroutine, self.after_exists = self.after_exists, None
+            asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+        return exists
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()['kyc_test']
+
+
+def _temp_file(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(CONTENT)
+    return path
+
+
+async def _store_existing(db, tmp_path, storage):
+    # file-a đã có trong store, file-b cùng nội dung đang được upload
+    storage.put_file(_temp_file(tmp_path, 'a.part'), KEY)
+    await register_file(db, 'file-a', CONTENT_HASH, '.jpg', len(CONTENT), 'user-a')
+
+
+def test_discard_after_dedup_check_keeps_blob(db, tmp_path, monkeypatch):
+    async def run():
+        storage = InterleavedStorage(tmp_path / 'store', asyncio.get_running_loop())
+        monkeypatch.setattr(kyc_file_store, 'get_storage', lambda: storage)
+        await _store_existing(db, tmp_path, storage)
+        # discard_files của file-a chạy xong ngay sau khi file-b thấy blob đã có (dedup)
+        storage.after_exists = discard_files(db, ['file-a'])
+        temp_path = _temp_file(tmp_path, 'b.part')
+        await store_blob(db, temp_path, 'file-b', CONTENT_HASH, '.jpg', len(CONTENT), 'user-b')
+        assert not temp_path.exists()
+        assert storage.read_bytes(KEY) == CONTENT
+        assert [r['file_id'] async for r in db[FILE_COLLECTION].find({}, {'_id': 0})] == ['file-b']
+
+    asyncio.run(run())
+
+
+def test_discard_before_register_reuploads_blob(db, tmp_path, monkeypatch):
+    async def run():
+        storage = InterleavedStorage(tmp_path / 'store', asyncio.get_running_loop())
+        monkeypatch.setattr(kyc_file_store, 'get_storage', lambda: storage)
+        await _store_existing(db, tmp_path, storage)
+        # discard_files xóa blob trước khi file-b được ghi metadata
+        await discard_files(db, ['file-a'])
+        assert not storage.exists(KEY)
+        temp_path = _temp_file(tmp_path, 'b.part')
+        await store_blob(db, temp_path, 'file-b', CONTENT_HASH, '.jpg', len(CONTENT), 'user-b')
+        assert storage.read_bytes(KEY) == CONTENT
+
+    asyncio.run(run())
+
+
+def test_discard_keeps_blob_shared_with_other_file(db, tmp_path, monkeypatch):
+    async def run():
+        storage = LocalStorage(tmp_path / 'store')
+        monkeypatch.setattr(kyc_file_store, 'get_storage', lambda: storage)
+        await _store_existing(db, tmp_path, storage)
+        await store_blob(db, _temp_file(tmp_path, 'b.part'), 'file-b', CONTENT_HASH, '.jpg', len(CONTENT), 'user-b')
+        await discard_files(db, ['file-a'])
+        assert storage.exists(KEY)
+        await discard_files(db, ['file-b'])
+        assert not storage.exists(KEY)
+
+    asyncio.run(run())
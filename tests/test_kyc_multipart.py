@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from starlette.requests import Request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils.kyc_multipart import (  # noqa: E402
+    BodyTooLarge, MultipartError, PART_BEGIN, PART_DATA, PART_END, iter_multipart
+)
+
+BOUNDARY = 'kyc-boundary'
+
+
+def _body(parts) -> bytes:
+    body = b''
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else '')
+        body += f'--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n'.encode() + content + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def _request(body: bytes, chunk_size: int = 7, content_type: str = f'multipart/form-data; boundary={BOUNDARY}'):
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    received = []
+
+    async def receive():
+        chunk = chunks[len(received)] if len(received) < len(chunks) else b''
+        received.append(chunk)
+        return {'type': 'http.request', 'body': chunk, 'more_body': len(received) < len(chunks)}
+
+    scope = {'type': 'http', 'method': 'POST', 'headers': [(b'content-type', content_type.encode())]}
+    return Request(scope, receive), received
+
+
+async def _collect(request: Request, max_body_bytes=None):
+    parts = []
+    async for event, value in iter_multipart(request, max_body_bytes):
+        if event == PART_BEGIN:
+            parts.append([value, b''])
+        elif event == PART_DATA:
+            parts[-1][1] += value
+        else:
+            assert event == PART_END
+    return parts
+
+
+def test_iter_multipart_streams_parts():
+    body = _body([('note', None, b'hello'), ('files', 'a.png', b'\x89PNG' * 50), ('files', 'b.jpg', b'\xff\xd8' * 30)])
+    request, _ = _request(body)
+    parts = asyncio.run(_collect(request))
+    assert parts == [
+        [('note', None), b'hello'],
+        [('files', 'a.png'), b'\x89PNG' * 50],
+        [('files', 'b.jpg'), b'\xff\xd8' * 30],
+    ]
+
+
+def test_iter_multipart_stops_reading_when_body_too_large():
+    body = _body([('files', 'a.png', b'x' * 1000)])
+    request, received = _request(body, chunk_size=100)
+    with pytest.raises(BodyTooLarge):
+        asyncio.run(_collect(request, max_body_bytes=300))
+    # Dừng ngay ở chunk đầu tiên vượt giới hạn (400 > 300), phần còn lại không được đọc
+    assert len(received) == 4 < len(body) // 100
+
+
+def test_iter_multipart_rejects_other_content_types():
+    request, _ = _request(b'{}', content_type='application/json')
+    with pytest.raises(MultipartError):
+        asyncio.run(_collect(request))
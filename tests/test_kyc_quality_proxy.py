@@ -0,0 +1,54 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from scripts.benchmark_kyc_analyzer import CORPUS_SEED, RESOLUTIONS, VARIANTS, make_image  # noqa: E402
+from utils.kyc_analyzer import ImageAnalysisContext, KYCDocumentAnalyzer  # noqa: E402
+
+# Sai lệch cho phép giữa proxy và full-res:
+# - sharpness (Laplacian variance) tính đúng trên full-res ở cả hai mode
+# - edge_density: 0.0025 = 1.25 điểm edge score = 0.125 điểm quality_score
+# - quality_score: 0.5 điểm (brightness / contrast / color lấy từ proxy)
+EDGE_DENSITY_TOLERANCE = 0.0025
+QUALITY_SCORE_TOLERANCE = 0.5
+
+
+@pytest.mark.parametrize('resolution', ['2MP', '8MP', '12MP'])
+def test_proxy_quality_matches_full_resolution(resolution):
+    width, height = RESOLUTIONS[resolution]
+    for variant, params in VARIANTS.items():
+        image = make_image(width, height, *params, seed=CORPUS_SEED)
+        full = KYCDocumentAnalyzer.analyze_image_quality(ImageAnalysisContext.from_image(image), 'full')
+        proxy = KYCDocumentAnalyzer.analyze_image_quality(ImageAnalysisContext.from_image(image), 'proxy')
+        assert proxy['sharpness']['value'] == pytest.approx(full['sharpness']['value'], rel=1e-6, abs=0.01), variant
+        assert abs(proxy['edge_density'] - full['edge_density']) <= EDGE_DENSITY_TOLERANCE, variant
+        assert abs(proxy['quality_score'] - full['quality_score']) <= QUALITY_SCORE_TOLERANCE, variant
+
+
+def test_laplacian_var_matches_float64():
+    gray = cv2.cvtColor(make_image(640, 480, *VARIANTS['id_card'], seed=CORPUS_SEED), cv2.COLOR_BGR2GRAY)
+    expected = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    assert KYCDocumentAnalyzer._laplacian_var(gray) == pytest.approx(expected, rel=1e-9)
+
+
+@pytest.mark.parametrize('resolution', ['2MP', '8MP', '12MP'])
+def test_proxy_document_detection_finds_card_frame(resolution):
+    width, height = RESOLUTIONS[resolution]
+    # Khung thẻ do make_image vẽ (kể cả biến thể mờ, nơi Canny full-res không tìm được)
+    card_w, card_h = int(width * 0.7), int(width * 0.7 / 1.58)
+    expected = np.array([(width - card_w) // 2, (height - card_h) // 2, card_w, card_h])
+    for variant, params in VARIANTS.items():
+        result = KYCDocumentAnalyzer.detect_document_type(
+            ImageAnalysisContext.from_image(make_image(width, height, *params, seed=CORPUS_SEED)), 'proxy'
+        )
+        if not params[2]:
+            assert not result['has_document_shape'], variant
+            continue
+        bbox = result['document_bbox']
+        found = np.array([bbox['x'], bbox['y'], bbox['width'], bbox['height']])
+        assert np.abs(found - expected).max() <= 0.01 * width, variant
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+from datetime import timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils.kyc_upload_sessions import (  # noqa: E402
+    KYC_UPLOAD_NODE, KYC_UPLOAD_SESSION_TTL_HOURS, SESSION_COLLECTION, _now, create_session, gc_upload_sessions,
+    is_staged_here
+)
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()['kyc_test']
+
+
+async def _expired_session(db, tmp_path, upload_id, node, hours_ago):
+    temp_path = tmp_path / f'{upload_id}.part'
+    temp_path.touch()
+    session = await create_session(db, 'user-1', 'id.jpg', '.jpg', 10, str(temp_path), upload_id)
+    await db[SESSION_COLLECTION].update_one({'id': upload_id}, {'$set': {
+        'node': node, 'expires_at': _now() - timedelta(hours=hours_ago)
+    }})
+    return {**session, 'node': node}, temp_path
+
+
+def test_chunked_session_is_staged_on_creating_node(db, tmp_path):
+    async def run():
+        temp_path = tmp_path / 'upload.part'
+        temp_path.touch()
+        session = await create_session(db, 'user-1', 'id.jpg', '.jpg', 10, str(temp_path))
+        assert session['node'] == KYC_UPLOAD_NODE
+        assert is_staged_here(session)
+        assert not is_staged_here({**session, 'node': 'other-node'})
+        temp_path.unlink()
+        assert not is_staged_here(session)
+        direct = await create_session(db, 'user-1', 'id.jpg', '.jpg', 10, None, mode='direct', storage_key='incoming/x')
+        assert direct['node'] is None and is_staged_here(direct)
+
+    asyncio.run(run())
+
+
+def test_gc_leaves_other_node_sessions_for_one_more_ttl(db, tmp_path):
+    async def run():
+        _, own_path = await _expired_session(db, tmp_path, 'own', KYC_UPLOAD_NODE, 1)
+        await _expired_session(db, tmp_path, 'other', 'other-node', 1)
+        await _expired_session(db, tmp_path, 'abandoned', 'other-node', KYC_UPLOAD_SESSION_TTL_HOURS + 1)
+        assert await gc_upload_sessions(db) == 2
+        assert not own_path.exists()
+        assert [s['id'] async for s in db[SESSION_COLLECTION].find({}, {'_id': 0, 'id': 1})] == ['other']
+
+    asyncio.run(run())
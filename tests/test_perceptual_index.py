@@ -0,0 +1,65 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from utils.perceptual_index import (  # noqa: E402
+    HASH_COLLECTION, find_similar_images, hamming_distance, image_hash_update, index_image_hash
+)
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()['kyc_test']
+
+
+async def _index_documents(db):
+    return await db[HASH_COLLECTION].find({}, {'_id': 0}).to_list(None)
+
+
+def test_index_image_hash_upserts_chunks(db):
+    async def run():
+        await index_image_hash(db, 'file-1', 'kyc-1', 'user-1', {'phash': '0123456789abcdef', 'dhash': 'ff' * 8})
+        [document] = await _index_documents(db)
+        created_at = document.pop('created_at')
+        assert document == {
+            'file_id': 'file-1', 'kyc_id': 'kyc-1', 'user_id': 'user-1',
+            'phash': '0123456789abcdef', 'dhash': 'ff' * 8,
+            'p0': 0xcdef, 'p1': 0x89ab, 'p2': 0x4567, 'p3': 0x0123
+        }
+
+        # Idempotent theo file_id: cập nhật hash, giữ created_at
+        await index_image_hash(db, 'file-1', 'kyc-2', 'user-1', {'phash': 'fedcba9876543210'})
+        [document] = await _index_documents(db)
+        assert document['kyc_id'] == 'kyc-2' and document['phash'] == 'fedcba9876543210'
+        assert document['p0'] == 0x3210 and document['created_at'] == created_at
+
+    asyncio.run(run())
+
+
+def test_index_image_hash_without_phash(db):
+    async def run():
+        assert image_hash_update('file-1', 'kyc-1', 'user-1', {}) is None
+        await index_image_hash(db, 'file-1', 'kyc-1', 'user-1', {})
+        assert await _index_documents(db) == []
+
+    asyncio.run(run())
+
+
+def test_find_similar_images_from_index(db):
+    async def run():
+        await index_image_hash(db, 'file-1', 'kyc-1', 'user-1', {'phash': '0123456789abcdef'})
+        await index_image_hash(db, 'file-2', 'kyc-2', 'user-2', {'phash': '0123456789abcdee'})
+        await index_image_hash(db, 'file-3', 'kyc-3', 'user-3', {'phash': 'fedcba9876543210'})
+        matches = await find_similar_images(db, '0123456789abcdef', 4, exclude_kyc_id='kyc-1')
+        assert [(match['file_id'], match['distance']) for match in matches] == [('file-2', 1)]
+
+    asyncio.run(run())
+
+
+def test_hamming_distance():
+    assert hamming_distance('0123456789abcdef', '0123456789abcdee') == 1